@@ -44,49 +44,86 @@ for folder in reversed(list(DRIVER_SOURCES.values())):
 del sys
 del folder
 
-# infos
-from .core.infos import infos, config_help
-from .core.infos import _list_devices as list_devices
-from .core.infos import _list_drivers as list_drivers
+# Everything else is imported on first access (PEP 562) so that
+# "import autolab" stays fast: autolab.get_device only imports the devices
+# modules, the GUI is only imported by autolab.gui, ...
+# {public name: (module, attribute name or None for the module itself)}
+_LAZY_ATTRIBUTES = {
+    # infos
+    'infos': ('.core.infos', 'infos'),
+    'config_help': ('.core.infos', 'config_help'),
+    'list_devices': ('.core.infos', '_list_devices'),
+    'list_drivers': ('.core.infos', '_list_drivers'),
+    # Devices
+    'get_device': ('.core.devices', 'get_device'),
+    'get_devices': ('.core.devices', 'get_devices'),
+    'close': ('.core.devices', 'close'),
+    'list_loaded_devices': ('.core.devices', 'list_loaded_devices'),
+    '_devices': ('.core.devices', None),
+    # Drivers
+    'get_driver': ('.core.drivers', 'get_driver'),
+    'explore_driver': ('.core.drivers', 'explore_driver'),
+    '_drivers': ('.core.drivers', None),
+    # Webbrowser shortcuts
+    'report': ('.core.web', 'report'),
+    'doc': ('.core.web', 'doc'),
+    # Server
+    'server': ('.core.server', 'Server'),
+    # GUI
+    'gui': ('.core.gui', 'gui'),
+    'plotter': ('.core.gui', 'plotter'),
+    'monitor': ('.core.gui', 'monitor'),
+    'slider': ('.core.gui', 'slider'),
+    'add_device': ('.core.gui', 'add_device'),
+    'about': ('.core.gui', 'about'),
+    'variables_menu': ('.core.gui', 'variables_menu'),
+    'preferences': ('.core.gui', 'preferences'),
+    'driver_installer': ('.core.gui', 'driver_installer'),
+    # Variables
+    'get_variable': ('.core.variables', 'get_variable'),
+    'list_variables': ('.core.variables', 'list_variables'),
+    'add_variable': ('.core.variables', 'set_variable'),
+    # Repository
+    'install_drivers': ('.core.repository', 'install_drivers'),
+    '_repository': ('.core.repository', None),
+    'create_shortcut': ('.core._create_shortcut', 'create_shortcut'),
+    # Used by os shell to start autolab
+    '_main': ('._entry_script', 'main'),
+}
+
+_drivers_checked = False
+
+
+def __getattr__(name: str):
+    """ Imports the lazy attributes of autolab on first access """
+    global _drivers_checked
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module 'autolab' has no attribute '{name}'")
+
+    import importlib
+    module_name, attribute_name = _LAZY_ATTRIBUTES[name]
+    module = importlib.import_module(module_name, __name__)
+    value = module if attribute_name is None else getattr(module, attribute_name)
+
+    # Deferred from import: install the official drivers if none are found
+    if not _drivers_checked:
+        _drivers_checked = True
+        from .core.repository import _check_empty_driver_folder
+        _check_empty_driver_folder()
+
+    globals()[name] = value  # next accesses don't go through __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
 
-# Devices
-from .core.devices import get_device, close, list_loaded_devices
-from .core import devices as _devices
-
-# Drivers
-from .core.drivers import get_driver, explore_driver
-from .core import drivers as _drivers
-
-# Webbrowser shortcuts
-from .core.web import report, doc
-
-# Server
-from .core.server import Server as server
-
-# GUI
-from .core.gui import (gui, plotter, monitor, slider, add_device, about,
-                       variables_menu, preferences, driver_installer)
-
-from .core.variables import get_variable, list_variables
-from .core.variables import set_variable as add_variable
-
-# Repository
-from .core.repository import install_drivers
-from .core import repository as _repository
-_repository._check_empty_driver_folder()
-
-del numpy
-del socket
-
-from .core._create_shortcut import create_shortcut
 
 if FIRST:
     # Ask if create shortcut
+    from .core._create_shortcut import create_shortcut
     create_shortcut(ask=True)
 del FIRST
 
-# Loading the drivers informations on startup
-_drivers.update_drivers_paths()
-
-# Used by os shell to start autolab
-from ._entry_script import main as _main
+del numpy
+del socket
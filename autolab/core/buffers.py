@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 10:12:37 2026
+
+@author: autolab
+"""
+
+import os
+import threading
+from typing import Any, List, Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+
+NUMERIC_KINDS = 'biuf'  # bool, signed int, unsigned int, float
+
+
+def _value_dtype(value: Any) -> np.dtype:
+    """ Returns the numpy dtype needed to store value in a column """
+    try:
+        array = np.asarray(value)
+    except Exception:
+        return np.dtype(object)
+    if array.ndim != 0 or array.dtype.kind not in NUMERIC_KINDS:
+        return np.dtype(object)
+    return array.dtype
+
+
+def _common_dtype(dtype1: np.dtype, dtype2: np.dtype) -> np.dtype:
+    """ Returns the smallest dtype able to store both dtypes, object if not numerical """
+    if dtype1.kind in NUMERIC_KINDS and dtype2.kind in NUMERIC_KINDS:
+        return np.promote_types(dtype1, dtype2)
+    return np.dtype(object)
+
+
+class ColumnBuffer:
+    """ Append-only columnar storage: one preallocated numpy array per column,
+    grown geometrically so that appending a row costs O(1) amortized.
+    Columns are typed from the first value received and promoted
+    (int -> float -> object) only if a later value doesn't fit. """
+
+    def __init__(self, columns: Iterable[str], capacity: int = 1024,
+                 growth: float = 2.):
+        self.columns = list(dict.fromkeys(columns))  # unique, keep order
+        self._capacity = max(int(capacity), 1)
+        self._growth = max(float(growth), 1.1)
+        self._size = 0
+        self._arrays: Dict[str, np.ndarray] = {
+            column: None for column in self.columns}
+        self._dataframe = None  # cached view, invalidated on append
+
+    def __len__(self) -> int:
+        """ Returns the number of rows stored """
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        """ Returns the number of rows that can be stored before the next growth """
+        return self._capacity
+
+    def _grow(self):
+        """ Reallocates every column with a larger capacity """
+        self._capacity = int(self._capacity * self._growth) + 1
+        for column, array in self._arrays.items():
+            if array is not None:
+                new_array = np.empty(self._capacity, dtype=array.dtype)
+                new_array[: self._size] = array[: self._size]
+                self._arrays[column] = new_array
+
+    def _allocate(self, column: str, dtype: np.dtype):
+        """ Creates the array of column, previous rows are set to missing """
+        if self._size != 0 and dtype.kind in 'biu':
+            dtype = np.dtype(float)  # previous rows are missing -> NaN
+        array = np.empty(self._capacity, dtype=dtype)
+        array[: self._size] = np.nan if dtype.kind in 'fO' else 0
+        self._arrays[column] = array
+
+    def _promote(self, column: str, dtype: np.dtype):
+        """ Changes the dtype of column, keeping its values """
+        array = self._arrays[column]
+        self._arrays[column] = array.astype(dtype)
+
+    def append(self, row: Dict[str, Any]):
+        """ Appends a row given as {column: value}. Unknown columns are ignored,
+        missing columns are set to NaN """
+        self.append_values([row.get(column, np.nan) for column in self.columns])
+
+    def append_values(self, values: List[Any]):
+        """ Appends a row given as a list of values in columns order.
+        Missing values must be given as NaN """
+        if len(values) != len(self.columns):
+            raise ValueError(
+                f"Expected {len(self.columns)} values, got {len(values)}")
+        if self._size == self._capacity:
+            self._grow()
+        index = self._size
+
+        for column, value in zip(self.columns, values):
+            array = self._arrays[column]
+            dtype = _value_dtype(value)
+
+            if array is None:
+                self._allocate(column, dtype)
+            elif (array.dtype != dtype
+                    and not np.can_cast(dtype, array.dtype, 'safe')):
+                self._promote(column, _common_dtype(array.dtype, dtype))
+            self._arrays[column][index] = value
+
+        self._size += 1
+        self._dataframe = None
+
+    def column(self, column: str) -> np.ndarray:
+        """ Returns a view (no copy) of the filled part of column """
+        array = self._arrays[column]
+        if array is None:
+            return np.full(self._size, np.nan)
+        return array[: self._size]
+
+    def row(self, index: int) -> List[Any]:
+        """ Returns the values of the row at index in columns order """
+        if index < 0: index += self._size
+        return [self._arrays[column][index] if self._arrays[column] is not None
+                else np.nan for column in self.columns]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """ Returns a DataFrame built on views of the columns. It is built only
+        when requested and reused until the next append """
+        if self._dataframe is None:
+            self._dataframe = pd.DataFrame(
+                {column: self.column(column) for column in self.columns},
+                columns=self.columns, copy=False)
+        return self._dataframe
+
+    def keep_last(self, size: int):
+        """ Removes the oldest rows, keeping the last size rows. They are moved
+        to new arrays, so views returned before stay valid """
+        size = max(int(size), 0)
+        if size >= self._size: return None
+        start = self._size - size
+        for column, array in self._arrays.items():
+            if array is not None:
+                new_array = np.empty(self._capacity, dtype=array.dtype)
+                new_array[: size] = array[start: self._size]
+                self._arrays[column] = new_array
+        self._size = size
+        self._dataframe = None
+        return None
+
+    def clear(self):
+        """ Removes every row. The arrays are released, then allocated again
+        with the same capacity and typed from the next values appended, so
+        views returned before stay valid """
+        self._size = 0
+        self._arrays = {column: None for column in self.columns}
+        self._dataframe = None
+
+
+class RingBuffer:
+    """ Sliding time window of (x, y) points stored in preallocated numpy arrays.
+    x must be increasing (time), so eviction of the points older than the
+    window length only moves the start index. Live points are always
+    contiguous: x and y are views, without copy. When the end of the arrays
+    is reached, live points are moved to new arrays (previous views stay valid).
+    The window mean and the min/max since the last clear are updated
+    incrementally. """
+
+    def __init__(self, window: float = 10, capacity: int = 1024):
+        self.window = float(window)
+        self._capacity = max(int(capacity), 2)
+        self.clear()
+
+    def clear(self):
+        """ Removes every point """
+        self._x = np.empty(self._capacity, dtype=float)
+        self._y = np.empty(self._capacity, dtype=float)
+        self._start = 0
+        self._end = 0
+        self._sum = 0.
+        self._count = 0  # number of y values in the window that are not NaN
+        self.min = None
+        self.max = None
+
+    def __len__(self) -> int:
+        """ Returns the number of points in the window """
+        return self._end - self._start
+
+    @property
+    def x(self) -> np.ndarray:
+        """ Returns a view of the x values in the window """
+        return self._x[self._start: self._end]
+
+    @property
+    def y(self) -> np.ndarray:
+        """ Returns a view of the y values in the window """
+        return self._y[self._start: self._end]
+
+    @property
+    def mean(self) -> float:
+        """ Returns the mean of the y values in the window, ignoring NaN """
+        return self._sum / self._count if self._count != 0 else np.nan
+
+    def set_window(self, window: float):
+        """ Changes the window length and removes the points now out of it """
+        self.window = float(window)
+        self._evict()
+
+    def _reserve(self, size: int):
+        """ Ensures that size points can be appended after the end """
+        if self._end + size <= len(self._x):
+            return None
+
+        length = len(self)
+        capacity = max(self._capacity, 2*(length+size))
+        x = np.empty(capacity, dtype=float)
+        y = np.empty(capacity, dtype=float)
+        x[: length] = self.x
+        y[: length] = self.y
+        self._x, self._y = x, y
+        self._start, self._end = 0, length
+        self._sum = float(np.nansum(self.y))  # reset rounding error
+        self._count = int(np.count_nonzero(~np.isnan(self.y)))
+        return None
+
+    def append(self, x: float, y: float):
+        """ Appends one point """
+        self._reserve(1)
+        self._x[self._end] = x
+        self._y[self._end] = y
+        self._end += 1
+        if y == y:  # not NaN
+            self._sum += y
+            self._count += 1
+            if self.min is None or y < self.min: self.min = y
+            if self.max is None or y > self.max: self.max = y
+        self._evict()
+
+    def extend(self, x: np.ndarray, y: np.ndarray):
+        """ Appends several points at once """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if len(x) == 0: return None
+        self._reserve(len(x))
+        self._x[self._end: self._end+len(x)] = x
+        self._y[self._end: self._end+len(y)] = y
+        self._end += len(x)
+        valid = int(np.count_nonzero(~np.isnan(y)))
+        if valid != 0:
+            self._sum += float(np.nansum(y))
+            self._count += valid
+            ymin, ymax = float(np.nanmin(y)), float(np.nanmax(y))
+            if self.min is None or ymin < self.min: self.min = ymin
+            if self.max is None or ymax > self.max: self.max = ymax
+        self._evict()
+        return None
+
+    def _evict(self):
+        """ Removes the points older than the window length """
+        if len(self) == 0: return None
+        limit = self._x[self._end-1] - self.window
+        if self._x[self._start] >= limit: return None
+        new_start = self._start + int(np.searchsorted(self.x, limit, side='left'))
+        evicted = self._y[self._start: new_start]
+        self._sum -= float(np.nansum(evicted))
+        self._count -= int(np.count_nonzero(~np.isnan(evicted)))
+        self._start = new_start
+        return None
+
+
+class ArrayStore:
+    """ Append-only binary storage of the arrays of one scan result.
+    Every array is appended to a single file as a .npy record, and its
+    offset in this file is appended to an index file as 'ID offset' lines.
+    An array can be read back, or memory-mapped, without reading the others.
+    Files are <folder>/<name>.npys and <folder>/<name>.index.
+    Arrays can be read by one thread while another one appends """
+
+    def __init__(self, folder: str, name: str):
+        self.path = os.path.join(folder, f'{name}.npys')
+        self.index_path = os.path.join(folder, f'{name}.index')
+        self.offsets: Dict[int, int] = {}  # {ID: offset}
+        self._file = None
+        self._index_file = None
+        self._lock = threading.RLock()
+
+        if os.path.exists(self.index_path):  # reopen an existing store
+            with open(self.index_path, 'r') as f:
+                for line in f:
+                    ID, offset = line.split()
+                    self.offsets[int(ID)] = int(offset)
+
+    def __len__(self) -> int:
+        """ Returns the number of arrays stored """
+        return len(self.offsets)
+
+    def ids(self) -> List[int]:
+        """ Returns the IDs of the arrays stored, in storage order """
+        return list(self.offsets)
+
+    def append(self, ID: int, value: Any) -> int:
+        """ Appends an array (or any value convertible to array).
+        Returns the number of bytes written """
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'ab')
+                self._index_file = open(self.index_path, 'a')
+
+            offset = self._file.seek(0, os.SEEK_END)
+            np.lib.format.write_array(self._file, np.asanyarray(value),
+                                      allow_pickle=True)
+            self._index_file.write(f'{ID} {offset}\n')
+            self.offsets[ID] = offset
+            return self._file.tell() - offset
+
+    def flush(self):
+        """ Writes the buffered data to the files """
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._index_file.flush()
+
+    def close(self):
+        """ Closes the files, they are reopened by the next append """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._index_file.close()
+                self._file = None
+                self._index_file = None
+
+    def read(self, ID: int, mmap: bool = False) -> np.ndarray:
+        """ Returns the array stored for ID. If mmap is True, returns a
+        read-only memory map of the file instead of loading the array
+        (not possible for arrays of python objects) """
+        with self._lock:
+            self.flush()
+            offset = self.offsets[ID]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            if mmap:
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    header = np.lib.format.read_array_header_1_0(f)
+                elif version == (2, 0):
+                    header = np.lib.format.read_array_header_2_0(f)
+                else:
+                    header = None
+                if (header is not None and not header[2].hasobject
+                        and 0 not in header[0]):
+                    shape, fortran_order, dtype = header
+                    return np.memmap(self.path, dtype=dtype, mode='r',
+                                     offset=f.tell(), shape=shape,
+                                     order='F' if fortran_order else 'C')
+                f.seek(offset)
+            return np.lib.format.read_array(f, allow_pickle=True)
@@ -6,9 +6,13 @@ Created on Mon Nov 18 14:53:10 2019
 """
 
 import os
+import io
+import copy
 import tempfile
+import threading
 import configparser
-from typing import List
+from types import MappingProxyType
+from typing import List, Tuple, Mapping
 
 from .paths import PATHS, DRIVER_SOURCES, DRIVER_REPOSITORY
 from .utilities import boolean
@@ -67,14 +71,52 @@ def initialize_local_directory() -> bool:
     return FIRST
 
 
+# Parsed configuration files: {path: ((mtime, size), ConfigParser)}
+# Shared parsers are never returned: the sections are returned as read-only
+# copies (see _read_only), use load_config to get a modifiable copy
+_CONFIG_CACHE = {}
+_CONFIG_CACHE_LOCK = threading.Lock()
+
+
+def _file_signature(path: str) -> Tuple[int, int]:
+    """ Returns (mtime, size) of the file or None if the file doesn't exist """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def invalidate_config_cache(config_name: str = None):
+    """ Removes config_name from the configuration cache (all configs if None).
+    Only needed if a configuration file is modified outside of autolab
+    within the file system mtime resolution """
+    with _CONFIG_CACHE_LOCK:
+        if config_name is None: _CONFIG_CACHE.clear()
+        else: _CONFIG_CACHE.pop(PATHS[config_name], None)
+
+
 def save_config(config_name: str, config: configparser.ConfigParser):
-    """ This function saves the given config parser in the autolab configuration file """
+    """ This function saves the given config parser in the autolab configuration file.
+    The file is only written if its content changes """
+    text = io.StringIO()
+    config.write(text)
+    text = text.getvalue()
+
+    try:
+        with open(PATHS[config_name], 'r') as file:
+            if file.read() == text: return None
+    except (OSError, UnicodeDecodeError):
+        pass
+
     with open(PATHS[config_name], 'w') as file:
-        config.write(file)
+        file.write(text)
+    invalidate_config_cache(config_name)
+    return None
 
 
-def load_config(config_name: str) -> configparser.ConfigParser:
-    """ This function loads the autolab configuration file in a config parser """
+def _parse_config(config_name: str) -> configparser.ConfigParser:
+    """ This function reads the autolab configuration file in a config parser """
     config = configparser.ConfigParser(allow_no_value=True, delimiters='=')  # don't want ':' as delim, needed for path as key
     config.optionxform = str
     try:  # encoding order matter
@@ -86,6 +128,37 @@ def load_config(config_name: str) -> configparser.ConfigParser:
     return config
 
 
+def _get_cached_config(config_name: str) -> configparser.ConfigParser:
+    """ Returns the shared config parser of the configuration file, only parsed
+    again if the file mtime or size changed. Must not be modified """
+    path = PATHS[config_name]
+    signature = _file_signature(path)
+
+    with _CONFIG_CACHE_LOCK:
+        cached = _CONFIG_CACHE.get(path)
+        if signature is not None and cached is not None and cached[0] == signature:
+            return cached[1]
+
+    config = _parse_config(config_name)
+
+    if signature is not None:
+        with _CONFIG_CACHE_LOCK:
+            _CONFIG_CACHE[path] = (signature, config)
+
+    return config
+
+
+def _read_only(section: configparser.SectionProxy) -> Mapping[str, str]:
+    """ Returns a read-only copy of a section of a shared config parser """
+    return MappingProxyType(dict(section))
+
+
+def load_config(config_name: str) -> configparser.ConfigParser:
+    """ This function loads the autolab configuration file in a config parser.
+    Returns a copy that can be modified """
+    return copy.deepcopy(_get_cached_config(config_name))
+
+
 def modify_config(config_name: str, config_dict: dict) -> configparser.ConfigParser:
     """ Returns a modified config file structures using the input dict """
     config = load_config(config_name)
@@ -141,11 +214,15 @@ autolab_dict = {
                        'console': False,
                        },
     'monitor': {'precision': 4,
-                'save_figure': True},
+                'save_figure': True,
+                'queue_size': 100,
+                'queue_policy': 'drop-oldest',
+                },
     'scanner': {'precision': 15,
                 'save_config': True,
                 'save_figure': True,
                 'save_temp': True,
+                'export_arrays_txt': False,
                 'ask_close': True,
                 },
     'directories': {'temp_folder': 'default'},
@@ -158,7 +235,10 @@ def change_autolab_config(config: configparser.ConfigParser):
     """ Save the autolab config file structures with comments """
     config.set('GUI', '# qt_api -> Choose between default, pyqt5, pyside2, pyqt6 and pyside6')
     config.set('GUI', '# theme -> Choose between default and dark')
+    config.set('monitor', '# queue_size -> Maximum number of sample blocks waiting to be displayed')
+    config.set('monitor', '# queue_policy -> Choose between drop-oldest, decimate and block')
     config.set('scanner', '# Think twice before using save_temp = False')
+    config.set('scanner', '# export_arrays_txt -> Also save the arrays as one text file per point (slow)')
     config.set('extra_driver_path', r'# Example: onedrive = C:\Users\username\OneDrive\my_drivers')
     config.set('extra_driver_url_repo', r'# Example: C:\Users\username\OneDrive\my_drivers = https://github.com/my_repo/my_drivers')
 
@@ -212,52 +292,56 @@ def check_autolab_config():
         autolab_config['GUI']['theme'] = str(autolab_dict['GUI']['theme'])
         print('Wrong GUI theme in config, change to default value')
 
+    if autolab_config['monitor']['queue_policy'] not in ('drop-oldest', 'decimate', 'block'):
+        autolab_config['monitor']['queue_policy'] = str(autolab_dict['monitor']['queue_policy'])
+        print('Wrong monitor queue_policy in config, change to default value')
+
     change_autolab_config(autolab_config)
 
 
-def get_config(section_name: str) -> configparser.SectionProxy:
-    ''' Returns section from autolab_config.ini '''
-    config = load_config('autolab_config')
+def get_config(section_name: str) -> Mapping[str, str]:
+    ''' Returns section from autolab_config.ini (read-only) '''
+    config = _get_cached_config('autolab_config')
     assert section_name in config.sections(), f'Missing {section_name} section in autolab_config.ini'
-    return config[section_name]
+    return _read_only(config[section_name])
 
 
-def get_server_config() -> configparser.SectionProxy:
+def get_server_config() -> Mapping[str, str]:
     ''' Returns section server from autolab_config.ini '''
     return get_config('server')
 
 
-def get_GUI_config() -> configparser.SectionProxy:
+def get_GUI_config() -> Mapping[str, str]:
     ''' Returns section qt_api from autolab_config.ini '''
     return get_config('GUI')
 
 
-def get_control_center_config() -> configparser.SectionProxy:
+def get_control_center_config() -> Mapping[str, str]:
     ''' Returns section control_center from autolab_config.ini '''
     return get_config('control_center')
 
 
-def get_monitor_config() -> configparser.SectionProxy:
+def get_monitor_config() -> Mapping[str, str]:
     ''' Returns section monitor from autolab_config.ini '''
     return get_config('monitor')
 
 
-def get_scanner_config() -> configparser.SectionProxy:
+def get_scanner_config() -> Mapping[str, str]:
     ''' Returns section scanner from autolab_config.ini '''
     return get_config('scanner')
 
 
-def get_directories_config() -> configparser.SectionProxy:
+def get_directories_config() -> Mapping[str, str]:
     ''' Returns section directories from autolab_config.ini '''
     return get_config('directories')
 
 
-def get_extra_driver_path_config() -> configparser.SectionProxy:
+def get_extra_driver_path_config() -> Mapping[str, str]:
     ''' Returns section extra_driver_path from autolab_config.ini '''
     return get_config('extra_driver_path')
 
 
-def get_extra_driver_repo_url_config() -> configparser.SectionProxy:
+def get_extra_driver_repo_url_config() -> Mapping[str, str]:
     ''' Returns section extra_driver_url_repo from autolab_config.ini '''
     return get_config('extra_driver_url_repo')
 
@@ -355,12 +439,12 @@ def get_all_devices_configs() -> configparser.ConfigParser:
 
 def list_all_devices_configs() -> List[str]:
     ''' Returns the list of available configuration names '''
-    devices_configs = get_all_devices_configs()
+    devices_configs = _get_cached_config('devices_config')
     return sorted(list(devices_configs.sections()))
 
 
-def get_device_config(config_name) -> configparser.SectionProxy:
-    ''' Returns the config associated with config_name '''
-    assert config_name in list_all_devices_configs(), f"Device configuration {config_name} not found"
-    devices_configs = get_all_devices_configs()
-    return devices_configs[config_name]
+def get_device_config(config_name) -> Mapping[str, str]:
+    ''' Returns the config associated with config_name (read-only) '''
+    devices_configs = _get_cached_config('devices_config')
+    assert config_name in devices_configs.sections(), f"Device configuration {config_name} not found"
+    return _read_only(devices_configs[config_name])
@@ -5,17 +5,122 @@ Created on Thu Jun 13 10:25:49 2019
 @author: quentin.chateiller
 """
 
-from typing import List, Union
-
-from .drivers import get_driver_path, get_driver
+from typing import List, Union, Any
+import time
+import itertools
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .drivers import get_driver_path, get_driver, load_driver_lib
 from .config import list_all_devices_configs, get_device_config
-from .elements import Module, Element
+from .elements import Module, Element, Variable, Action
 
 # Storage of the devices
 DEVICES = {}
+# Flat index of the elements of the loaded devices {address: element}
+ELEMENTS = {}
+
+# =============================================================================
+# DEVICE EXECUTION LANE
+# =============================================================================
+
+# I/O priorities, lower value is executed first
+PRIORITY_SCAN = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_MONITOR = 2
+
+_thread_priority = threading.local()
+
+
+def set_io_priority(priority: int):
+    """ Set the priority of the device calls made by the current thread """
+    _thread_priority.value = int(priority)
+
+
+def get_io_priority() -> int:
+    """ Returns the priority of the device calls made by the current thread """
+    return getattr(_thread_priority, 'value', PRIORITY_DEFAULT)
+
+
+class DeviceLane:
+    """ Serializes the calls to the driver functions of one device.
+    Calls from different threads are executed one at a time, by priority
+    (see set_io_priority) then by arrival order. A call overtaken max_bypass
+    times by calls of higher priority that arrived after it is executed
+    next, so that monitor calls are not starved by a scan. A thread already
+    executing on the lane (driver function using another element of the same
+    device) is not blocked. Different devices have different lanes and run
+    in parallel. """
+
+    def __init__(self, name: str, prioritize: bool = True, max_bypass: int = 8):
+        self.name = name
+        self.prioritize = prioritize
+        self.max_bypass = max_bypass
+
+        self._condition = threading.Condition()
+        self._owner = None
+        self._depth = 0
+        self._waiting = {}  # {(priority, order): times overtaken}
+        self._order = itertools.count()
+
+        self.calls = 0
+        self.total_wait = 0.
+        self.max_wait = 0.
+
+    def execute(self, function, *args) -> Any:
+        """ Calls function(*args) when the lane is free """
+        thread_id = threading.get_ident()
+
+        with self._condition:
+            if self._owner == thread_id:
+                self._depth += 1
+            else:
+                priority = get_io_priority() if self.prioritize else PRIORITY_DEFAULT
+                ticket = (priority, next(self._order))
+                self._waiting[ticket] = 0
+                start = time.perf_counter()
+
+                while self._owner is not None or self._next() != ticket:
+                    self._condition.wait()
+
+                del self._waiting[ticket]
+                for other in self._waiting:
+                    if other[1] < ticket[1]: self._waiting[other] += 1
+                self._owner = thread_id
+                self._depth = 1
+
+                wait = time.perf_counter() - start
+                self.calls += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+
+        try:
+            return function(*args)
+        finally:
+            with self._condition:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._owner = None
+                    self._condition.notify_all()
+
+    def _next(self) -> tuple:
+        """ Returns the ticket of the next waiting call to execute """
+        oldest = min(self._waiting, key=lambda ticket: ticket[1])
+        if self._waiting[oldest] >= self.max_bypass: return oldest
+        return min(self._waiting)
+
+    def queue_depth(self) -> int:
+        """ Returns the number of calls waiting for the lane """
+        return len(self._waiting)
+
+    def stats(self) -> dict:
+        """ Returns the lane statistics (waiting times in seconds) """
+        return {'queue_depth': self.queue_depth(),
+                'calls': self.calls,
+                'mean_wait': self.total_wait / self.calls if self.calls else 0.,
+                'max_wait': self.max_wait}
 
-# After DEVICES to avoid circular import
-from .variables import update_allowed_dict
 
 # =============================================================================
 # DEVICE CLASS
@@ -27,36 +132,48 @@ class Device(Module):
         """ device_config is returned by :meth:`get_final_device_config` """
 
         self.device_config = device_config  # hidden from completion
-        self.driver_path = get_driver_path(device_config["driver"])
+        if device_config["driver"] == 'autolab_server':  # see server.Driver_REMOTE
+            self.driver_path = 'autolab_server'
+        else:
+            self.driver_path = get_driver_path(device_config["driver"])
+        self._lane = DeviceLane(device_name)  # serializes the driver calls
 
         super().__init__(None, {'name': device_name, 'object': instance,
                                 'help': f'Device {device_name} at {self.driver_path}'})
 
+        self._elements_index = self.get_elements_index()
+
     def close(self):
         """ This function close the connection of the current physical device """
         # Remove read and write signals from gui
         try:
             # condition avoid reopenning connection if use close twice
             if self.name in DEVICES:
-                for struc in self.get_structure():
-                    element = get_element_by_address(struc[0])
-                    if struc[1] == 'variable':
+                for element in self._elements_index.values():
+                    if isinstance(element, Variable):
                         element._read_signal = None
                         element._write_signal = None
-                    if struc[1] == 'action':
+                    if isinstance(element, Action):
                         element._write_signal = None
         except: pass
 
-        try: self.instance.close()
+        try: self._lane.execute(self.instance.close)
         except: pass
 
+        for address in self._elements_index:
+            if ELEMENTS.get(address) is self._elements_index[address]:
+                del ELEMENTS[address]
         del DEVICES[self.name]
-        update_allowed_dict()
+
+    def io_stats(self) -> dict:
+        """ Returns the statistics of the device execution lane:
+        queue depth, number of calls, mean and max waiting time """
+        return self._lane.stats()
 
     def __dir__(self):
         """ For auto-completion """
         return (self.list_modules() + self.list_variables()
-                + self.list_actions() + ['driver_path', 'close', 'help', 'instance'])
+                + self.list_actions() + ['driver_path', 'close', 'help', 'instance', 'io_stats'])
 
 
 # =============================================================================
@@ -65,6 +182,9 @@ class Device(Module):
 
 def get_element_by_address(address: str) -> Element:
     """ Returns the Element located at the provided address """
+    element = ELEMENTS.get(address)
+    if element is not None: return element
+
     address_list = address.split('.')
     device_name = address_list[0]
     if device_name in DEVICES:
@@ -73,6 +193,10 @@ def get_element_by_address(address: str) -> Element:
         # This should not be used on autolab closing to avoid access violation due to config opening
         element = get_device(device_name)
 
+    clean_address = '.'.join([device_name] + [
+        address_part.replace(' ', '') for address_part in address_list[1: ]])
+    if clean_address in ELEMENTS: return ELEMENTS[clean_address]
+
     for i, address_part in enumerate(address_list[1: ]):
         address_part = address_part.replace(' ', '')
         if hasattr(element, address_part):
@@ -105,6 +229,30 @@ def get_final_device_config(device_name: str, **kwargs) -> dict:
     return device_config
 
 
+def _open_driver(device_config: dict, gui: Any = None) -> Any:
+    """ Returns the driver instance described by device_config.
+    gui is given to the driver only if its __init__ accepts it """
+    driver_kwargs = {k: v for k, v in device_config.items() if k not in [
+        'driver', 'connection']}
+
+    if gui is not None and device_config['driver'] != 'autolab_server':
+        driver_lib = load_driver_lib(device_config['driver'])
+        if hasattr(driver_lib, 'Driver') and 'gui' in [
+                param.name for param in inspect.signature(
+                    driver_lib.Driver.__init__).parameters.values()]:
+            driver_kwargs['gui'] = gui
+
+    return get_driver(
+        device_config['driver'], device_config['connection'], **driver_kwargs)
+
+
+def _add_device(device_name: str, instance: Any, device_config: dict) -> Device:
+    """ Creates the Device of a driver instance and registers it """
+    DEVICES[device_name] = Device(device_name, instance, device_config)
+    ELEMENTS.update(DEVICES[device_name]._elements_index)
+    return DEVICES[device_name]
+
+
 def get_device(device_name: str, **kwargs) -> Device:
     ''' Returns the Device associated to device_name. Load it if not already done.'''
     device_config = get_final_device_config(device_name, **kwargs)
@@ -113,16 +261,62 @@ def get_device(device_name: str, **kwargs) -> Device:
         assert device_config == DEVICES[device_name].device_config, 'You cannot change the configuration of an existing Device. Close it first & retry, or remove the provided configuration.'
 
     else:
-        instance = get_driver(
-            device_config['driver'], device_config['connection'],
-            **{k: v for k, v in device_config.items() if k not in [
-                'driver', 'connection']})
-        DEVICES[device_name] = Device(device_name, instance, device_config)
-        update_allowed_dict()
+        _add_device(device_name, _open_driver(device_config), device_config)
 
     return DEVICES[device_name]
 
 
+def get_devices(device_names: List[str], max_workers: int = None,
+                raise_error: bool = True, gui: Any = None) -> dict:
+    ''' Returns a dict {device_name: Device}. Devices not already loaded are
+    opened concurrently, one thread per driver (up to max_workers), so the
+    waiting time is the one of the slowest device instead of the sum of all.
+    An error opening one device doesn't stop the others: if raise_error is
+    True, an exception listing every failure is raised once all threads are
+    done (devices opened successfully stay loaded), otherwise the failing
+    devices are returned with their exception instead of a Device.'''
+    device_names = list(dict.fromkeys(device_names))  # unique, keep order
+    results = {}
+    to_open = {}
+
+    for device_name in device_names:
+        try:
+            device_config = get_final_device_config(device_name)
+            if device_name in DEVICES:
+                assert device_config == DEVICES[device_name].device_config, 'You cannot change the configuration of an existing Device. Close it first & retry, or remove the provided configuration.'
+                results[device_name] = DEVICES[device_name]
+            else:
+                to_open[device_name] = device_config
+        except Exception as e:
+            results[device_name] = e
+
+    if len(to_open) != 0:
+        if max_workers is None: max_workers = len(to_open)
+        with ThreadPoolExecutor(max_workers=max(int(max_workers), 1),
+                                thread_name_prefix='autolab_open') as executor:
+            futures = {device_name: executor.submit(
+                _open_driver, device_config, gui)
+                for device_name, device_config in to_open.items()}
+
+        # Devices are created in the calling thread once all drivers are opened
+        for device_name, future in futures.items():
+            try:
+                results[device_name] = _add_device(
+                    device_name, future.result(), to_open[device_name])
+            except Exception as e:
+                results[device_name] = e
+
+    results = {device_name: results[device_name] for device_name in device_names}
+
+    errors = {device_name: result for device_name, result in results.items()
+              if isinstance(result, Exception)}
+    if raise_error and len(errors) != 0:
+        raise RuntimeError('Error opening device(s):\n' + '\n'.join(
+            f"{device_name}: {error}" for device_name, error in errors.items()))
+
+    return results
+
+
 # =============================================================================
 # DEVICES LIST HELP
 # =============================================================================
@@ -6,9 +6,14 @@ Created on Tue Oct  1 17:38:15 2019
 """
 import os
 import sys
+import ast
+import json
+import hashlib
 import inspect
 import importlib
-from typing import Type, List, Tuple
+import threading
+from typing import Type, List, Tuple, Any
+from contextlib import contextmanager
 from types import ModuleType
 
 from .paths import PATHS, DRIVERS_PATHS, DRIVER_SOURCES
@@ -18,39 +23,94 @@ from .paths import PATHS, DRIVERS_PATHS, DRIVER_SOURCES
 # DRIVERS INSTANTIATION
 # =============================================================================
 
+# Loading a driver changes the state of the process (sys.path, sys.modules,
+# working directory): it is serialized between the threads opening devices
+# (see devices.get_devices), only the instantiation of the drivers
+# (connection) runs in parallel. The helper modules imported from a driver
+# folder are removed from sys.modules once loaded, so that drivers with
+# helper modules of the same name don't share them (see _driver_imports)
+_LOAD_LOCK = threading.RLock()
+_SYS_PATH_USERS = {}  # {directory added to sys.path: [users, added]}
+
+
+@contextmanager
+def _sys_path(directory: str):
+    ''' Adds directory to sys.path while in use (by any thread) '''
+    with _LOAD_LOCK:
+        users = _SYS_PATH_USERS.get(directory)
+        if users is None:
+            users = _SYS_PATH_USERS[directory] = [0, directory not in sys.path]
+            if users[1]: sys.path.append(directory)
+        users[0] += 1
+    try:
+        yield
+    finally:
+        with _LOAD_LOCK:
+            users[0] -= 1
+            if users[0] == 0:
+                del _SYS_PATH_USERS[directory]
+                if users[1] and directory in sys.path:
+                    sys.path.remove(directory)
+                # modules imported by the drivers during their instantiation
+                for name in _modules_in([directory]):
+                    del sys.modules[name]
+
+
+def _modules_in(directories: List[str]) -> List[str]:
+    ''' Returns the names of the modules of sys.modules imported from files
+    in directories (or their sub-folders) '''
+    directories = tuple(os.path.join(os.path.abspath(directory), '')
+                        for directory in directories)
+    if not directories: return []
+    return [name for name, module in list(sys.modules.items())
+            if isinstance(getattr(module, '__file__', None), str)
+            and os.path.abspath(module.__file__).startswith(directories)]
+
+
+@contextmanager
+def _driver_imports(directory: str):
+    ''' Isolates the imports of a driver of directory from the other drivers:
+    the modules of the other driver folders in use are hidden from
+    sys.modules meanwhile, and the ones imported from directory are removed
+    from it after (the driver keeps its references). Holds _LOAD_LOCK '''
+    with _LOAD_LOCK:
+        others = [other for other in _SYS_PATH_USERS if other != directory]
+        hidden = {name: sys.modules.pop(name) for name in _modules_in(others)}
+        try:
+            yield
+        finally:
+            for name in _modules_in([directory]):
+                del sys.modules[name]
+            sys.modules.update(hidden)
+
+
 def get_driver(driver_name: str, connection: str, **kwargs) -> Type:
     ''' Returns a driver instance using configuration provided in kwargs '''
     if driver_name == 'autolab_server':
         from .server import Driver_REMOTE  # avoid circular import
         driver_instance = Driver_REMOTE(**kwargs)
     else:
-        assert driver_name in list_drivers(), f"Driver {driver_name} not found in autolab's drivers"
-        driver_lib = load_driver_lib(driver_name)
+        with _LOAD_LOCK:
+            assert driver_name in list_drivers(), f"Driver {driver_name} not found in autolab's drivers"
+            driver_lib = load_driver_lib(driver_name)
+            driver_class = get_connection_class(driver_lib, connection)
         # Need to add the driver path to allow driver imports from its folder (and only his own, not other drivers)
-        driver_path = os.path.dirname(driver_lib.__file__)
-        if driver_path not in sys.path:
-            sys.path.append(driver_path)
-        try:
-            driver_instance = get_connection_class(driver_lib, connection)(**kwargs)
-        finally:
-            sys.path.remove(driver_path)
+        with _sys_path(os.path.dirname(driver_lib.__file__)):
+            driver_instance = driver_class(**kwargs)
 
     return driver_instance
 
 
 def load_driver_lib(driver_name: str) -> ModuleType:
     ''' Returns a driver library that contains Driver, Driver_XXX, Module_XXX '''
-    # Loading preparation
-    driver_path = get_driver_path(driver_name)
-    driver_directory = os.path.dirname(driver_path)
+    with _LOAD_LOCK:
+        # Loading preparation
+        driver_path = get_driver_path(driver_name)
 
-    if driver_directory not in sys.path:
-        sys.path.append(driver_directory)
-    try:
         # Load library
-        driver_lib = load_lib(driver_path)
-    finally:
-        sys.path.remove(driver_directory)
+        directory = os.path.dirname(driver_path)
+        with _sys_path(directory), _driver_imports(directory):
+            driver_lib = load_lib(driver_path)
 
     return driver_lib
 
@@ -59,20 +119,21 @@ def load_lib(lib_path: str) -> ModuleType:
     ''' Returns an instance of the python script located at lib_path '''
     lib_name = os.path.basename(lib_path).split('.')[0]
 
-    # Save current working directory path
-    curr_dir = os.getcwd()
+    with _LOAD_LOCK:
+        # Save current working directory path
+        curr_dir = os.getcwd()
 
-    # Go to the driver's directory (in case it contains absolute imports)
-    os.chdir(os.path.dirname(lib_path))
+        # Go to the driver's directory (in case it contains absolute imports)
+        os.chdir(os.path.dirname(lib_path))
 
-    try:
-        # Load the module
-        spec = importlib.util.spec_from_file_location(lib_name, lib_path)
-        lib = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(lib)
-    finally:
-        # Come back to previous working directory
-        os.chdir(curr_dir)
+        try:
+            # Load the module
+            spec = importlib.util.spec_from_file_location(lib_name, lib_path)
+            lib = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(lib)
+        finally:
+            # Come back to previous working directory
+            os.chdir(curr_dir)
 
     return lib
 
@@ -95,21 +156,22 @@ def load_utilities_lib(lib_path: str) -> ModuleType:
     ''' Returns an instance of the python script located at lib_path '''
     lib_name = os.path.basename(lib_path).split('.')[0]
 
-    # Save current working directory path
-    curr_dir = os.getcwd()
+    with _LOAD_LOCK:
+        # Save current working directory path
+        curr_dir = os.getcwd()
 
-    # Go to the driver's directory (in case it contains absolute imports)
-    os.chdir(os.path.dirname(lib_path))
+        # Go to the driver's directory (in case it contains absolute imports)
+        os.chdir(os.path.dirname(lib_path))
 
-    # Load the module
-    lib_name = lib_name + '_utilities'
-    spec = importlib.util.spec_from_file_location(
-        lib_name, os.path.join(os.path.dirname(lib_path), f'{lib_name}.py'))
-    lib = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(lib)
+        # Load the module
+        lib_name = lib_name + '_utilities'
+        spec = importlib.util.spec_from_file_location(
+            lib_name, os.path.join(os.path.dirname(lib_path), f'{lib_name}.py'))
+        lib = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(lib)
 
-    # Come back to previous working directory
-    os.chdir(curr_dir)
+        # Come back to previous working directory
+        os.chdir(curr_dir)
 
     return lib
 
@@ -146,24 +208,9 @@ def get_connection_names(driver_lib: ModuleType) -> List[str]:
 
 
 def get_driver_category(driver_name: str) -> str:
-    ''' Returns the driver's category from class Driver '''
-    for filename in ('', '_utilities'):
-
-        driver_utilities_path = os.path.join(
-            os.path.dirname(get_driver_path(driver_name)), f'{driver_name}{filename}.py')
-        category = 'Unknown'
-
-        if os.path.exists(driver_utilities_path):
-            try:
-                driver_utilities = load_lib(driver_utilities_path)
-            except Exception as e:
-                print(f"Can't load {driver_name}: {e}", file=sys.stderr)
-            else:
-                if hasattr(driver_utilities, 'category'):
-                    category = driver_utilities.category
-                    break
-
-    return category
+    ''' Returns the driver's category, read from the driver index (without
+    executing the driver) '''
+    return get_driver_infos(driver_name)['category']
 
 
 def get_driver_class(driver_lib: ModuleType) -> Type:
@@ -435,8 +482,11 @@ def get_class_args(clas: Type) -> dict:
 def get_driver_path(driver_name: str) -> str:
     ''' Returns the config associated with driver_name '''
     assert isinstance(driver_name, str), "drive_name must be a string."
-    assert driver_name in DRIVERS_PATHS, f'Driver {driver_name} not found.'
-    return DRIVERS_PATHS[driver_name]['path']
+    with _LOAD_LOCK:
+        if driver_name not in DRIVERS_PATHS:
+            update_drivers_paths()  # drivers are only scanned on first use
+        assert driver_name in DRIVERS_PATHS, f'Driver {driver_name} not found.'
+        return DRIVERS_PATHS[driver_name]['path']
 
 
 def load_drivers_paths() -> dict:
@@ -449,22 +499,242 @@ def load_drivers_paths() -> dict:
         if not os.path.isdir(source_path):
             print(f"Warning, can't found driver folder: {source_path}")
             continue
-        for driver_name in os.listdir(source_path):
-            temp_path = os.path.join(source_path, driver_name)
-            if (os.path.isdir(temp_path)
-                    and f'{driver_name}.py' in os.listdir(temp_path)):
-                ## Before, raised error if two identical drivers in different folders, I thought of putting a warning message instead but there was too much printing, now don't say that overwrite path (don't overwrite file).
-                # if driver_name in drivers_paths.keys():
-                #     print(f"Two drivers where found with the name '{driver_name}', will use path {source_name}")
-                # assert driver_name not in drivers_paths.keys(), f"Two drivers where found with the name '{driver_name}'. Each driver must have a unique name."
-                drivers_paths[driver_name] = {
-                    'path': os.path.join(temp_path, f'{driver_name}.py'),
-                    'source': source_name}
+        with os.scandir(source_path) as entries:
+            for entry in entries:
+                driver_name = entry.name
+                driver_path = os.path.join(entry.path, f'{driver_name}.py')
+                if entry.is_dir() and os.path.isfile(driver_path):
+                    ## Before, raised error if two identical drivers in different folders, I thought of putting a warning message instead but there was too much printing, now don't say that overwrite path (don't overwrite file).
+                    # if driver_name in drivers_paths.keys():
+                    #     print(f"Two drivers where found with the name '{driver_name}', will use path {source_name}")
+                    # assert driver_name not in drivers_paths.keys(), f"Two drivers where found with the name '{driver_name}'. Each driver must have a unique name."
+                    drivers_paths[driver_name] = {
+                        'path': driver_path, 'source': source_name}
 
     return drivers_paths
 
 
 def update_drivers_paths():
     ''' Update list of available driver '''
-    DRIVERS_PATHS.clear()
-    DRIVERS_PATHS.update(load_drivers_paths())
+    drivers_paths = load_drivers_paths()
+    with _LOAD_LOCK:
+        DRIVERS_PATHS.clear()
+        DRIVERS_PATHS.update(drivers_paths)
+
+
+# =============================================================================
+# DRIVERS INDEX
+# =============================================================================
+# The metadata of the drivers (category, connections, modules, arguments) are
+# extracted by parsing their python files, without executing them, and saved in
+# PATHS['drivers_index'] with the mtime, size and hash of the parsed files.
+# Only the drivers whose files changed are parsed again.
+
+DRIVERS_INDEX_VERSION = 1
+_DRIVERS_INDEX = None  # {driver_path: infos}, loaded from disk on first use
+_DRIVERS_INDEX_LOCK = threading.RLock()
+
+
+def _file_hash(path: str) -> str:
+    """ Returns the sha1 of the content of the file at path """
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _literal(node: ast.AST, source: str) -> Any:
+    """ Returns the value of a default argument, or its source code if it is
+    not a literal that can be saved in json """
+    try:
+        value = ast.literal_eval(node)
+    except Exception:
+        return _unparse(node, source)
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    return _unparse(node, source)
+
+
+def _unparse(node: ast.AST, source: str) -> str:
+    """ Returns the source code of node, taken from source (the text of the
+    parsed file) if ast.unparse is not available (python < 3.9) """
+    if hasattr(ast, 'unparse'): return ast.unparse(node)
+    return ast.get_source_segment(source, node)
+
+
+def _get_init_args(class_node: ast.ClassDef, source: str) -> dict:
+    """ Returns the optional arguments of the __init__ of a class with their
+    default values, like get_class_args """
+    for node in class_node.body:
+        if isinstance(node, ast.FunctionDef) and node.name == '__init__':
+            args = node.args
+            positional = args.posonlyargs + args.args
+            kwargs = {arg.arg: _literal(default, source) for arg, default in zip(
+                positional[len(positional)-len(args.defaults):], args.defaults)}
+            kwargs.update({arg.arg: _literal(default, source) for arg, default in zip(
+                args.kwonlyargs, args.kw_defaults) if default is not None})
+            return kwargs
+    return {}
+
+
+def _get_category(tree: ast.Module, source: str) -> Any:
+    """ Returns the value of the module variable category if any """
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            targets = node.targets
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            targets = [node.target]
+        else:
+            continue
+        for target in targets:
+            if isinstance(target, ast.Name) and target.id == 'category':
+                value = _literal(node.value, source)
+                return value if isinstance(value, str) else None
+    return None
+
+
+def parse_driver_file(driver_path: str) -> dict:
+    ''' Returns the metadata of the driver located at driver_path, found by
+    static analysis of its python file and of its _utilities file '''
+    driver_name = os.path.basename(driver_path)[: -len('.py')]
+    infos = {'name': driver_name, 'path': driver_path, 'category': 'Unknown',
+             'connections': {}, 'modules': [], 'driver_args': {}}
+
+    with open(driver_path, 'rb') as f:
+        source = f.read()
+    tree = ast.parse(source, filename=driver_path)
+    source = source.decode('utf-8', errors='replace')
+
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef): continue
+        if node.name == 'Driver':
+            infos['driver_args'] = _get_init_args(node, source)
+        elif node.name.startswith('Driver_'):
+            infos['connections'][node.name.split('_')[1]] = _get_init_args(
+                node, source)
+        elif node.name.startswith('Module_'):
+            infos['modules'].append(node.name.split('_')[1])
+
+    # Same order as the previous get_driver_category: driver then utilities
+    category = _get_category(tree, source)
+    if category is None:
+        utilities_path = _utilities_path(driver_path)
+        if os.path.exists(utilities_path):
+            with open(utilities_path, 'rb') as f:
+                source = f.read()
+            category = _get_category(
+                ast.parse(source, filename=utilities_path),
+                source.decode('utf-8', errors='replace'))
+    if category is not None:
+        infos['category'] = category
+
+    return infos
+
+
+def _utilities_path(driver_path: str) -> str:
+    """ Returns the path of the _utilities file of a driver """
+    return driver_path[: -len('.py')] + '_utilities.py'
+
+
+def _load_drivers_index() -> dict:
+    """ Returns the index saved on disk, empty if missing or outdated """
+    try:
+        with open(PATHS['drivers_index'], 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if index.get('version') != DRIVERS_INDEX_VERSION:
+        return {}
+    return index.get('drivers', {})
+
+
+def _save_drivers_index():
+    """ Writes the index on disk (atomic replace) """
+    temp_path = PATHS['drivers_index'] + '.tmp'
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump({'version': DRIVERS_INDEX_VERSION,
+                       'drivers': _DRIVERS_INDEX}, f)
+        os.replace(temp_path, PATHS['drivers_index'])
+    except OSError:
+        pass  # index is only a cache, drivers are parsed again next time
+
+
+def _update_driver_entry(driver_path: str) -> bool:
+    """ Parses again the driver at driver_path if one of its files changed.
+    Returns True if the index has been modified """
+    files = {}
+    for path in (driver_path, _utilities_path(driver_path)):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files[path] = [stat.st_mtime_ns, stat.st_size, None]
+
+    entry = _DRIVERS_INDEX.get(driver_path)
+    if entry is not None:
+        old_files = entry['files']
+        if set(old_files) == set(files) and all(
+                old_files[path][: 2] == files[path][: 2] for path in files):
+            return False  # same mtime and size
+
+    for path in files:
+        files[path][2] = _file_hash(path)
+
+    if entry is not None and {path: value[2] for path, value in old_files.items()
+                              } == {path: value[2] for path, value in files.items()}:
+        entry['files'] = files  # touched but same content
+        return True
+
+    try:
+        infos = parse_driver_file(driver_path)
+    except Exception as e:
+        print(f"Can't parse {driver_path}: {e}", file=sys.stderr)
+        infos = {'name': os.path.basename(driver_path)[: -len('.py')],
+                 'path': driver_path, 'category': 'Unknown',
+                 'connections': {}, 'modules': [], 'driver_args': {}}
+    infos['files'] = files
+    _DRIVERS_INDEX[driver_path] = infos
+    return True
+
+
+def get_drivers_index() -> dict:
+    ''' Returns the metadata of every available driver as {driver_name: infos}.
+    infos contains the name, path, source, category, connections (with their
+    optional arguments), modules and driver_args of the driver. Only the
+    drivers modified since the last call are parsed again. '''
+    global _DRIVERS_INDEX
+    update_drivers_paths()
+
+    with _DRIVERS_INDEX_LOCK:
+        if _DRIVERS_INDEX is None:
+            _DRIVERS_INDEX = _load_drivers_index()
+
+        modified = False
+        for driver_path in [val['path'] for val in DRIVERS_PATHS.values()]:
+            modified |= _update_driver_entry(driver_path)
+
+        driver_paths = {val['path'] for val in DRIVERS_PATHS.values()}
+        for driver_path in list(_DRIVERS_INDEX):
+            if driver_path not in driver_paths:
+                _DRIVERS_INDEX.pop(driver_path)
+                modified = True
+
+        if modified: _save_drivers_index()
+
+        return {driver_name: dict(_DRIVERS_INDEX[val['path']],
+                                  source=val['source'])
+                for driver_name, val in DRIVERS_PATHS.items()}
+
+
+def get_driver_infos(driver_name: str) -> dict:
+    ''' Returns the metadata of one driver, see get_drivers_index '''
+    global _DRIVERS_INDEX
+    driver_path = get_driver_path(driver_name)
+
+    with _DRIVERS_INDEX_LOCK:
+        if _DRIVERS_INDEX is None:
+            _DRIVERS_INDEX = _load_drivers_index()
+
+        if _update_driver_entry(driver_path): _save_drivers_index()
+
+        return dict(_DRIVERS_INDEX[driver_path],
+                    source=DRIVERS_PATHS[driver_name]['source'])
@@ -7,7 +7,9 @@ Created on Fri Oct 18 22:20:14 2019
 
 import os
 import sys
+import time
 import inspect
+import threading
 from typing import Type, Tuple, List, Any
 
 import numpy as np
@@ -26,6 +28,18 @@ class Element():
         self._parent = parent
         self._help = None
 
+    def _execute(self, function, *args) -> Any:
+        """ Calls the driver function through the execution lane of the device
+        (see devices.DeviceLane) so that each device sees one call at a time """
+        lane = self.__dict__.get('_lane_cache', False)
+        if lane is False:
+            element = self
+            while element._parent is not None: element = element._parent
+            lane = self._lane_cache = element.__dict__.get('_lane')  # only set by Device
+
+        if lane is None: return function(*args)
+        return lane.execute(function, *args)
+
     def address(self) -> str:
         """ Returns the address of the given element.
         <module.submodule.variable> """
@@ -78,6 +92,19 @@ class Variable(Element):
             assert isinstance(config['help'], str), f"Variable {self.address()} configuration: Info parameter must be a string"
             self._help = config['help']
 
+        # Read cache: a value younger than cache_ttl seconds is returned without reading the device
+        self.cache_ttl = None
+        if 'cache_ttl' in config:
+            assert isinstance(config['cache_ttl'], (int, float)) and config['cache_ttl'] >= 0, f"Variable {self.address()} configuration: cache_ttl parameter must be a positive number"
+            self.cache_ttl = float(config['cache_ttl'])
+        self._cache_lock = threading.Lock()
+        self._cache_value = None
+        self._cache_time = None
+        self._cache_inflight = None
+        self._cache_generation = 0  # changed by writes, to ignore reads started before them
+        self.cache_hits = 0
+        self.cache_misses = 0
+
         # Properties
         self.writable = self.write_function is not None
         self.readable = self.read_function is not None
@@ -88,6 +115,68 @@ class Variable(Element):
         self._read_signal = None
         self._write_signal = None
 
+    def set_cache_ttl(self, ttl: float = None):
+        """ Set the maximum age in seconds of a cached read value (None to disable the cache) """
+        assert ttl is None or ttl >= 0, "cache_ttl must be a positive number or None"
+        self.cache_ttl = None if ttl is None else float(ttl)
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        """ Forget the cached value, next read will query the device.
+        A read in progress is not shared with the next readers anymore """
+        with self._cache_lock:
+            self._cache_value = None
+            self._cache_time = None
+            self._cache_inflight = None
+            self._cache_generation += 1
+
+    def cache_age(self) -> float:
+        """ Returns the age in seconds of the cached value, None if no cached value """
+        cache_time = self._cache_time
+        return None if cache_time is None else time.monotonic() - cache_time
+
+    def cache_info(self) -> dict:
+        """ Returns the cache statistics of this variable """
+        return {'ttl': self.cache_ttl, 'hits': self.cache_hits,
+                'misses': self.cache_misses, 'age': self.cache_age()}
+
+    def _read_cached(self) -> Any:
+        """ Returns the cached value if younger than cache_ttl, else reads the device.
+        Concurrent readers wait for the read in progress instead of reading again """
+        with self._cache_lock:
+            if (self._cache_time is not None
+                    and time.monotonic() - self._cache_time <= self.cache_ttl):
+                self.cache_hits += 1
+                return self._cache_value
+
+            inflight = self._cache_inflight
+            is_reader = inflight is None
+            if is_reader:
+                inflight = self._cache_inflight = _InflightRead()
+                generation = self._cache_generation
+                self.cache_misses += 1
+            else:
+                self.cache_hits += 1
+
+        if not is_reader:
+            return inflight.wait()
+
+        try:
+            answer = self._execute(self.read_function)
+        except Exception as e:
+            with self._cache_lock:
+                if self._cache_inflight is inflight: self._cache_inflight = None
+            inflight.set_error(e)
+            raise
+
+        with self._cache_lock:
+            if generation == self._cache_generation:
+                self._cache_value = answer
+                self._cache_time = time.monotonic()
+            if self._cache_inflight is inflight: self._cache_inflight = None
+        inflight.set_value(answer)
+        return answer
+
     def save(self, path: str, value: Any = None):
         """ This function measure the variable and saves its value in the provided path """
 
@@ -138,6 +227,9 @@ class Variable(Element):
         if self.unit is not None: display += f'{self.unit}\n'
         else: display += 'None\n'
 
+        if self.cache_ttl is not None:
+            display += f'Cache: {self.cache_ttl:g} s ({self.cache_hits} hits, {self.cache_misses} misses)\n'
+
         return display
 
     def __call__(self, value: Any = None) -> Any:
@@ -145,7 +237,10 @@ class Variable(Element):
         # GET FUNCTION
         if value is None:
             assert self.readable, f"The variable {self.address()} is not readable"
-            answer = self.read_function()
+            if self.cache_ttl is None:
+                answer = self._execute(self.read_function)
+            else:
+                answer = self._read_cached()
             if self._read_signal is not None: self._read_signal.emit_read(answer)
             if self.type in [tuple]:  # OPTIMIZE: could be generalized to any variable but fear could lead to memory issue
                 self.value = answer
@@ -160,11 +255,37 @@ class Variable(Element):
             value = self.type(value)
         if self.type in [tuple]:  # OPTIMIZE: could be generalized to any variable but fear could lead to memory issue
             self.value = value
-        self.write_function(value)
+        try:
+            self._execute(self.write_function, value)
+        finally:
+            # After the write: a read done during the write can't be kept
+            if self.cache_ttl is not None: self.invalidate_cache()
         if self._write_signal is not None: self._write_signal.emit_write(value)
         return None
 
 
+class _InflightRead:
+    """ Read in progress shared by concurrent readers of a cached Variable """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+
+    def set_value(self, value: Any):
+        self._value = value
+        self._event.set()
+
+    def set_error(self, error: Exception):
+        self._error = error
+        self._event.set()
+
+    def wait(self) -> Any:
+        self._event.wait()
+        if self._error is not None: raise self._error
+        return self._value
+
+
 class Action(Element):
 
     def __init__(self, parent: Type, config: dict):
@@ -230,7 +351,7 @@ class Action(Element):
                     value = np.array(value, ndmin=1)  # ndim=1 to avoid having float if 0D
                 else:
                     value = self.type(value)
-                self.function(value)
+                self._execute(self.function, value)
             elif self.unit in ('open-file', 'save-file', 'filename'):
                 if self.unit == 'filename':  # LEGACY (may be removed later)
                     print(f"Using 'filename' as unit is depreciated in favor of 'open-file' and 'save-file'" \
@@ -256,7 +377,7 @@ class Action(Element):
                     path = os.path.dirname(filename)
                     PATHS['last_folder'] = path
                     value = filename
-                    self.function(value)
+                    self._execute(self.function, value)
                 else:
                     print(f"Action '{self.address()}' cancel filename selection")
 
@@ -271,12 +392,12 @@ class Action(Element):
 
                 if response != '':
                     value = response
-                    self.function(value)
+                    self._execute(self.function, value)
             else:
                 assert value is not None, f"The action {self.address()} requires an argument"
         else:
             assert value is None, f"The action {self.address()} doesn't require an argument"
-            self.function()
+            self._execute(self.function)
 
         if self.type in [tuple]:  # OPTIMIZE: could be generalized to any variable but fear could lead to memory issue
             self.value = value
@@ -292,6 +413,7 @@ class Module(Element):
         self._mod = {}
         self._var = {}
         self._act = {}
+        self._elements = {}  # all children by name, used by __getattr__
         self._read_init_list = []
 
         # Object - instance
@@ -328,11 +450,13 @@ class Module(Element):
                 # Check name uniqueness
                 assert name not in self.get_names(), f"Module {self.address()}, Submodule {name} configuration: '{name}' already exists"
                 self._mod[name] = Module(self, config_line)
+                self._elements[name] = self._mod[name]
 
             elif element_type == 'variable':
                 # Check name uniqueness
                 assert name not in self.get_names(), f"Module {self.address()}, Variable {name} configuration: '{name}' already exists"
                 self._var[name] = Variable(self, config_line)
+                self._elements[name] = self._var[name]
                 if self._var[name].read_init:
                     self._read_init_list.append(self._var[name])
 
@@ -340,6 +464,7 @@ class Module(Element):
                 # Check name uniqueness
                 assert name not in self.get_names(), f"Module {self.address()}, Action {name} configuration: '{name}' already exists"
                 self._act[name] = Action(self, config_line)
+                self._elements[name] = self._act[name]
 
     def get_module(self, name: str) -> Type:  # -> Module
         """ Returns the submodule of the given name """
@@ -373,11 +498,21 @@ class Module(Element):
         return self.list_modules() + self.list_variables() + self.list_actions()
 
     def __getattr__(self, attr: str) -> Element:
-        if attr in self.list_variables(): return self.get_variable(attr)
-        if attr in self.list_actions(): return self.get_action(attr)
-        if attr in self.list_modules(): return self.get_module(attr)
+        elements = self.__dict__.get('_elements')  # avoid recursion if not initialized
+        if elements is not None and attr in elements: return elements[attr]
         raise AttributeError(f"'{attr}' not found in module '{self.address()}'")
 
+    def get_elements_index(self) -> dict:
+        """ Returns a flat dict {address: element} of this module and all its sub-elements """
+        index = {self.address(): self}
+        modules = [self]
+        while modules:
+            module = modules.pop()
+            for element in module._elements.values():
+                index[element.address()] = element
+                if isinstance(element, Module): modules.append(element)
+        return index
+
     def get_structure(self) -> List[Tuple[str, str]]:
         """ Returns the structure of the module as a list containing each element address associated with its type as
         [['address1', 'variable'], ['address2', 'action'],...] """
@@ -439,3 +574,17 @@ class Module(Element):
         """ For auto-completion """
         return (self.list_modules() + self.list_variables()
                 + self.list_actions() + ['help', 'instance'])
+
+
+def read_sample(variable: Any) -> Any:
+    """ Reads variable for monitoring. Returns a float, or the array or
+    dataframe read (used by the monitor and the server subscriptions) """
+    value = variable()
+
+    if not isinstance(value, (np.ndarray, pd.DataFrame)):  # should not float(array) because if 0D convert to float and loose information on type
+        try:
+            value = float(value)
+        except TypeError:
+            assert hasattr(value, "shape"), "If data is not a float, should be an array or a dataframe"
+
+    return value
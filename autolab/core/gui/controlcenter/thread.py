@@ -6,15 +6,13 @@ Created on Sun Sep 29 18:26:32 2019
 """
 
 import sys
-import inspect
-from typing import Any
+import threading
+from typing import Any, List
 
 from qtpy import QtCore, QtWidgets
 
 from ..GUI_utilities import qt_object_exists
-from ...devices import get_final_device_config, list_loaded_devices, DEVICES, Device
-from ...drivers import load_driver_lib, get_driver
-from ...variables import update_allowed_dict
+from ...devices import get_devices
 
 
 class ThreadManager:
@@ -24,6 +22,7 @@ class ThreadManager:
         self.gui = gui
         self.threads = {}
         self.threads_conn = {}
+        self.pending_loads = []  # load threads started together by startLoads
 
     def start(self, item: QtWidgets.QTreeWidgetItem, intType: str, value = None):
         """ This function is called when a new thread is requested,
@@ -65,7 +64,23 @@ class ThreadManager:
         thread.finished.connect(lambda x=tid: self.delete(x))
 
         # Starting thread
-        thread.start()
+        if intType == 'load':
+            # Devices requested in the same event loop iteration (tree
+            # initialization, devices opened by a scan) are opened together
+            if not self.pending_loads:
+                QtCore.QTimer.singleShot(0, self.startLoads)
+            self.pending_loads.append(thread)
+        else:
+            thread.start()
+
+    def startLoads(self):
+        """ Starts the pending load threads, sharing a single LoadBatch """
+        threads, self.pending_loads = self.pending_loads, []
+        batch = LoadBatch([thread.item.name for thread in threads],
+                          self.gui)
+        for thread in threads:
+            thread.batch = batch
+            thread.start()
 
     def threadFinished(self, tid: int, error: Exception):
         """ This function is called when a thread has finished its job, with an error or not
@@ -108,6 +123,40 @@ class ThreadManager:
         self.threads.pop(tid)
 
 
+class LoadBatch:
+    """ Devices requested together, opened by a single get_devices call made
+    by the first of their load threads to run. The other threads wait for it,
+    or open their device alone if this thread is canceled """
+
+    def __init__(self, device_names: List[str], gui: QtWidgets.QMainWindow):
+        self.device_names = device_names
+        self.gui = gui
+        self.devices = {}
+        self.owner = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def get(self, device_name: str, thread: QtCore.QThread) -> Any:
+        """ Returns the device, or the exception raised while opening it """
+        with self.lock:
+            if self.owner is None: self.owner = thread
+
+        if self.owner is thread:
+            try:
+                self.devices = get_devices(self.device_names, raise_error=False,
+                                           gui=self.gui)
+            finally:
+                self.done.set()
+        else:
+            while not self.done.wait(0.1):
+                if not self.owner.isRunning(): break
+
+        if device_name not in self.devices:
+            return get_devices([device_name], raise_error=False,
+                               gui=self.gui)[device_name]
+        return self.devices[device_name]
+
+
 class InteractionThread(QtCore.QThread):
     """ This class is dedicated to operation interaction with the devices, in a new thread """
     endSignal = QtCore.Signal(object)
@@ -117,6 +166,7 @@ class InteractionThread(QtCore.QThread):
         self.item = item
         self.intType = intType
         self.value = value
+        self.batch = None  # LoadBatch of a 'load' thread, see startLoads
 
     def run(self):
         """ Depending on the interaction type requested, this function reads or writes a variable,
@@ -137,28 +187,15 @@ class InteractionThread(QtCore.QThread):
             #     # Note that threadItemDict needs to be updated outside of thread to avoid timing error
             #     module = devices.get_device(self.item.name)  # Try to get / instantiated the device
             #     self.item.gui.threadDeviceDict[id(self.item)] = module
-            elif self.intType == 'load':  # OPTIMIZE: is very similar to get_device()
+            elif self.intType == 'load':
                 # Note that threadItemDict needs to be updated outside of thread to avoid timing error
                 device_name = self.item.name
-                device_config = get_final_device_config(device_name)
-
-                if device_name in list_loaded_devices():
-                    assert device_config == DEVICES[device_name].device_config, 'You cannot change the configuration of an existing Device. Close it first & retry, or remove the provided configuration.'
-                else:
-                    driver_kwargs = {k: v for k, v in device_config.items() if k not in ['driver', 'connection']}
-                    driver_lib = load_driver_lib(device_config['driver'])
-
-                    if hasattr(driver_lib, 'Driver') and 'gui' in [param.name for param in inspect.signature(driver_lib.Driver.__init__).parameters.values()]:
-                            driver_kwargs['gui'] = self.item.gui
-
-                    instance = get_driver(
-                        device_config['driver'], device_config['connection'],
-                        **driver_kwargs)
-                    DEVICES[device_name] = Device(
-                        device_name, instance, device_config)
-                    update_allowed_dict()
+                if self.batch is None:
+                    self.batch = LoadBatch([device_name], self.item.gui)
+                device = self.batch.get(device_name, self)
+                if isinstance(device, Exception): raise device
 
-                self.item.gui.threadDeviceDict[id(self.item)] = DEVICES[device_name]
+                self.item.gui.threadDeviceDict[id(self.item)] = device
 
         except Exception as e:
             error = e
@@ -10,6 +10,8 @@ import pandas as pd
 import numpy as np
 from qtpy import QtWidgets
 
+from ...buffers import RingBuffer
+
 
 class DataManager:
 
@@ -17,21 +19,35 @@ class DataManager:
 
         self.gui = gui
         self.windowLength = 10
-        self.xlist = []
-        self.ylist = []
+        self.points = RingBuffer(self.windowLength)
+        self._is_points = True
+        self.xlist = self.points.x
+        self.ylist = self.points.y
 
     def setWindowLength(self, value: float):
         """ This function set the value of the window length """
         self.windowLength = value
+        self.points.set_window(value)
+        if self.isPoints(): self._updateViews()
 
     def getWindowLength(self) -> float:
         """ This function returns the value of the window legnth """
         return self.windowLength
 
-    def getData(self) -> Tuple[List, List]:
+    def getData(self) -> Tuple[np.ndarray, np.ndarray]:
         """ This function update the data of the provided plot object """
         return self.xlist, self.ylist
 
+    def isPoints(self) -> bool:
+        """ Returns True if the data are points in the time window (not an array or an image) """
+        return self._is_points
+
+    def getStats(self) -> Tuple[float, float, float]:
+        """ Returns (min, mean, max) of the points, None if not points.
+        Min and max are since last clear, mean is over the time window """
+        if not self.isPoints() or len(self.points) == 0 or self.points.min is None: return None
+        return self.points.min, self.points.mean, self.points.max
+
     def save(self, filename: str):
         """ This function save the data in a file with the provided filename"""
         if self.xlist is not None:
@@ -62,22 +78,41 @@ class DataManager:
             elif isinstance(y, pd.DataFrame):
                 self._addArray(y.values.T)
         else:
-            if not self.gui.windowLength_lineEdit.isVisible():
-                self.gui.xlabel = 'Time(s)'
-                self.gui.figureManager.setLabel('x', self.gui.xlabel)
-                self.gui.windowLength_lineEdit.show()
-                self.gui.windowLength_label.show()
-                self.gui.dataDisplay.show()
-
+            self._showPointsDisplay()
             self._addPoint(point)
 
+    def addPoints(self, blocks: List[Any]):
+        """ This function add the samples of several blocks (objects with x and y arrays) at once """
+        self._showPointsDisplay()
+        if not self.isPoints(): self.clear()  # avoid error when switching from array to point
+
+        if len(blocks) == 1:
+            x, y = blocks[0].x, blocks[0].y
+        else:
+            x = np.concatenate([block.x for block in blocks])
+            y = np.concatenate([block.y for block in blocks])
+
+        self.points.extend(x, y)
+        self._updateViews()
+
+    def _showPointsDisplay(self):
+        """ Shows the widgets used for time window points """
+        if not self.gui.windowLength_lineEdit.isVisible():
+            self.gui.xlabel = 'Time(s)'
+            self.gui.figureManager.setLabel('x', self.gui.xlabel)
+            self.gui.windowLength_lineEdit.show()
+            self.gui.windowLength_label.show()
+            self.gui.dataDisplay.show()
+
     def _addImage(self, image: np.ndarray):
         """ Add image to ylist data as np.ndarray """
+        self._is_points = False
         self.xlist = None
         self.ylist = image
 
     def _addArray(self, array: np.ndarray):
         """ This function replace an dataset [x,y] x is time y is array """
+        self._is_points = False
         if len(array.shape) == 0:
             y_array = array
             self.xlist = np.array([0])
@@ -96,24 +131,19 @@ class DataManager:
             self.ylist = np.array(y_array)
 
     def _addPoint(self, point: Tuple[float, float]):
-        """ This function append a datapoint [x,y] in the lists of data """
-        if not hasattr(self.xlist, 'append'): self.clear()  # avoid error when switching from array to point
+        """ This function append a datapoint [x,y] in the time window """
+        if not self.isPoints(): self.clear()  # avoid error when switching from array to point
 
         x, y = point
+        self.points.append(x, y)  # remove too old data (regarding the window length)
+        self._updateViews()
 
-        # Append data
-        self.xlist.append(x)
-        self.ylist.append(y)
-
-        # Remove too old data (regarding the window length)
-        while (max(self.xlist) - min(self.xlist)) > self.windowLength:
-            self.xlist.pop(0)
-            self.ylist.pop(0)
+    def _updateViews(self):
+        """ Points data are views of the ring buffer """
+        self.xlist = self.points.x
+        self.ylist = self.points.y
 
     def clear(self):
-        try:
-            self.xlist.clear()
-            self.ylist.clear()
-        except AttributeError:  # numpy array has no clear method
-            self.xlist = []
-            self.ylist = []
+        self.points.clear()
+        self._is_points = True
+        self._updateViews()
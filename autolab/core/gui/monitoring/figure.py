@@ -50,7 +50,7 @@ class FigureManager:
     # PLOT DATA
     ###########################################################################
 
-    def update(self, xlist: list, ylist: list) -> None:
+    def update(self, xlist: np.ndarray, ylist: np.ndarray) -> None:
         """ This function update the figure in the GUI """
         if xlist is None: # image
             self.figMap.setImage(ylist, autoRange=False, autoLevels=False, autoHistogramRange=False)
@@ -84,10 +84,19 @@ class FigureManager:
         if xlist is None or ylist is None or len(xlist) == 0 or len(ylist) == 0:
             return None
 
-        xmin = min(xlist)
-        xmax = max(xlist)
-        ymin = min(ylist)
-        ymax = max(ylist)
+        stats = self.gui.dataManager.getStats()
+
+        if stats is not None:
+            # Points in time window: x is increasing, stats are kept up to date by the ring buffer
+            xmin = xlist[0]
+            xmax = xlist[-1]
+            ymin, ymean, ymax = stats
+        else:
+            xmin = np.min(xlist)
+            xmax = np.max(xlist)
+            ymin = np.min(ylist)
+            ymax = np.max(ylist)
+            ymean = None
 
         if self.ymin is None: self.ymin = ymin
         if self.ymax is None: self.ymax = ymax
@@ -97,7 +106,7 @@ class FigureManager:
 
         # Mean update
         if self.gui.mean_checkBox.isChecked():
-            ymean = np.mean(ylist)
+            if ymean is None: ymean = np.mean(ylist)
             self.plot_mean.setData([xmin, xmax], [ymean, ymean])
 
         # Min update
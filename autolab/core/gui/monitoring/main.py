@@ -13,10 +13,11 @@ from qtpy import QtCore, QtWidgets, uic
 
 from .data import DataManager
 from .figure import FigureManager
-from .monitor import MonitorManager
+from .monitor import MonitorManager, SampleBlock
 from ..icons import icons
 from ..GUI_utilities import get_font_size, setLineEditBackground
 from ..GUI_instances import clearMonitor
+from ...config import get_monitor_config
 from ...paths import PATHS
 from ...utilities import SUPPORTED_EXTENSION
 from ...elements import Variable as Variable_og
@@ -39,10 +40,12 @@ class Monitor(QtWidgets.QMainWindow):
         self.setWindowTitle(f"AUTOLAB - Monitor: {self.variable.address()}")
         self.setWindowIcon(icons['monitor'])
         # Queue
-        self.queue = queue.Queue()
+        monitor_config = get_monitor_config()
+        self.queue = queue.Queue(maxsize=max(int(float(monitor_config['queue_size'])), 1))
         self.timer = QtCore.QTimer(self)
         self.timer.setInterval(33)  # 30fps
         self.timer.timeout.connect(self.sync)
+        self._dropped = 0
 
         # Window length
         self.windowLength_lineEdit.setText('10')
@@ -111,12 +114,30 @@ class Monitor(QtWidgets.QMainWindow):
     def sync(self):
         """ This function updates the data and then the figure.
         Function called by the time """
-        # Empty the queue
+        # Empty the queue: the whole backlog is appended at once
         count = 0
-        while not self.queue.empty():
-            self.dataManager.addPoint(self.queue.get())
+        blocks = []
+        for _ in range(self.queue.qsize()):
+            try: item = self.queue.get_nowait()
+            except queue.Empty: break
+
+            if isinstance(item, SampleBlock):
+                blocks.append(item)
+            else:
+                if blocks: self.dataManager.addPoints(blocks)
+                blocks = []
+                self.dataManager.addPoint(item)
             count += 1
 
+        if blocks: self.dataManager.addPoints(blocks)
+
+        dropped = self.monitorManager.thread.dropped
+        if dropped != self._dropped:
+            self._dropped = dropped
+            self.setStatus(f'Display slower than acquisition: {dropped} samples ' \
+                           f"removed (queue policy '{self.monitorManager.thread.policy}')",
+                           5000)
+
         # Upload the plot if new data available
         if count > 0:
             xlist, ylist = self.dataManager.getData()
@@ -4,17 +4,30 @@ Created on Sun Sep 29 18:21:49 2019
 
 @author: qchat
 """
-from typing import Union
+from typing import Union, Any
 import time
 import threading
-from queue import Queue
+from queue import Queue, Full, Empty
 
 import numpy as np
-import pandas as pd
 from qtpy import QtCore, QtWidgets
 
+from ...config import get_monitor_config
+from ...devices import set_io_priority, PRIORITY_MONITOR
 from ...variables import Variable
-from ...elements import Variable as Variable_og
+from ...elements import Variable as Variable_og, read_sample
+
+
+class SampleBlock:
+    """ Block of scalar samples (times x, values y) published at once by MonitorThread """
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x: np.ndarray, y: np.ndarray):
+        self.x = x
+        self.y = y
+
+    def __len__(self) -> int:
+        return len(self.x)
 
 
 class MonitorManager:
@@ -24,7 +37,9 @@ class MonitorManager:
         self.gui = gui
 
         # Configure a new thread
-        self.thread = MonitorThread(self.gui.variable, self.gui.queue)
+        monitor_config = get_monitor_config()
+        self.thread = MonitorThread(self.gui.variable, self.gui.queue,
+                                    policy=monitor_config['queue_policy'])
         self.thread.errorSignal.connect(self.error)
 
     def error(self, error: Exception):
@@ -65,22 +80,93 @@ class MonitorManager:
 
 
 class MonitorThread(QtCore.QThread):
-    """ This thread class is dedicated to read the variable, and send its data to GUI through a queue """
+    """ This thread class is dedicated to read the variable, and send its data to GUI through a queue.
+    Scalar samples are sent by blocks (SampleBlock) every block_interval seconds or when
+    block_size samples are acquired. Arrays and dataframes are sent one by one as [time, value].
+    If the queue is full (GUI slower than the acquisition), policy tells what to do:
+    'drop-oldest' removes the oldest item of the queue, 'decimate' merges the queue
+    keeping one sample out of two, 'block' waits for the GUI """
 
     errorSignal = QtCore.Signal(object)
 
-    def __init__(self, variable: Union[Variable, Variable_og], queue: Queue):
+    def __init__(self, variable: Union[Variable, Variable_og], queue: Queue,
+                 policy: str = 'drop-oldest'):
 
         super().__init__()
         self.variable = variable
         self.queue = queue
+        assert policy in ('drop-oldest', 'decimate', 'block'), f"Unknown queue policy '{policy}'"
+        self.policy = policy
 
         self.pauseFlag = threading.Event()
         self.stopFlag = threading.Event()
 
         self.delay = 0
+        self.block_size = 1024
+        self.block_interval = 0.033  # same as GUI refresh
+
+        self.dropped = 0  # number of samples removed by the queue policy
+        self._newBlock()
+
+    def _newBlock(self):
+        """ Allocates the arrays of the next block """
+        self._block_x = np.empty(self.block_size)
+        self._block_y = np.empty(self.block_size)
+        self._block_len = 0
+        self._block_time = time.time()
+
+    def publishBlock(self):
+        """ Sends the samples acquired since the last block """
+        if self._block_len == 0: return None
+        block = SampleBlock(self._block_x[: self._block_len],
+                            self._block_y[: self._block_len])
+        self._newBlock()
+        self.publish(block)
+        return None
+
+    def publish(self, item: Any):
+        """ Puts item in the queue, applying the queue policy if the queue is full.
+        Once the thread is stopped, the GUI is not waited for anymore """
+        while True:
+            stopped = self.stopFlag.is_set()
+            try:
+                if self.policy == 'block' and not stopped:
+                    self.queue.put(item, timeout=0.1)
+                else:
+                    self.queue.put_nowait(item)
+                return None
+            except Full:
+                if self.policy == 'drop-oldest':
+                    try: self.dropped += _nb_samples(self.queue.get_nowait())
+                    except Empty: pass
+                elif self.policy == 'decimate':
+                    item = self._decimate(item)
+                elif stopped:
+                    self.dropped += _nb_samples(item)
+                    return None
+
+    def _decimate(self, item: Any) -> Any:
+        """ Empties the queue and returns a single item with one sample out of two
+        of the queued blocks and item. Only the last array or dataframe is kept """
+        items = []
+        while True:
+            try: items.append(self.queue.get_nowait())
+            except Empty: break
+        items.append(item)
+
+        blocks = [item for item in items if isinstance(item, SampleBlock)]
+        others = [item for item in items if not isinstance(item, SampleBlock)]
+        if others:
+            self.dropped += sum(_nb_samples(item) for item in items) - 1
+            return others[-1]
+
+        x = np.concatenate([block.x for block in blocks])
+        y = np.concatenate([block.y for block in blocks])
+        self.dropped += len(x) - len(x[::2])
+        return SampleBlock(x[::2], y[::2])
 
     def run(self):
+        set_io_priority(PRIORITY_MONITOR)  # scan steps go first
 
         t_ini = time.time()
         pauseLength = 0
@@ -97,17 +183,19 @@ class MonitorThread(QtCore.QThread):
 
             try:
                 # Measure variable
-                value = self.variable()
-
-                # Check type
-                if not isinstance(value, (np.ndarray, pd.DataFrame)):  # should not float(array) because if 0D convert to float and loose information on type
-                    try:
-                        value = float(value)
-                    except TypeError:
-                        assert hasattr(value, "shape"), "If data is not a float, should be an array or a dataframe"
+                value = read_sample(self.variable)
 
                 # Send signal new data
-                self.queue.put([now, value])
+                if isinstance(value, float):
+                    self._block_x[self._block_len] = now
+                    self._block_y[self._block_len] = value
+                    self._block_len += 1
+                    if (self._block_len == self.block_size
+                            or time.time() - self._block_time >= self.block_interval):
+                        self.publishBlock()
+                else:
+                    self.publishBlock()  # keep order
+                    self.publish([now, value])
 
             except Exception as e:
                 self.errorSignal.emit(e)
@@ -117,7 +205,14 @@ class MonitorThread(QtCore.QThread):
             time.sleep(self.delay)
 
             # pause
+            if self.pauseFlag.is_set() or self.stopFlag.is_set():
+                self.publishBlock()
             while self.pauseFlag.is_set():
                 if pauseStartedTime is None:
                     pauseStartedTime = time.time()
                 time.sleep(0.1)
+
+
+def _nb_samples(item: Any) -> int:
+    """ Returns the number of samples in a queue item """
+    return len(item) if isinstance(item, SampleBlock) else 1
@@ -19,7 +19,8 @@ from qtpy import QtWidgets, QtCore
 from ...config import get_scanner_config
 from ...elements import Variable as Variable_og
 from ...elements import Action
-from ...devices import DEVICES, list_loaded_devices, get_element_by_address
+from ...devices import (DEVICES, list_loaded_devices, get_element_by_address,
+                         get_devices)
 from ...utilities import (boolean, str_to_array, array_to_str, create_array,
                           str_to_dataframe, dataframe_to_str, str_to_data,
                           str_to_tuple)
@@ -106,6 +107,22 @@ class ConfigManager:
 
         return element
 
+    def ask_get_devices(self, device_names: List[str]):
+        """ Asks user if want to instantiate the devices not already
+        instantiated, then opens all of them concurrently """
+        for device_name in dict.fromkeys(device_names):
+            if device_name not in DEVICES:
+                msg_box = QtWidgets.QMessageBox(self.gui)
+                msg_box.setWindowTitle(f"Device {device_name}")
+                msg_box.setText(f"Instantiate device {device_name}?")
+                msg_box.setStandardButtons(QtWidgets.QMessageBox.Ok
+                                           | QtWidgets.QMessageBox.Cancel)
+                msg_box.show()
+                if msg_box.exec_() == QtWidgets.QMessageBox.Cancel:
+                    raise ValueError(f'Refused {device_name} instantiation')
+
+        get_devices(device_names)
+
     def update_loaded_devices(self, already_loaded_devices: list):
         """ Refresh GUI with the new loaded devices """
         for device in (set(list_loaded_devices()) - set(already_loaded_devices)):
@@ -976,6 +993,30 @@ class ConfigManager:
             recipeNameList = [i for i in list(configPars)
                               if i not in ('autolab', 'variables')]
 
+            # Open every device used by the scan at once
+            device_names = []
+            for recipe_num_name in recipeNameList:
+                pars_recipe_i = configPars[recipe_num_name]
+                pars_param = pars_recipe_i.get('parameter', {})
+                if len(pars_param) != 0 and isinstance(
+                        list(pars_param.values())[0], dict):
+                    addresses = [param_pars.get('address', 'None')
+                                 for param_pars in pars_param.values()]
+                else:  # LEGACY <= 1.2.1
+                    addresses = [pars_param.get('address', 'None')]
+
+                pars_recipe = pars_recipe_i.get('recipe', {})
+                i = 1
+                while f'{i}_name' in pars_recipe:
+                    if pars_recipe.get(f'{i}_steptype') != 'recipe':
+                        addresses.append(pars_recipe.get(f'{i}_address', 'None'))
+                    i += 1
+
+                device_names += [address.split('.')[0] for address in addresses
+                                 if address != 'None']
+
+            self.ask_get_devices(device_names)
+
             for recipe_num_name in recipeNameList:
 
                 pars_recipe_i = configPars[recipe_num_name]
@@ -5,24 +5,126 @@ Created on Sun Sep 29 18:10:31 2019
 @author: qchat
 """
 
-from collections import OrderedDict
 from queue import Queue
 import os
+import csv
+import time
 import shutil
 import tempfile
 import sys
 import random
-from typing import List, Union
+import threading
+from typing import List, Union, Tuple, Iterator, Any
 
 import numpy as np
 import pandas as pd
 from qtpy import QtCore, QtWidgets
 
+from ...buffers import ColumnBuffer, ArrayStore
 from ...config import get_scanner_config
 from ...utilities import boolean, create_array, data_to_dataframe
 from ...variables import has_eval, eval_safely
 
 
+class ScanPoint:
+    """ Values of one point of a recipe, stored in the order of the recipe
+    schema: parameters then recipe steps. None means no value for a step """
+    __slots__ = ('recipe_name', 'names', 'values')
+
+    def __init__(self, recipe_name: str, names: Tuple[str, ...]):
+        self.recipe_name = recipe_name
+        self.names = names  # shared by every point of the recipe
+        self.values = [None] * len(names)
+
+    @staticmethod
+    def schema(recipe: dict) -> Tuple[str, ...]:
+        """ Returns the names of the values of a point of recipe """
+        return tuple([parameter['name'] for parameter in recipe['parameter']]
+                     + [step['name'] for step in recipe['recipe']])
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """ Iterates over (name, value) of the values set """
+        return ((name, value) for name, value in zip(self.names, self.values)
+                if value is not None)
+
+
+class ArrayResults:
+    """ Values of a non-numerical result of a Dataset, by point index (ID-1).
+    If the dataset has an ArrayStore for the result, a value is only kept in
+    memory until the writer thread stores it, then it is read back from the
+    store (memory-mapped when possible). Without store, values stay in memory """
+
+    def __init__(self, array_store: ArrayStore = None, dataframe: bool = False):
+        self.array_store = array_store
+        self.dataframe = dataframe  # stored as records, read back as DataFrame
+        self._ids = []
+        self._pending = {}  # {ID: value not stored yet}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def append(self, ID: int, value: Any):
+        self._ids.append(ID)
+        self._pending[ID] = value
+
+    def stored(self, ID: int):
+        """ Called by the writer thread once the value of ID is stored """
+        if self.array_store is not None: self._pending.pop(ID, None)
+
+    def __getitem__(self, index: int) -> Any:
+        ID = self._ids[index]
+        try:
+            return self._pending[ID]
+        except KeyError:
+            value = self.array_store.read(ID, mmap=True)
+            return pd.DataFrame(value) if self.dataframe else value
+
+    def __iter__(self) -> Iterator[Any]:
+        return (self[index] for index in range(len(self)))
+
+
+class TempWriter(threading.Thread):
+    """ Writes the temporary files of the scans in a dedicated thread, so that
+    disk latency doesn't slow down the GUI. Receives batches of write jobs
+    from the datasets (one batch per dataset and per sync) in a bounded queue:
+    when the queue is full, the GUI waits for the disk instead of loosing data """
+
+    def __init__(self, maxsize: int = 1000):
+        super().__init__(name='autolab_scan_writer', daemon=True)
+        self.queue = Queue(maxsize=maxsize)
+        self.bytes_written = 0
+        self.error = None  # last error, reset by the GUI once displayed
+
+    def put(self, dataset: 'Dataset', jobs: list):
+        """ Adds a batch of write jobs of dataset to the queue """
+        self.queue.put((dataset, jobs))
+
+    def backlog(self) -> int:
+        """ Returns the number of batches waiting to be written """
+        return self.queue.qsize()
+
+    def wait(self):
+        """ Blocks until every batch in the queue has been written """
+        self.queue.join()
+
+    def stop(self):
+        """ Writes the remaining batches and stops the thread """
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None: return None
+                dataset, jobs = item
+                self.bytes_written += dataset.writeJobs(jobs)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+
 class DataManager:
     """ Manage data from a scan """
 
@@ -34,12 +136,20 @@ class DataManager:
 
         scanner_config = get_scanner_config()
         self.save_temp = boolean(scanner_config["save_temp"])
+        self.export_arrays_txt = boolean(scanner_config["export_arrays_txt"])
 
         # Timer
         self.timer = QtCore.QTimer(self.gui)
         self.timer.setInterval(33) #30fps
         self.timer.timeout.connect(self.sync)
 
+        # Temporary files writer
+        self.writer = TempWriter()
+        self.writer.start()
+        self.writerLabel = QtWidgets.QLabel()
+        self.gui.statusBar.addPermanentWidget(self.writerLabel)
+        self._writer_stats = (time.time(), 0)  # (time, bytes written)
+
     def getData(self, nbDataset: int, var_list: List[str],
                 selectedData: int = 0, data_name: str = "Scan",
                 filter_condition: List[dict] = []) -> List[pd.DataFrame]:
@@ -126,7 +236,9 @@ class DataManager:
                 if self.save_temp: os.mkdir(sub_folder)
 
                 dataset = Dataset(sub_folder, recipe_name,
-                                  config, save_temp=self.save_temp)
+                                  config, save_temp=self.save_temp,
+                                  writer=self.writer,
+                                  export_arrays_txt=self.export_arrays_txt)
                 scanset[recipe_name] = dataset
 
                 # bellow just to know maximum point
@@ -187,14 +299,19 @@ class DataManager:
 
         # Add scan data to dataset
         for _ in range(lenQueue):
-            try: point = self.queue.get()  # point is collections.OrderedDict{0:recipe_name, 'parameter_name':parameter_value, 'step1_name':step1_value, 'step2_name':step2_value, ...}
+            try: point = self.queue.get()  # point is ScanPoint
             except: break
 
-            recipe_name = list(point.values())[0]
-            dataset = scanset[recipe_name]
+            dataset = scanset[point.recipe_name]
             dataset.addPoint(point)
             count += 1
 
+        # Temporary files are written by the writer thread, one batch per dataset
+        if scanset is not None:
+            for dataset in scanset.values():
+                dataset.pushJobs()
+        self.updateWriterStatus()
+
         # Upload the plot if new data available
         if count > 0:
             # Update progress bar
@@ -212,6 +329,33 @@ class DataManager:
             # Update plot
             self.gui.figureManager.data_comboBoxClicked()
 
+    def updateWriterStatus(self):
+        """ Displays the writer backlog and speed in the status bar,
+        updated at most once per second """
+        if self.writer.error is not None:
+            self.gui.setStatus(
+                f'Error writing temporary files: {self.writer.error}',
+                10000, False)
+            self.writer.error = None
+
+        now = time.time()
+        last_time, last_bytes = self._writer_stats
+        if now - last_time < 1: return None
+
+        bytes_written = self.writer.bytes_written
+        speed = (bytes_written - last_bytes) / (now - last_time)
+        self._writer_stats = (now, bytes_written)
+
+        backlog = self.writer.backlog()
+        if backlog == 0 and speed == 0: self.writerLabel.setText('')
+        else: self.writerLabel.setText(
+                f'Writing: {backlog} pending, {speed/1e3:.1f} kB/s')
+        return None
+
+    def close(self):
+        """ Writes the remaining temporary files and stops the writer """
+        self.writer.stop()
+
     def updateDisplayableResults(self):
         """ This function update the combobox in the GUI that displays the names of
         the results that can be plotted """
@@ -294,11 +438,17 @@ class DataManager:
 class Dataset():
     """ Collection of data from a recipe """
     def __init__(self, folder_dataset_temp: str, recipe_name: str, config: dict,
-                 save_temp: bool = True):
-        self._data_temp = []
+                 save_temp: bool = True, writer: TempWriter = None,
+                 export_arrays_txt: bool = False):
         self.recipe_name = recipe_name
+        # Also save the stored arrays as one text file per point (slow)
+        self.export_arrays_txt = export_arrays_txt
+        self.writer = writer  # if None, temporary files are written directly
+        self._jobs = []  # write jobs waiting to be sent to the writer
+        self._data_file = None  # data.txt, only used by the writer thread
         self.folders = []
-        self.data_arrays = {}
+        self.data_arrays = {}  # {result_name: ArrayResults}
+        self.array_stores = {}  # {result_name: ArrayStore} for arrays and dataframes
         self.folder_dataset_temp = folder_dataset_temp
         self.new = True
         self.save_temp = save_temp
@@ -334,7 +484,34 @@ class Dataset():
                            step['stepType'] == 'measure'
                            and step['element'].type in [int, float, bool])]
                        )
-        self.data = pd.DataFrame(columns=self.header)
+        self._buffer = ColumnBuffer(self.header)
+        self._column_index = {column: i for i, column in enumerate(
+            self._buffer.columns)}
+
+        # Where each result goes: {name: (element, kind, column index)}
+        # kind is 'column' for numerical values stored in the data columns
+        # and 'array' for the other values stored in data_arrays and files
+        self._routes = {}
+        for step in self.list_param + self.list_step:
+            if step['name'] in self._routes: continue  # first one is used
+            element = step['element']
+            if (element is None or element.type in [int, float, bool]) and (
+                    step['name'] in self._column_index):
+                route = (element, 'column', self._column_index[step['name']])
+            else:
+                route = (element, 'array', None)
+            self._routes[step['name']] = route
+
+    @property
+    def data(self) -> pd.DataFrame:
+        """ Returns the scan data as a DataFrame built on the column buffer.
+        The DataFrame is only created when requested and reused until a new
+        point is added """
+        return self._buffer.to_dataframe()
+
+    def getColumn(self, name: str) -> np.ndarray:
+        """ Returns a view (no copy) of the data column name """
+        return self._buffer.column(name)
 
     def getData(self, var_list: List[str], data_name: str = "Scan",
                 dataID: int = 0, filter_condition: List[dict] = []) -> pd.DataFrame:
@@ -396,10 +573,14 @@ class Dataset():
         dataset_folder = os.path.splitext(filename)[0]
         data_name = os.path.join(self.folder_dataset_temp, 'data.txt')
 
+        # Temporary files must be complete before being copied
+        self.pushJobs()
+        if self.writer is not None: self.writer.wait()
+
         if os.path.exists(data_name):
             shutil.copy(data_name, filename)
         else:
-            self.data.to_csv(filename, index=False, header=self.header)
+            self.data.to_csv(filename, index=False)
 
         if self.folders:
             if not os.path.exists(dataset_folder): os.mkdir(dataset_folder)
@@ -408,6 +589,7 @@ class Dataset():
                 dest_folder = os.path.join(dataset_folder, array_name)
 
                 if os.path.exists(tmp_folder):
+                    # Binary stores and text files are copied as they are
                     try:
                         shutil.copytree(tmp_folder, dest_folder,
                                         dirs_exist_ok=True)  # python >=3.8 only
@@ -415,6 +597,11 @@ class Dataset():
                         if os.path.exists(dest_folder):
                             shutil.rmtree(dest_folder, ignore_errors=True)
                         shutil.copytree(tmp_folder, dest_folder)
+
+                    if self.export_arrays_txt and array_name in self.array_stores:
+                        # Legacy export: one text file per point, written
+                        # by the writer thread to keep the GUI responsive
+                        self._jobs.append(('export', array_name, dest_folder))
                 else:
                     # This is only executed if no temp folder is set
                     if not os.path.exists(dest_folder): os.mkdir(dest_folder)
@@ -435,64 +622,139 @@ class Dataset():
                             elif isinstance(value, pd.DataFrame):
                                 value.to_csv(path, index=False)
 
-    def addPoint(self, dataPoint: OrderedDict):
-        """ This function add a data point (parameter value, and results) in the dataset """
-        ID = len(self.data) + 1
-        simpledata = OrderedDict()
-        simpledata['id'] = ID
-
-        for result_name, result in dataPoint.items():
+            self.pushJobs()
+
+    def exportArrays(self, result_name: str, folder: str):
+        """ Writes the arrays of result_name stored in binary in one text file
+        per point, as done by the element save function """
+        element = self._routes[result_name][0]
+        array_store = self.array_stores[result_name]
+
+        for ID in array_store.ids():
+            value = array_store.read(ID, mmap=True)
+            if element.type == pd.DataFrame: value = pd.DataFrame(value)
+            element.save(os.path.join(folder, f'{ID}.txt'), value=value)
+
+    def close(self):
+        """ Closes the files kept open during the scan, once written """
+        self._jobs.append(('close',))
+        self.pushJobs()
+
+    def pushJobs(self):
+        """ Sends the pending write jobs to the writer thread as one batch """
+        if not self._jobs: return None
+        jobs, self._jobs = self._jobs, []
+        if self.writer is None: self.writeJobs(jobs)
+        else: self.writer.put(self, jobs)
+        return None
 
-            if result_name == 0: continue  # skip first result which is recipe_name
+    def writeJobs(self, jobs: list) -> int:
+        """ Writes a batch of jobs in the temporary files, flushed once at the
+        end. Executed in the writer thread. Returns the number of bytes written """
+        nbytes = 0
+        flush = set()
+
+        for job in jobs:
+            kind = job[0]
+
+            if kind == 'row':
+                _, ID, row = job
+                if self._data_file is None:
+                    if not os.path.exists(self.folder_dataset_temp):
+                        print(f'Warning: {self.folder_dataset_temp} has been created ' \
+                              'but should have been created earlier. ' \
+                              'Check that you have not lost any data',
+                              file=sys.stderr)
+                        os.mkdir(self.folder_dataset_temp)
+                    self._data_file = open(os.path.join(
+                        self.folder_dataset_temp, 'data.txt'), 'a', newline='')
+                    self._data_writer = csv.writer(self._data_file,
+                                                   lineterminator=os.linesep)
+                start = self._data_file.tell()
+                if ID == 1: self._data_writer.writerow(self._buffer.columns)
+                self._data_writer.writerow(['' if pd.isna(value) else value
+                                            for value in row])
+                nbytes += self._data_file.tell() - start
+                flush.add(self._data_file)
+            elif kind == 'array':
+                _, result_name, results_folder, ID, result = job
+                if not os.path.exists(results_folder): os.mkdir(results_folder)
+                # One binary file per result instead of one csv per point
+                array_store = self.array_stores[result_name]
+                nbytes += array_store.append(ID, (
+                    result.to_records(index=False)
+                    if isinstance(result, pd.DataFrame) else result))
+                flush.add(array_store)
+                self.data_arrays[result_name].stored(ID)
+            elif kind == 'file':
+                _, element, results_folder, ID, result = job
+                if not os.path.exists(results_folder): os.mkdir(results_folder)
+                result_path = os.path.join(results_folder, f'{ID}.txt')
+                element.save(result_path, value=result)
+                nbytes += os.path.getsize(result_path)
+            elif kind == 'export':
+                _, result_name, folder = job
+                self.array_stores[result_name].flush()
+                self.exportArrays(result_name, folder)
+            elif kind == 'close':
+                flush.clear()
+                for array_store in self.array_stores.values():
+                    array_store.close()
+                if self._data_file is not None:
+                    self._data_file.close()
+                    self._data_file = None
+
+        for f in flush: f.flush()
+
+        return nbytes
+
+    def addPoint(self, dataPoint: ScanPoint):
+        """ This function add a data point (parameter value, and results) in the dataset.
+        Writing of the temporary files is queued, see pushJobs """
+        ID = len(self._buffer) + 1
+        row = [np.nan] * len(self._buffer.columns)
+        row[self._column_index['id']] = ID
 
-            elements = [step['element'] for step in (
-                self.list_param+self.list_step) if step['name']==result_name]
-            element = elements[0]
-            # should always find exactly one element in list above
+        for result_name, result in dataPoint.items():
+            element, kind, column = self._routes[result_name]
 
             # If the result is displayable (numerical), keep it in memory
-            if element is None or element.type in [int, float, bool]:
-                simpledata[result_name] = result
+            if kind == 'column':
+                row[column] = result
             else : # Else write it on a file, in a temp directory
                 results_folder = os.path.join(self.folder_dataset_temp, result_name)
 
-                if self.save_temp:
-                    if not os.path.exists(results_folder): os.mkdir(results_folder)
-                    result_path = os.path.join(results_folder, f'{ID}.txt')
+                stored = (self.save_temp and element is not None
+                          and element.type in [np.ndarray, pd.DataFrame])
 
-                    if element is not None:
-                        element.save(result_path, value=result)
+                if self.data_arrays.get(result_name) is None:
+                    if stored:
+                        self.array_stores[result_name] = ArrayStore(
+                            results_folder, result_name)
+                    self.data_arrays[result_name] = ArrayResults(
+                        self.array_stores.get(result_name),
+                        dataframe=element is not None and element.type == pd.DataFrame)
+
+                if stored:
+                    self._jobs.append(
+                        ('array', result_name, results_folder, ID, result))
+                elif self.save_temp and element is not None:
+                    self._jobs.append(
+                        ('file', element, results_folder, ID, result))
 
                 if results_folder not in self.folders:
                     self.folders.append(results_folder)
 
-                if self.data_arrays.get(result_name) is None:
-                    self.data_arrays[result_name] = []
+                self.data_arrays[result_name].append(ID, result)
 
-                self.data_arrays[result_name].append(result)
-
-        self._data_temp.append(simpledata)
-        self.data = pd.DataFrame(self._data_temp, columns=self.header)
+        self._buffer.append_values(row)
 
         if self.save_temp:
-            if not os.path.exists(self.folder_dataset_temp):
-                print(f'Warning: {self.folder_dataset_temp} has been created ' \
-                      'but should have been created earlier. ' \
-                      'Check that you have not lost any data',
-                      file=sys.stderr)
-                os.mkdir(self.folder_dataset_temp)
-            if ID == 1:
-                self.data.tail(1).to_csv(
-                    os.path.join(self.folder_dataset_temp, 'data.txt'),
-                    index=False, mode='a', header=self.header)
-            else:
-                self.data.tail(1).to_csv(
-                    os.path.join(self.folder_dataset_temp, 'data.txt'),
-                    index=False, mode='a', header=False)
+            self._jobs.append(('row', ID, row))
 
     def __len__(self):
         """ Returns the number of data point of this dataset """
-        return len(self.data)
+        return len(self._buffer)
 
 
 class ScanSet(dict):
@@ -6,6 +6,7 @@ Created on Sun Sep 29 18:12:24 2019
 """
 
 import os
+import time
 from typing import List
 
 import numpy as np
@@ -30,6 +31,12 @@ elif hasattr(pd.core.computation.ops, 'UndefinedVariableError'): # pd 1.1.5
 else:
     UndefinedVariableError = Exception
 
+# The curve of the scan in progress is redrawn entirely (setData): at most
+# every LIVE_CURVE_INTERVAL seconds, and less often for long curves so that
+# redrawing it takes at most 1/LIVE_CURVE_LOAD of the time
+LIVE_CURVE_INTERVAL = 0.1
+LIVE_CURVE_LOAD = 10
+
 
 class FigureManager:
     """ Manage the figure of the scanner """
@@ -40,6 +47,15 @@ class FigureManager:
         self.curves = []
         self.filter_condition = []
 
+        # Incremental update of the curve of the scan in progress:
+        # curves are only rebuilt if what is plotted changes (see _plotKey)
+        self._plot_key = None
+        self._live_curve = None  # (curve, dataset, number of points plotted)
+        self._live_update = 0.  # time of the last redraw of the live curve
+        self._live_cost = 0.  # duration of this redraw
+        self._live_timer = QtCore.QTimer(singleShot=True)  # redraw postponed
+        self._live_timer.timeout.connect(self.updateLiveCurve)
+
         self._font_size = get_font_size()
 
         # Configure and initialize the figure in the GUI
@@ -173,6 +189,7 @@ class FigureManager:
 
                 self.filter_condition.append(filter_i)
 
+        self._plot_key = None  # filter values are not part of the key
         self.reloadData()
 
     def refresh_filter_combobox(self, comboBox):
@@ -366,17 +383,73 @@ class FigureManager:
             try: self.ax.removeItem(curve)  # try because curve=None if close before end of scan
             except: pass
         self.curves = []
+        self._live_curve = None
         self.figMap.clear()
 
         if self.fig.img_active:
             if self.fig.img.isVisible():
                 self.fig.img.hide() # OPTIMIZE: would be better to erase data
 
+    def _plotKey(self) -> tuple:
+        """ Returns the plot settings and dataset selection the curves depend on """
+        datasets = self.gui.dataManager.datasets
+        index = int(self.gui.data_comboBox.currentIndex())
+        return (self.gui.dataframe_comboBox.currentText(),
+                self.gui.scan_recipe_comboBox.currentText(),
+                self.gui.variable_x_comboBox.currentText(),
+                self.gui.variable_x2_comboBox.currentText(),
+                self.gui.variable_y_comboBox.currentText(),
+                self.gui.variable_x2_checkBox.isChecked(),
+                self.gui.checkBoxFilter.isChecked(),
+                self.nbtraces, len(datasets),
+                id(datasets[index]) if 0 <= index < len(datasets) else None)
+
+    def updateLiveCurve(self) -> bool:
+        """ Appends the new points of the scan in progress to its curve, using
+        views of the dataset columns. The redraw is postponed if the last one
+        is too recent (see LIVE_CURVE_INTERVAL). Returns False if the curves
+        must be rebuilt instead (plot settings or dataset selection changed) """
+        if self._live_curve is None or self._plotKey() != self._plot_key:
+            return False
+
+        curve, dataset, length = self._live_curve
+        if len(dataset) == length: return True
+
+        start = time.perf_counter()
+        wait = self._live_update + max(
+            LIVE_CURVE_INTERVAL, LIVE_CURVE_LOAD*self._live_cost) - start
+        if wait > 0:
+            if not self._live_timer.isActive():
+                self._live_timer.start(int(wait*1000) + 1)
+            return True
+
+        variable_x = self.gui.variable_x_comboBox.currentText()
+        variable_y = self.gui.variable_y_comboBox.currentText()
+        try:
+            x = np.asarray(dataset.getColumn(variable_x), dtype=float)
+            y = np.asarray(dataset.getColumn(variable_y), dtype=float)
+        except (KeyError, TypeError, ValueError):
+            return False
+
+        curve.setData(x, y)
+        self._live_curve = (curve, dataset, len(dataset))
+        self._live_update = time.perf_counter()
+        self._live_cost = self._live_update - start
+
+        if self.displayScan.isVisible(): self.refreshDisplayScanData()
+
+        return True
+
     def reloadData(self):
         ''' Removes any plotted curves and reload all required
-        curves from data available in the data manager'''
+        curves from data available in the data manager.
+        If only new points of the scan in progress are available, they are
+        appended to its curve instead '''
+        if self.updateLiveCurve(): return None
+
         # Remove all curves
         self.clearData()
+        self._plot_key = self._plotKey()
 
         # Get current displayed result
         data_name = self.gui.dataframe_comboBox.currentText()
@@ -417,6 +490,15 @@ class FigureManager:
         can_filter = var_to_display not in (['', ''], ['', '', ''])  # Allows to differentiate images from scan or arrays. Works only because on dataframe_comboBoxCurrentChanged, updateDisplayableResults is called
         filter_condition = self.filter_condition if (
             self.gui.checkBoxFilter.isChecked() and can_filter) else []
+        # Dataset of the last trace, updated incrementally if not filtered
+        live_dataset = None
+        if data_name == "Scan" and not self.displayed_as_image and not any(
+                var_filter['enable'] for var_filter in filter_condition):
+            recipe_name = self.gui.scan_recipe_comboBox.currentText()
+            if 0 <= selectedData < data_len:
+                scanset = self.gui.dataManager.datasets[-(selectedData+1)]
+                if recipe_name in scanset and scanset.display:
+                    live_dataset = scanset[recipe_name]
         data: List[pd.DataFrame] = self.gui.dataManager.getData(
             nbtraces_temp, var_to_display,
             selectedData=selectedData, data_name=data_name,
@@ -600,6 +682,10 @@ class FigureManager:
                     curve.setAlpha(alpha, False)
                     self.curves.append(curve)
 
+                    if i == (len(data) - 1) and live_dataset is not None:
+                        self._live_curve = (curve, live_dataset,
+                                            len(live_dataset))
+
     def axisChanged(self, index):
         """ Called when the displayed result has been changed
         in the combo box. It proceeds to the change. """
@@ -574,6 +574,9 @@ class Scanner(QtWidgets.QMainWindow):
 
         self.figureManager.close()
 
+        # Write the remaining temporary files
+        self.dataManager.close()
+
         # Remove scan variables from VARIABLES
         try: self.configManager.updateVariableConfig([])
         except: pass
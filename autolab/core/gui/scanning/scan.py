@@ -9,18 +9,19 @@ import os
 import time
 import math as m
 import threading
-from collections import OrderedDict
 from queue import Queue
-from itertools import product
 
 import numpy as np
 from qtpy import QtCore, QtWidgets
 
 from ..GUI_utilities import qt_object_exists, MyInputDialog, MyFileDialog
 from ..GUI_instances import instances
+from ...devices import set_io_priority, PRIORITY_SCAN
 from ...paths import PATHS
+from ...server import get_remote_driver, read_remote_variables
 from ...variables import eval_variable, set_variable, has_eval
-from ...utilities import create_array
+from ...utilities import create_array, ParameterSpace
+from .data import ScanPoint
 
 
 class ScanManager:
@@ -268,6 +269,8 @@ class ScanManager:
         self.gui.configManager.updateUndoRedoButtons()
         self.gui.dataManager.timer.stop()
         self.gui.dataManager.sync() # once again to be sure we grabbed every data
+        for dataset in self.gui.dataManager.getLastDataset().values():
+            dataset.close()
         self.thread = None
         self.gui.refresh_widget(self.gui.stop_pushButton)
 
@@ -352,18 +355,18 @@ class ScanThread(QtCore.QThread):
         self.stopFlag = threading.Event()
 
         self.user_response = None
+        self.remote_batches = {}  # {recipe_name: {step index: number of steps}}
 
     def run(self):
+        set_io_priority(PRIORITY_SCAN)  # scan steps go before monitor reads
         # Start the scan
         for recipe_name in self.config:
             if self.config[recipe_name]['active']: self.execRecipe(recipe_name)
 
         self.scanCompletedSignal.emit()
 
-    def execRecipe(self, recipe_name: str,
-                   initPoint: OrderedDict = None):
-        """ Executes a recipe. initPoint is obsolete, was used to add parameters values
-        and master-recipe name to a sub-recipe """
+    def execRecipe(self, recipe_name: str):
+        """ Executes a recipe """
 
         paramValues_list = []
 
@@ -393,25 +396,25 @@ class ScanThread(QtCore.QThread):
             set_variable(param_name, paramValues[0])
             paramValues_list.append(paramValues)
 
+        # Names of the point values, computed once for the whole recipe
+        point_names = ScanPoint.schema(self.config[recipe_name])
+        self.remote_batches[recipe_name] = self.remoteBatches(recipe_name)
+
         ID = 0
         # iter over each parameter (do once if no parameter!)
-        for i, paramValueList in enumerate(product(*paramValues_list)):
+        for i, paramValueList in enumerate(ParameterSpace(paramValues_list)):
 
             if not self.stopFlag.is_set():
 
-                if initPoint is None:  # OBSOLETE
-                    initPoint = OrderedDict()
-                    initPoint[0] = recipe_name
-
-                initPointStep = initPoint.copy()
+                dataPoint = ScanPoint(recipe_name, point_names)
 
                 try:
                     self._source_of_error = None
                     ID += 1
                     set_variable('ID', ID)
 
-                    for parameter, paramValue in zip(
-                            self.config[recipe_name]['parameter'], paramValueList):
+                    for param_index, (parameter, paramValue) in enumerate(zip(
+                            self.config[recipe_name]['parameter'], paramValueList)):
                         self._source_of_error = parameter
                         element = parameter['element']
                         param_name = parameter['name']
@@ -424,13 +427,10 @@ class ScanThread(QtCore.QThread):
                         if element is not None: element(paramValue)
                         self.finishParameterSignal.emit(recipe_name, param_name)
 
-                        initPointStep[param_name] = paramValue
-
-                    dataPoint = initPointStep.copy()
+                        dataPoint.values[param_index] = paramValue
 
                     # Start the recipe
-                    dataPoint = self.processStep(
-                        recipe_name, dataPoint, initPointStep)
+                    dataPoint = self.processStep(recipe_name, dataPoint)
                     # Send the whole data in the queue
                     if not self.stopFlag.is_set(): self.queue.put(dataPoint)
 
@@ -463,19 +463,50 @@ class ScanThread(QtCore.QThread):
         for parameter in self.config[recipe_name]['parameter']:
             self.parameterCompletedSignal.emit(recipe_name, parameter['name'])
 
-    def processStep(self, recipe_name: str,
-                    dataPoint: OrderedDict,
-                    initPoint: OrderedDict):
+    def remoteBatches(self, recipe_name: str) -> dict:
+        """ Returns the consecutive measure steps of variables of the same
+        remote server, read in one round trip, as {first step index: number
+        of steps} """
+        batches = {}
+        first, driver_remote = None, None
+
+        for step_index, stepInfos in enumerate(
+                self.config[recipe_name]['recipe'] + [None]):
+            driver = None
+            if (stepInfos is not None and stepInfos['stepType'] == 'measure'
+                    and getattr(stepInfos['element'], 'cache_ttl', 0) is None):
+                driver = get_remote_driver(stepInfos['element'])
+
+            if driver is None or driver is not driver_remote:
+                if driver_remote is not None and step_index - first > 1:
+                    batches[first] = step_index - first
+                first, driver_remote = step_index, driver
+
+        return batches
+
+    def processStep(self, recipe_name: str, dataPoint: ScanPoint) -> ScanPoint:
         """ Executes the recipe step """
-        for stepInfos in self.config[recipe_name]['recipe']:
+        # steps values are after the parameters values in the point
+        offset = len(self.config[recipe_name]['parameter'])
+        recipe = self.config[recipe_name]['recipe']
+        batches = self.remote_batches.get(recipe_name, {})
+        prefetched = {}
+
+        for step_index, stepInfos in enumerate(recipe):
             self._source_of_error = stepInfos
 
             if not self.stopFlag.is_set():
+                if step_index in batches:
+                    steps = recipe[step_index: step_index + batches[step_index]]
+                    prefetched = dict(zip(
+                        [step['name'] for step in steps],
+                        read_remote_variables([step['element'] for step in steps])))
+
                 # Process the recipe step
-                result = self.processElement(recipe_name, stepInfos, initPoint)
+                result = self.processElement(recipe_name, stepInfos, prefetched)
 
                 if result is not None:
-                    dataPoint[stepInfos['name']] = result
+                    dataPoint.values[offset + step_index] = result
 
                 # Wait until the scan is no more in pause
                 while self.pauseFlag.is_set():
@@ -487,15 +518,19 @@ class ScanThread(QtCore.QThread):
         return dataPoint
 
     def processElement(self, recipe_name: str, stepInfos: dict,
-                       initPoint: OrderedDict):
-        """ Processes the recipe step """
+                       prefetched: dict = None):
+        """ Processes the recipe step. prefetched contains the values of the
+        measure steps already read (see remoteBatches) """
         element = stepInfos['element']
         stepType = stepInfos['stepType']
         self.startStepSignal.emit(recipe_name, stepInfos['name'])
         result = None
 
         if stepType == 'measure':
-            result = element()
+            if prefetched is not None and stepInfos['name'] in prefetched:
+                result = prefetched.pop(stepInfos['name'])
+            else:
+                result = element()
             set_variable(stepInfos['name'], result)
         elif stepType == 'set':
             value = eval_variable(stepInfos['value'])
@@ -521,7 +556,7 @@ class ScanThread(QtCore.QThread):
             else:
                 element()
         elif stepType == 'recipe':  # OBSOLETE
-            self.execRecipe(element, initPoint=initPoint)  # Execute a recipe in the recipe
+            self.execRecipe(element)  # Execute a recipe in the recipe
 
         self.finishStepSignal.emit(recipe_name, stepInfos['name'])
         return result
@@ -2,7 +2,7 @@
 import sys
 
 from .config import get_device_config
-from .drivers import (update_drivers_paths, DRIVERS_PATHS, get_driver_category,
+from .drivers import (get_drivers_index, get_driver_category,
                       load_driver_lib, get_connection_names, get_class_args,
                       get_connection_class, get_driver_class, get_module_names,
                       get_module_class)
@@ -17,18 +17,18 @@ from .devices import list_devices, list_loaded_devices, get_final_device_config
 def _list_drivers(_print: bool = True) -> str:
     ''' Returns a list of all the drivers with categories by sections
     (autolab drivers, local drivers) '''
-    update_drivers_paths()
+    drivers_index = get_drivers_index()
 
     s = '\n'
-    s += f'{len(DRIVERS_PATHS)} drivers found\n\n'
+    s += f'{len(drivers_index)} drivers found\n\n'
 
     for i, (source_name, source) in enumerate(DRIVER_SOURCES.items()):
-        sub_driver_list = sorted([key for key, val in DRIVERS_PATHS.items(
+        sub_driver_list = sorted([key for key, val in drivers_index.items(
             ) if val['source'] == source_name])
         s += f'Drivers in {source}:\n'
         if len(sub_driver_list) > 0:
             txt_list = [[f' - {driver_name}',
-                         f'({get_driver_category(driver_name)})']
+                         f"({drivers_index[driver_name]['category']})"]
                             for driver_name in sub_driver_list]
             s += two_columns(txt_list) + '\n\n'
         else:
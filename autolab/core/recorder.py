@@ -7,7 +7,11 @@ Created on Sun Jul 21 22:13:21 2019
 
 
 import os
+import csv
+import time
 import shutil
+import weakref
+import threading
 
 
 
@@ -194,10 +198,13 @@ class Recorder :
 
 
 class Recorder_V2 :
+    """ Saves rows of values in data.csv. Rows are written through a buffered
+    file, flushed every flush_interval seconds by a background thread (0 to
+    flush every row). Only the last tail rows are kept in memory (see
+    dataframe), in typed columns, so that memory doesn't grow with long
+    recordings. Must be closed, or used as a context manager """
 
-    def __init__(self,name,customPath=None,verbose=True):
-
-        import pandas as pd
+    def __init__(self,name,customPath=None,verbose=True,flush_interval=1.,tail=1000):
 
         if isinstance(name,str) is False or checkForbiddenCharacters(name) is False:
             raise ValueError(f'The name "{name}" is not valid')
@@ -205,16 +212,25 @@ class Recorder_V2 :
         print(f'Starting Recorder with name "{name}"')
 
         self.verbose = verbose
+        self.flush_interval = float(flush_interval)
+        self.tail = max(int(tail), 1)
 
         self.name = name
         self.path = None
 
         self.var = {}
         self.varNameHistory = []
-        self.dataframe = pd.DataFrame()
+        self.buffer = None  # ColumnBuffer of the last rows, created by initialize
         self.started = False
         self.count = 0
 
+        self.dataFile = None
+        self.dataWriter = None
+        self.lastFlush = None
+        self._lock = threading.Lock()  # between save and the flusher thread
+        self._stopFlush = threading.Event()
+        self._flusher = None
+
 
         if customPath is None :
             self.setPath(os.getcwd())
@@ -293,10 +309,37 @@ class Recorder_V2 :
     #--------------------------------------------------------------------------
 
     def initialize(self):
+        from .buffers import ColumnBuffer
+
         self.started = True
 
         os.mkdir(self.path)
 
+        # Typed columns, twice the tail to trim them only once every tail rows
+        self.buffer = ColumnBuffer(self.varNameHistory, capacity=2*self.tail)
+
+        self.dataFile = open(os.path.join(self.getPath(),'data.csv'), 'w', newline='')
+        self.dataWriter = csv.writer(self.dataFile, delimiter=';')
+        self.dataWriter.writerow([''] + self.varNameHistory)
+        self.lastFlush = time.time()
+
+        if self.flush_interval > 0:
+            self._flusher = threading.Thread(
+                target=_flush_periodically, daemon=True,
+                args=(weakref.ref(self), self._stopFlush, self.flush_interval))
+            self._flusher.start()
+
+
+    @property
+    def dataframe(self):
+        """ Returns the last saved rows (at most tail rows) as a DataFrame,
+        indexed by their row number in data.csv """
+        import pandas as pd
+        if self.buffer is None: return pd.DataFrame()
+        with self._lock:
+            df = self.buffer.to_dataframe().iloc[-self.tail:]
+            df.index = range(self.count - len(df), self.count)
+        return df
 
 
     def save(self):
@@ -304,19 +347,67 @@ class Recorder_V2 :
         if self.started is False :
             self.initialize()
 
-        # Ajout du set de variable à la fin du dataframe
-        self.dataframe = self.dataframe.append(self.var, ignore_index=True)
+        values = [self.var[varName] for varName in self.varNameHistory]
 
-        # Copie de la dernière ligne dans le fichier
-        filePath = os.path.join(self.getPath(),'data.csv')
-        if len(self.dataframe) == 1 :
-            self.dataframe=self.dataframe[self.varNameHistory]
-            self.dataframe.iloc[[-1]].to_csv(filePath,sep=';')
-        else :
-            self.dataframe.iloc[[-1]].to_csv(filePath,sep=';', mode='a', header=False)
+        with self._lock:
+            # Ajout du set de variable à la fin des colonnes
+            if len(self.buffer) == 2*self.tail:
+                self.buffer.keep_last(self.tail)
+            self.buffer.append_values(values)
+
+            # Ecriture de la ligne dans le fichier
+            self.dataWriter.writerow([self.count] + values)
+            self.count += 1
+
+        if self.flush_interval <= 0:
+            self.flush()
 
         # Log
         if self.verbose is True :
             print()
             print(f'Recorder "{self.name}" saving data point #{self.count} :')
-            print(self.dataframe.iloc[-1])
+            for varName, value in zip(self.varNameHistory, values) :
+                print(f' - {varName} = {value}')
+            print()
+
+
+    def flush(self):
+        """ Writes the buffered rows to data.csv """
+        with self._lock:
+            if self.dataFile is not None :
+                self.dataFile.flush()
+            self.lastFlush = time.time()
+
+
+    def close(self):
+        """ Stops the flusher thread and closes data.csv """
+        self._stopFlush.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        self._flusher = None
+        with self._lock:
+            if self.dataFile is None : return None
+            self.dataFile.close()
+            self.dataFile = None
+        print(f'Recorder "{self.name}" closed')
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        try: self.close()
+        except Exception: pass
+
+
+def _flush_periodically(recorder_ref, stop: threading.Event, interval: float):
+    """ Flushes the recorder every interval seconds until stop is set.
+    Only keeps a weak reference, to let the recorder be closed by __del__ """
+    while not stop.wait(interval):
+        recorder = recorder_ref()
+        if recorder is None: break
+        recorder.flush()
+        del recorder
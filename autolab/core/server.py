@@ -1,90 +1,346 @@
 # -*- coding: utf-8 -*-
 
+import time
 import socket
+import struct
 import pickle
+import asyncio
+import itertools
 import threading
 import datetime as dt
-from functools import partial
+from typing import Any, List
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 from .config import get_server_config
-from .devices import get_devices_status, get_device
+from .devices import (get_devices_status, get_device, get_element_by_address,
+                      set_io_priority, DEVICES, ELEMENTS, PRIORITY_MONITOR)
+from .elements import Element, Variable, Action, Module, read_sample
+
+
+# =============================================================================
+# FRAMING
+# =============================================================================
+# A message is a python object pickled with protocol 5 (python >= 3.8). The
+# buffers it contains (numpy arrays data) are sent out-of-band, without copy,
+# as frames following the pickle data. A message is sent as:
+# [number of frames (uint32)] [length of each frame (uint64)...] [frames...]
+
+COUNT = struct.Struct('!I')
+LENGTH = struct.Struct('!Q')
+
+
+def pack_message(obj: Any) -> List[memoryview]:
+    """ Returns the buffers to send for obj: the header with the pickle data,
+    then the out-of-band buffers """
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    frames = [memoryview(data)] + [buffer.raw() for buffer in buffers]
+    header = COUNT.pack(len(frames)) + b''.join(
+        LENGTH.pack(frame.nbytes) for frame in frames)
+    return [memoryview(header + data)] + frames[1:]
+
+
+def recv_exactly(sock: socket.socket, buffer: bytearray) -> bytearray:
+    """ Fills buffer with data received from sock, without intermediate copy """
+    view = memoryview(buffer)
+    while len(view) != 0:
+        size = sock.recv_into(view)
+        if size == 0: raise ConnectionError('Connection closed by remote host')
+        view = view[size:]
+    return buffer
+
+
+def send_message(sock: socket.socket, obj: Any):
+    """ Sends obj to sock """
+    for buffer in pack_message(obj):
+        sock.sendall(buffer)
+
+
+def recv_message(sock: socket.socket, max_size: int = None) -> Any:
+    """ Receives an object from sock. If max_size is given, larger messages
+    are refused (used before the handshake) """
+    count, = COUNT.unpack(recv_exactly(sock, bytearray(COUNT.size)))
+    if max_size is not None:
+        assert count*LENGTH.size <= max_size, 'Autolab communication structure not found in message'
+    lengths = [length for length, in LENGTH.iter_unpack(
+        recv_exactly(sock, bytearray(count*LENGTH.size)))]
+    if max_size is not None:
+        assert sum(lengths) <= max_size, 'Autolab communication structure not found in message'
+    frames = [recv_exactly(sock, bytearray(length)) for length in lengths]
+    return pickle.loads(frames[0], buffers=frames[1:])
+
+
+# =============================================================================
+# REMOTE ELEMENTS
+# =============================================================================
+
+def describe_module(module: Module) -> dict:
+    """ Returns the description of module and its elements sent to the
+    clients, used by RemoteModule to mirror it """
+    return {
+        'name': module.name, 'help': module._help,
+        'modules': [describe_module(module.get_module(name))
+                    for name in module.list_modules()],
+        'variables': [{'name': variable.name, 'type': variable.type,
+                       'unit': variable.unit, 'help': variable._help,
+                       'readable': variable.readable,
+                       'writable': variable.writable}
+                      for variable in map(module.get_variable,
+                                          module.list_variables())],
+        'actions': [{'name': action.name, 'type': action.type,
+                     'unit': action.unit, 'help': action._help}
+                    for action in map(module.get_action,
+                                      module.list_actions())],
+        }
+
+
+def execute_operation(element: Element, operation: str, value: Any = None) -> Any:
+    """ Reads ('read'), writes ('write') or does ('do') element.
+    Returns the value read, None otherwise """
+    if operation == 'read':
+        assert isinstance(element, Variable), f"{element.address()} is not a variable"
+        return element()
+    if operation == 'write':
+        assert isinstance(element, Variable), f"{element.address()} is not a variable"
+        assert value is not None, f"No value given to write {element.address()}"
+        element(value)
+    elif operation == 'do':
+        assert isinstance(element, Action), f"{element.address()} is not an action"
+        if value is None: element()
+        else: element(value)
+    else:
+        raise ValueError(f"Unknown operation '{operation}'")
+    return None
+
+
+async def read_message_async(reader: asyncio.StreamReader,
+                             max_size: int = None) -> Any:
+    """ Receives an object from an asyncio stream, see recv_message """
+    count, = COUNT.unpack(await reader.readexactly(COUNT.size))
+    if max_size is not None:
+        assert count*LENGTH.size <= max_size, 'Autolab communication structure not found in message'
+    lengths = [length for length, in LENGTH.iter_unpack(
+        await reader.readexactly(count*LENGTH.size))]
+    if max_size is not None:
+        assert sum(lengths) <= max_size, 'Autolab communication structure not found in message'
+    frames = [await reader.readexactly(length) for length in lengths]
+    # out-of-band buffers must be writable, as the arrays built on them
+    return pickle.loads(frames[0], buffers=[
+        bytearray(frame) for frame in frames[1:]])
+
+
+# =============================================================================
+# SUBSCRIPTIONS
+# =============================================================================
+# A client subscribes to a variable with a sampling rate. The server reads
+# each subscribed variable in a single loop (Sampler), whatever the number of
+# subscribers, and pushes the samples to each subscriber by blocks, reduced
+# according to its mode:
+# None: one sample per period 1/rate of the subscription (the sampler reads
+# at the highest rate of the subscriptions), 'last', 'mean': one value per
+# group of decimation periods, 'minmax': min and max of each group (envelope)
+
+SUBSCRIPTION_MODES = (None, 'last', 'mean', 'minmax')
+
+
+class Subscription():
+    ''' Samples of a variable waiting to be sent to a client '''
+
+    def __init__(self, client, subscription_id: int, rate: float,
+                 mode: str = None, decimation: int = 1, interval: float = 0.1):
+        assert mode in SUBSCRIPTION_MODES, f"Unknown subscription mode '{mode}', must be one of {SUBSCRIPTION_MODES}"
+        assert rate > 0, "Subscription rate must be positive"
+        assert int(decimation) >= 1, "Subscription decimation must be at least 1"
+        self.client = client
+        self.id = subscription_id
+        self.rate = float(rate)
+        self.mode = mode
+        self.decimation = int(decimation)
+        self.interval = float(interval)  # seconds between two blocks
+
+        self.period = self.decimation / self.rate  # of the reduced points
+        self.start = None  # time of the first sample, origin of the groups
+        self.last_slot = -1  # period of the last sample sent (mode None)
+        self.last_block = time.time()
+        self.sending = []  # futures of the blocks not yet written to the client
+        self.dropped = 0  # blocks not sent because the client is too slow
+        self._x = []
+        self._y = []
+
+    def add(self, t: float, value: Any):
+        ''' Adds a sample '''
+        if self.start is None: self.start = t
+        self._x.append(t)
+        self._y.append(value)
+
+    def take_block(self, now: float) -> dict:
+        ''' Returns the message of the samples to send, None if none is ready.
+        Samples of a group not finished yet are kept for the next block '''
+        if now - self.last_block < self.interval or len(self._x) == 0:
+            return None
+        self.last_block = now
+
+        x = np.array(self._x)
+        scalar = all(isinstance(value, float) for value in self._y)
+
+        if self.mode is None:
+            # First sample of each period not sent yet
+            slots = np.floor((x - self.start) * self.rate)
+            keep = np.flatnonzero(np.diff(slots, prepend=self.last_slot) > 0)
+            self.last_slot = slots[-1]
+            values = [self._y[i] for i in keep]
+            self._x, self._y = [], []
+            if len(keep) == 0: return None
+            message = {'x': x[keep]}
+            message['y' if scalar else 'values'] = (
+                np.array(values) if scalar else values)
+            return message
+
+        # Reduce the samples of each finished group
+        groups = np.floor((x - self.start) / self.period).astype(int)
+        finished = groups < int((now - self.start) / self.period)
+        count = int(np.count_nonzero(finished))
+        if count == 0: return None
+        groups = groups[: count]
+        starts = np.flatnonzero(np.diff(groups, prepend=-1))  # first sample of each group
+        ends = np.append(starts[1:], count)
+
+        message = {'x': self.start + groups[starts] * self.period}
+        if not scalar or self.mode == 'last':
+            values = [self._y[end-1] for end in ends]
+            message['y' if scalar else 'values'] = (
+                np.array(values) if scalar else values)
+        else:
+            y = np.array(self._y[: count])
+            if self.mode == 'mean':
+                message['y'] = np.add.reduceat(y, starts) / (ends - starts)
+            else:
+                message['min'] = np.minimum.reduceat(y, starts)
+                message['max'] = np.maximum.reduceat(y, starts)
 
+        del self._x[: count]
+        del self._y[: count]
+        return message
 
-class Driver_SOCKET():
 
-    prefix = b'<AUTOLAB_START>'
-    suffix = b'<AUTOLAB_END>'
+class Sampler(threading.Thread):
+    ''' Reads a variable for all its subscriptions, at the highest rate they
+    asked, like the monitor does (same read function and I/O priority) '''
 
-    def read(self, length=4096):
-        ''' Read pickled object from autolab master and return python object '''
-        # First read
-        msg  = self.socket.recv(length)
-        assert msg != b'', 'Connection closed by remote host'
-        assert msg.startswith(self.prefix), 'Autolab communication structure not found in reply'
+    def __init__(self, server, variable: Variable):
+        super().__init__(name=f'autolab_sampler_{variable.address()}',
+                         daemon=True)
+        self.server = server
+        self.variable = variable
+        self.subscriptions = {}  # {(client, subscription id): Subscription}
+        self.lock = threading.Lock()
+        self.stop_flag = threading.Event()
+        self.wake = threading.Event()  # a subscription was added or stopped
+
+    def run(self):
+        set_io_priority(PRIORITY_MONITOR)  # scan steps go first
+
+        while not self.stop_flag.is_set():
+            with self.lock:
+                subscriptions = list(self.subscriptions.values())
+            if len(subscriptions) == 0:  # stopped by the server
+                self.stop_flag.wait(0.1)
+                continue
+            delay = 1 / max(subscription.rate for subscription in subscriptions)
+
+            t = time.time()
+            try:
+                value = read_sample(self.variable)
+            except Exception as e:
+                for subscription in subscriptions:
+                    self.server.push(subscription, {'error': f'{type(e).__name__}: {e}'})
+                self.stop_flag.wait(max(delay, 1))  # don't flood with errors
+                continue
+
+            for subscription in subscriptions:
+                subscription.add(t, value)
+                message = subscription.take_block(time.time())
+                if message is not None:
+                    self.server.push(subscription, message)
+
+            # Woken up by a new subscription, that may need a higher rate
+            self.wake.wait(max(0, delay - (time.time() - t)))
+            self.wake.clear()
+
+    def add(self, subscription: Subscription):
+        with self.lock:
+            self.subscriptions[(subscription.client, subscription.id)] = subscription
+        self.wake.set()
+
+    def stop(self):
+        self.stop_flag.set()
+        self.wake.set()
+
+    def remove(self, client, subscription_id: int) -> bool:
+        ''' Removes a subscription, returns True if it was the last one '''
+        with self.lock:
+            self.subscriptions.pop((client, subscription_id), None)
+            return len(self.subscriptions) == 0
 
-        # Continue reading up to suffix
-        while not msg.endswith(self.suffix):
-            msg += self.socket.recv(length)
 
-        # Clean msg (remove prefix and suffix) and unpicke it
-        msg = msg.lstrip(self.prefix).rstrip(self.suffix)
-        obj = pickle.loads(msg)
+class Driver_SOCKET():
 
-        return obj
+    def read(self, max_size: int = None) -> Any:
+        ''' Read pickled object from autolab master and return python object '''
+        return recv_message(self.socket, max_size)
 
     def write(self, object):
         ''' Send pickled object to autolab master '''
-        msg = self.prefix + pickle.dumps(object) + self.suffix
-        self.socket.send(msg)
+        send_message(self.socket, object)
 
 
-class ClientThread(threading.Thread, Driver_SOCKET):
+class ClientHandler():
+    ''' Connection of a client to the server. Requests are read as they come
+    and executed concurrently: their replies are sent as soon as they are
+    ready, with the id of their request '''
 
-    def __init__(self, client_socket, server):
-        super().__init__()
-        self.socket = client_socket
+    def __init__(self, server, reader, writer):
         self.server = server
-        self.stop_flag = threading.Event()
+        self.reader = reader
+        self.writer = writer
         self.hostname = None
+        self.closed = False
+        self._write_lock = asyncio.Lock()
+        self._tasks = set()  # requests in progress
 
-    def run(self):
+        client_socket = writer.get_extra_info('socket')
+        if client_socket is not None:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
-        # Handshaking
-        if self.handshake():
-            # Start listening client commands
-            self.listen()
+    async def run(self):
 
-        # Close client socket
-        self.close()
+        try:
+            # Handshaking
+            if await self.handshake():
+                # Start listening client commands
+                await self.listen()
+        finally:
+            # Close client socket
+            self.close()
 
-    def handshake(self) -> bool:
+    async def handshake(self) -> bool:
 
-        ''' Check that incoming connection comes from another Autolab program,
-            and that no thread is already controlling autolab '''
-
-        self.socket.settimeout(2)
+        ''' Check that incoming connection comes from another Autolab program '''
 
         try :
             # Read first command from client
-            handshake_str = self.read()
+            handshake_str = await asyncio.wait_for(
+                read_message_async(self.reader, max_size=1024), 2)
 
             # Check that first client command is 'AUTOLAB?'
-            if handshake_str.startswith('AUTOLAB?'):
+            if isinstance(handshake_str, str) and handshake_str.startswith('AUTOLAB?'):
 
                 self.hostname = handshake_str.split('=')[1]
-
-                # There is no main thread currently running, accepting communication
-                if self.server.active_connection_thread is None:
-                    self.server.active_connection_thread = self
-                    self.server.log(f'Host "{self.hostname}" connected')
-                    self.write('YES')
-                    result = True
-
-                # Another client is controlling autolab, reply that the server is busy, refusing communication
-                else :
-                    self.server.log(f'Host "{self.hostname}" trying to connect but a connection is already established from host "{self.server.active_connection_thread.hostname}"')
-                    self.write(f'A connection to the Autolab server is already established from host "{self.server.active_connection_thread.hostname}".')
-                    result = False
+                self.server.log(f'Host "{self.hostname}" connected')
+                await self.write('YES')
+                result = True
 
             # The client did not ask the right first command, refusing communication
             else: result = False
@@ -93,113 +349,273 @@ class ClientThread(threading.Thread, Driver_SOCKET):
             print(e)
             result = False
 
-        self.socket.settimeout(None)
-
         return result
 
-    def listen(self):
-        ''' Listen and answer client commands '''
-        while not self.stop_flag.is_set():
+    async def listen(self):
+        ''' Listen client commands, each one is answered by its own task '''
+        while True:
             try:
-                command = self.read()
-                self.process_command(command)
-            except:
-                self.stop_flag.set()
-
-    def process_command(self, command):
-        ''' Process given client command '''
-        if isinstance(command, str):
+                command = await read_message_async(self.reader)
+            except (asyncio.IncompleteReadError, ConnectionError, OSError):
+                break
+            except Exception as e:  # the next messages can't be found
+                self.server.log(f'Host "{self.hostname}" sent an invalid message: {type(e).__name__}: {e}')
+                break
             if command == 'CLOSE_CONNECTION':
-                self.stop_flag.set()
-            elif command == 'DEVICES_STATUS?':
-                return self.write(get_devices_status())
+                break
+            task = asyncio.ensure_future(self.process_command(command))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def process_command(self, command):
+        ''' Executes command and sends its reply '''
+        if isinstance(command, dict):
+            reply = await self.server.execute(command, self)
+            reply['id'] = command.get('id')
         else:
-            if command['command'] == 'get_device_model':
-                device_name = command['device_name']
-                structure = get_device(device_name).get_structure()
-                self.write(structure)
-            elif command['command'] == 'request':
-                get_device(device_name).get_by_adress(command['element_adress'])
-                # element_address --> my_yenista::submodule::wavelength
-                wavelength()
+            reply = {'id': None, 'status': 'error',
+                     'error': f'Unknown command {command!r}'}
 
-#command_dict = {'command':'get_driver_model','name':self.name}
+        try:
+            await self.write(reply)
+        except (ConnectionError, OSError):
+            pass  # client disconnected
+        except Exception as e:  # value that can't be pickled
+            await self.write({'id': reply['id'], 'status': 'error',
+                              'error': f'{type(e).__name__}: {e}'})
+
+    async def write(self, obj: Any):
+        ''' Sends obj to the client '''
+        buffers = pack_message(obj)
+        async with self._write_lock:
+            self.writer.writelines(buffers)
+            await self.writer.drain()
 
     def close(self):
+        ''' Closes the connection, only once (called by run and by the server) '''
+        if self.closed: return None
+        self.closed = True
 
-        # In case the close call come from outside of the threading
-        self.socket.close()
+        self.server.unsubscribe_all(self)
+        for task in self._tasks: task.cancel()
+        self.writer.close()
 
-        # If this thread is the main client thread, remove declaration
-        if self.server.active_connection_thread == self:
+        if self.hostname is not None:
             self.server.log(f'Host "{self.hostname}" disconnected')
-            self.server.active_connection_thread = None
+        return None
 
-    def request_close(self):
 
-        self.stop_flag.set()
-        self.socket.shutdown(socket.SHUT_RDWR)
-        self.join()
+class Server():
 
+    def __init__(self, port=None, background=False, host='127.0.0.1'):
+        ''' Starts the server and listens until interrupted, or in a
+        background thread if background is True (close it with close).
+        port=0 uses a free port, see self.port. host is the interface to
+        listen on, the local host only by default: use host='0.0.0.0' to
+        accept connections from all IPv4 interfaces '''
 
-class Server():
+        self.clients = set()
 
-    def __init__(self, port=None):
+        # Driver calls are executed in one thread per device: the requests of
+        # a device are executed in order, different devices work in parallel
+        self._executors = {}
 
-        self.client_threads = []
-        self.active_connection_thread = None
+        # Several clients can use the same device: it is opened once (see
+        # get_device), then its driver calls are serialized by its lane
+        self._device_locks = {}
+        self._device_locks_lock = threading.Lock()
+
+        # One sampler per subscribed variable {address: Sampler}
+        self._samplers = {}
+        self._subscriptions = {}  # {(client, subscription id): address}
+        self._samplers_lock = threading.Lock()
 
         # Load server config in autolab_config.ini
         server_config = get_server_config()
-        if not port: port = int(server_config['port'])
+        if port is None: port = int(server_config['port'])
         self.port = port
+        self.host = host
+
+        self.loop = asyncio.new_event_loop()
 
         # Start the server
-        self.start()
+        self.loop.run_until_complete(self.start())
 
         # Start listening
-        try: self.listen()
-        except: print('You excited the server (TO CHANGE)')
-        self.close()
+        if background:
+            self.listen_thread = threading.Thread(
+                target=self.loop.run_forever, name='autolab_server', daemon=True)
+            self.listen_thread.start()
+        else:
+            self.listen_thread = None
+            try: self.loop.run_until_complete(self.listen())
+            except: print('You excited the server (TO CHANGE)')
+            self.close()
 
 
-    def start(self):
+    async def start(self):
         ''' Start the server '''
-        self.main_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.main_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.main_socket.bind(('', self.port))
-        self.main_socket.listen(0)
+        self.main_server = await asyncio.start_server(
+            self.handle_client, host=self.host, port=self.port)
+        self.port = self.main_server.sockets[0].getsockname()[1]
         self.log(f'Autolab server running, waiting for incoming connections on port {self.port}')
 
 
-    def listen(self):
+    async def listen(self):
+        ''' Accepts connections until the server is closed '''
+        await self.main_server.serve_forever()
 
-        while True:
 
-            # Wait incoming connection
-            client_socket, _ = self.main_socket.accept()
+    async def handle_client(self, reader, writer):
+        ''' Serves a new connection '''
+        client = ClientHandler(self, reader, writer)
+        self.clients.add(client)
+        try: await client.run()
+        finally: self.clients.discard(client)
+
+
+    def get_executor(self, device_name: str) -> ThreadPoolExecutor:
+        ''' Returns the executor of the driver calls of device_name '''
+        executor = self._executors.get(device_name)
+        if executor is None:
+            executor = self._executors[device_name] = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f'autolab_server_{device_name}')
+        return executor
+
 
-            # Clean terminated threads
-            self.clean_client_threads()
+    async def execute(self, command: dict, client: ClientHandler = None) -> dict:
+        ''' Executes command in the executor of its device, see process_command '''
+        if command.get('command') == 'get_device_model':
+            executor = self.get_executor(command['device_name'])
+        elif command.get('command') in ('request', 'subscribe'):
+            executor = self.get_executor(command['element_address'].split('.')[0])
+        elif command.get('command') == 'batch' and len(command['operations']) != 0:
+            # operations are executed in order, by the executor of the first one
+            executor = self.get_executor(
+                command['operations'][0]['element_address'].split('.')[0])
+        else:
+            executor = None  # default executor of the loop
+
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, self.process_command, command, client)
 
-            # Start new client thread
-            client_thread = ClientThread(client_socket, self)
-            client_thread.start()
-            self.client_threads.append(client_thread)
 
+    def process_command(self, command: dict, client: ClientHandler = None) -> dict:
+        ''' Process given client command, returns its reply '''
+        address = None  # element in error
+        try:
+            if command['command'] == 'subscribe':
+                address = command['element_address']
+                value = self.subscribe(client, command)
+                address = None
+            elif command['command'] == 'unsubscribe':
+                value = self.unsubscribe(client, command['subscription'])
+            elif command['command'] == 'get_devices_status':
+                value = get_devices_status()
+            elif command['command'] == 'get_device_model':
+                device = self.get_device(command['device_name'])
+                value = describe_module(device)
+            elif command['command'] in ('request', 'batch'):
+                operations = (command['operations'] if command['command'] == 'batch'
+                              else [command])
+                value = []
+                for operation in operations:
+                    address = operation['element_address']
+                    value.append(execute_operation(
+                        self.get_element(address),
+                        operation['operation'], operation['value']))
+                address = None
+                if command['command'] == 'request': value = value[0]
+            else:
+                raise ValueError(f"Unknown command '{command['command']}'")
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+            if address is not None: error = f'{address}: {error}'
+            return {'status': 'error', 'error': error}
+
+        return {'status': 'ok', 'value': value}
+
+
+    def subscribe(self, client: ClientHandler, command: dict) -> int:
+        ''' Subscribes client to the variable at command['element_address'],
+        with the options of Subscription. The samples are pushed to the
+        client with the id of the subscribe command, returned '''
+        variable = self.get_element(command['element_address'])
+        assert isinstance(variable, Variable) and variable.readable, f"{variable.address()} is not a readable variable"
+        subscription = Subscription(
+            client, command['id'], command['rate'], command.get('mode'),
+            command.get('decimation', 1), command.get('interval', 0.1))
+
+        with self._samplers_lock:
+            address = variable.address()
+            key = (client, subscription.id)
+            assert key not in self._subscriptions, f"Subscription {subscription.id} already exists"
+            self._subscriptions[key] = address
+            sampler = self._samplers.get(address)
+            if sampler is None:
+                sampler = self._samplers[address] = Sampler(self, variable)
+                sampler.add(subscription)
+                sampler.start()
+            else:
+                sampler.add(subscription)
+
+        return subscription.id
+
+
+    def unsubscribe(self, client: ClientHandler, subscription_id: int):
+        ''' Removes a subscription of client, and stops the sampler of its
+        variable if it was the last one '''
+        with self._samplers_lock:
+            address = self._subscriptions.pop((client, subscription_id), None)
+            assert address is not None, f"Subscription {subscription_id} not found"
+            if self._samplers[address].remove(client, subscription_id):
+                self._samplers.pop(address).stop()
+
+
+    def unsubscribe_all(self, client: ClientHandler):
+        ''' Removes the subscriptions of client '''
+        with self._samplers_lock:
+            keys = [key for key in self._subscriptions if key[0] is client]
+        for key in keys:
+            self.unsubscribe(*key)
+
+
+    def push(self, subscription: Subscription, message: dict):
+        ''' Sends a block of samples to a subscriber (from a sampler thread).
+        The block is dropped if the client didn't receive the previous ones '''
+        subscription.sending = [future for future in subscription.sending
+                                if not future.done()]
+        if len(subscription.sending) >= 10:
+            subscription.dropped += 1
+            return None
+
+        message['subscription'] = subscription.id
+        message['dropped'] = subscription.dropped
+        try:
+            subscription.sending.append(asyncio.run_coroutine_threadsafe(
+                subscription.client.write(message), self.loop))
+        except RuntimeError:
+            pass  # server closed
+        return None
 
-    def clean_client_threads(self):
-        ''' Remove finshed client threads from the list '''
-        self.client_threads = [t for t in self.client_threads if t.is_alive()]
 
-    def close_client_threads(self):
-        ''' Close any existing client thread '''
-        self.clean_client_threads()
+    def get_element(self, address: str) -> Element:
+        ''' Returns the element at address, opening its device if needed '''
+        element = ELEMENTS.get(address)
+        if element is not None: return element
+        self.get_device(address.split('.')[0])
+        return get_element_by_address(address)
 
-        for thread in self.client_threads:
-            thread.request_close()
 
-        self.client_threads = []
+    def get_device(self, device_name: str):
+        ''' Returns the Device device_name. Opened only once if several
+        clients ask for it at the same time '''
+        device = DEVICES.get(device_name)
+        if device is not None: return device
+        with self._device_locks_lock:
+            lock = self._device_locks.setdefault(device_name, threading.Lock())
+        with lock:
+            return get_device(device_name)
 
 
     def log(self, log):
@@ -208,20 +624,49 @@ class Server():
         print(f'{timestamp}: {log}')
 
 
+    async def _close(self):
+        ''' Stops accepting connections and closes the client connections '''
+        self.main_server.close()
+        for client in list(self.clients):
+            client.close()
+
+
     def close(self):
-        ''' Close the server and client threads'''
-        self.close_client_threads()
-        self.main_socket.shutdown(socket.SHUT_RDWR)
-        self.main_socket.close()
+        ''' Close the server and client connections'''
+        if self.loop.is_closed(): return None
+
+        if self.listen_thread is not None:
+            asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.listen_thread.join()
+        else:
+            self.loop.run_until_complete(self._close())
+        self.loop.close()
+
+        with self._samplers_lock:
+            for sampler in self._samplers.values():
+                sampler.stop()
+            self._samplers.clear()
+            self._subscriptions.clear()
+
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
+        return None
 
 
 class Driver_REMOTE(Driver_SOCKET):
+    ''' Driver of the devices of a remote Autolab server. Each remote device is
+    a module of this driver, with the same elements as the remote Device:
+    reading, writing or doing an element sends a request to the server.
+    devices is the list (or comma separated names) of the remote devices
+    to use, by default the ones already opened on the server. '''
 
-    def __init__(self, address='192.168.1.1', port=4001):
-        from functools import partial
+    def __init__(self, address='192.168.1.1', port=4001, devices=None):
 
         self.address = address
         self.port = int(port)
+        self._lock = threading.Lock()  # one request at a time on the socket
+        self._ids = itertools.count()
 
         # Connection au serveur Autolab
         self.connect()
@@ -231,12 +676,20 @@ class Driver_REMOTE(Driver_SOCKET):
 
         # Retourne la liste des devices
         self.devices_status = self.get_devices_status()
-        print(self.devices_status)
+
+        if devices is None:
+            devices = [name for name, loaded in self.devices_status.items() if loaded]
+        elif isinstance(devices, str):
+            devices = [name.strip() for name in devices.split(',') if name.strip() != '']
+        for device_name in devices:
+            assert device_name in self.devices_status, f"Device '{device_name}' not found on Autolab server at {self.address}:{self.port}"
+        self.devices = list(devices)
 
 
     def connect(self):
         ''' Initialize connection with autolab server '''
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.socket.settimeout(2)
         self.socket.connect((self.address, self.port))
         self.socket.settimeout(None)
@@ -253,73 +706,338 @@ class Driver_REMOTE(Driver_SOCKET):
 
     def disconnect(self):
         ''' Close autolab server connection '''
-        self.socket.write('CLOSE_CONNECTION')
-        self.socket.shutdown(socket.SHUT_RDWR)
-        self.socket.close()
+        with self._lock:
+            try:
+                self.write('CLOSE_CONNECTION')
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError: pass  # server already closed
+            self.socket.close()
+
+    def close(self):
+        ''' Called by Device.close '''
+        self.disconnect()
 
     def get_devices_status(self): # Déjà instantié ou non
-        self.write('DEVICES_STATUS?')
-        return self.read()
+        return self.request({'command': 'get_devices_status'})
+
+    def request(self, command: dict) -> Any:
+        ''' Sends command to the server and returns the value of its reply '''
+        with self._lock:
+            command = dict(command, id=next(self._ids))
+            self.write(command)
+            reply = self.read()
+        assert reply['id'] == command['id'], f"Autolab server {self.address}:{self.port}: reply to an unknown request"
+        if reply['status'] == 'error':
+            raise RuntimeError(f"Autolab server {self.address}:{self.port}: {reply['error']}")
+        return reply['value']
+
+    def execute(self, address: str, operation: str, value: Any = None) -> Any:
+        ''' Reads ('read'), writes ('write') or does ('do') the remote element at
+        address, and returns the value read (None otherwise) '''
+        return self.request({'command': 'request', 'element_address': address,
+                             'operation': operation, 'value': value})
+
+    def batch(self, operations: List[tuple]) -> List[Any]:
+        ''' Executes several operations (address, operation[, value]) in one
+        round trip, in order. Returns the list of their results '''
+        operations = [{'element_address': operation[0],
+                       'operation': operation[1],
+                       'value': operation[2] if len(operation) > 2 else None}
+                      for operation in operations]
+        return self.request({'command': 'batch', 'operations': operations})
+
+    def read_variables(self, variables: List[Any]) -> List[Any]:
+        ''' Reads several variables of this driver in one round trip.
+        variables are the (local) Variable elements of the remote devices '''
+        return self.batch([(variable.read_function.__self__.address, 'read')
+                           for variable in variables])
 
     def get_driver_model(self):
         model = []
-        for dev_name in self.devices_status.keys():
-            a = FakeDriver(self, dev_name, status)
-            model.append({'element': 'module', 'name': dev_name, 'object': a})
-            a.get_driver_model()
-            partial(devices.Device, dev_name)
+        for dev_name in self.devices:
+            description = self.request({'command': 'get_device_model',
+                                        'device_name': dev_name})
+            config = {'element': 'module', 'name': dev_name,
+                      'object': RemoteModule(self, dev_name, description)}
+            if description['help'] is not None:
+                config['help'] = description['help']
+            model.append(config)
         return model
 
-    def get_device(self, dev_name):
-        pass
 
-    def get_device_structure(self):
-        pass
-            # Pour un device de slave donné, retourne sa structure de (sous-devices, modules, action variable) à l’instant t
-            # Device non instantité : ne renvoie rien
-            # Device instantié : renvoie structure en (modules, action, variable)
+class RemoteElement():
+    ''' Functions of a remote variable or action, used by its local element '''
 
+    def __init__(self, driver_remote, address):
+        self.driver_remote = driver_remote
+        self.address = address
+
+    def read(self):
+        return self.driver_remote.execute(self.address, 'read')
+
+    def write(self, value):
+        self.driver_remote.execute(self.address, 'write', value)
+
+    def do(self, value=None):
+        self.driver_remote.execute(self.address, 'do', value)
 
-class FakeDriver():
 
-    def __init__(self, driver_remote, name, status):
+class RemoteModule():
+    ''' Driver object of a remote module, built from its description
+    (see describe_module) '''
 
+    def __init__(self, driver_remote, address, description):
         self.driver_remote = driver_remote
-        self.name = name
-        self.status = status
+        self.address = address
+        self.description = description
 
     def get_driver_model(self):
         model = []
-        if status is False:
-            return model
-        else:
-            command_dict = {'command': 'get_device_structure', 'name': self.name}
-            remote_device_structure = self.driver_remote.write(command_dict)
 
-            for key in remote_device_structure.keys():
-                if remote_device_structure[key] == 'variable':
-                    arg = {'command': 'request', address: 'yenista::wavelength'}
-                    #model.append({'element':remote_device_structure[key], 'name':key, 'read': partial(self.interact,'read',address) .., 'write'})
-                elif remote_device_structure[key] == 'action':
-                    pass
-                elif remote_device_structure[key] == 'module':
-                    pass
+        for description in self.description['modules']:
+            config = {'element': 'module', 'name': description['name'],
+                      'object': RemoteModule(
+                          self.driver_remote,
+                          f"{self.address}.{description['name']}", description)}
+            if description['help'] is not None:
+                config['help'] = description['help']
+            model.append(config)
+
+        for description in self.description['variables']:
+            element = RemoteElement(self.driver_remote,
+                                    f"{self.address}.{description['name']}")
+            config = {'element': 'variable', 'name': description['name'],
+                      'type': description['type']}
+            if description['readable']: config['read'] = element.read
+            if description['writable']: config['write'] = element.write
+            if description['unit'] is not None: config['unit'] = description['unit']
+            if description['help'] is not None: config['help'] = description['help']
+            model.append(config)
+
+        for description in self.description['actions']:
+            element = RemoteElement(self.driver_remote,
+                                    f"{self.address}.{description['name']}")
+            config = {'element': 'action', 'name': description['name'],
+                      'do': element.do}
+            if description['type'] is not None:
+                config['param_type'] = description['type']
+                if description['unit'] is not None:
+                    config['param_unit'] = description['unit']
+            if description['help'] is not None: config['help'] = description['help']
+            model.append(config)
+
+        return model
+
 
-            return remote_driver_model
+def get_remote_driver(variable: Variable):
+    ''' Returns the Driver_REMOTE reading variable, None if variable is not
+    a variable of a remote device '''
+    remote = getattr(getattr(variable, 'read_function', None), '__self__', None)
+    return remote.driver_remote if isinstance(remote, RemoteElement) else None
 
-    def interact(interaction_type, address):
-        pass
 
+def read_remote_variables(variables: List[Variable]) -> List[Any]:
+    ''' Reads variables of the same Driver_REMOTE in one round trip, through
+    the lane of their device. The variables are updated as if each one was
+    read (read signal, value of tuples) '''
+    driver_remote = get_remote_driver(variables[0])
+    answers = variables[0]._execute(driver_remote.read_variables, variables)
+    for variable, answer in zip(variables, answers):
+        if variable._read_signal is not None: variable._read_signal.emit_read(answer)
+        if variable.type in [tuple]: variable.value = answer
+    return answers
 
-#{'slot1': {'power': 'variable', 'wavelength': 'variable'},
-# 'amplitude': 'variable',
-# 'something': 'action'}
 
-#def get_driver_model(self):
+class AsyncClient():
+    ''' asyncio client of an Autolab server. Requests can be pipelined: many
+    requests can be awaited at the same time, each reply is matched to its
+    request by its id, in the order the server completes them. Requests to
+    different devices are executed in parallel by the server.
 
- #    model = []
-#    model.append({'element':'variable','name':'amplitude','write':self.amplitude,'read':self.get_amplitude,'unit':'V','type':float,'help':'Amplitude'})
-#    model.append({'element':'variable','name':'offset','write':self.offset,'read':self.get_offset,'unit':'V','type':float,'help':'Offset'})
-#    model.append({'element':'variable','name':'frequency','write':self.frequency,'read':self.get_frequency,'unit':'Hz','type':float,'help':'Frequency'})
+    async with AsyncClient(address, port) as client:
+        powers = await asyncio.gather(*[
+            client.execute(f'{name}.power', 'read') for name in names])
+    '''
 
-#    return model
+    def __init__(self, address='192.168.1.1', port=4001):
+
+        self.address = address
+        self.port = int(port)
+        self._ids = itertools.count()
+        self._pending = {}  # {request id: future of the reply}
+        self._subscriptions = {}  # {subscription id: RemoteSubscription}
+        self._write_lock = None
+        self._read_task = None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def connect(self):
+        ''' Initialize connection with autolab server '''
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.address, self.port), 2)
+        client_socket = self.writer.get_extra_info('socket')
+        if client_socket is not None:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._write_lock = asyncio.Lock()
+
+        # Handshaking
+        await self.write(f'AUTOLAB?HOSTNAME={socket.gethostname()}')
+        try:
+            answer = await asyncio.wait_for(read_message_async(self.reader), 2)
+            assert answer == 'YES', answer
+        except Exception as e:
+            self.writer.close()
+            raise ValueError(f'Impossible to join autolab server at {self.address}:{self.port} \n {e}')
+
+        self._read_task = asyncio.ensure_future(self._read_replies())
+        return self
+
+    async def close(self):
+        ''' Close autolab server connection '''
+        if self._read_task is None: return None
+        try: await self.write('CLOSE_CONNECTION')
+        except (ConnectionError, OSError): pass
+        self._read_task.cancel()
+        self._read_task = None
+        self.writer.close()
+        self._fail_pending(ConnectionError('Connection to Autolab server closed'))
+        return None
+
+    async def write(self, obj: Any):
+        ''' Sends obj to the server '''
+        buffers = pack_message(obj)
+        async with self._write_lock:
+            self.writer.writelines(buffers)
+            await self.writer.drain()
+
+    def _fail_pending(self, error: Exception):
+        ''' Raises error in the requests waiting for a reply and in the
+        subscriptions '''
+        for future in self._pending.values():
+            if not future.done(): future.set_exception(error)
+        self._pending.clear()
+        for subscription in self._subscriptions.values():
+            subscription._put({'error': str(error)})
+        self._subscriptions.clear()
+
+    async def _read_replies(self):
+        ''' Gives the replies to their requests as they arrive '''
+        try:
+            while True:
+                reply = await read_message_async(self.reader)
+                if 'subscription' in reply:  # block of samples
+                    subscription = self._subscriptions.get(reply['subscription'])
+                    if subscription is not None: subscription._put(reply)
+                    continue
+                future = self._pending.pop(reply.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        except Exception as e:
+            self._fail_pending(ConnectionError(
+                f'Connection to Autolab server {self.address}:{self.port} lost: {e}'))
+
+    async def request(self, command: dict) -> Any:
+        ''' Sends command to the server and returns the value of its reply '''
+        assert self._read_task is not None, 'Not connected to an Autolab server'
+        if 'id' not in command: command = dict(command, id=next(self._ids))
+        future = asyncio.get_running_loop().create_future()
+        self._pending[command['id']] = future
+        try:
+            await self.write(command)
+        except BaseException:
+            self._pending.pop(command['id'], None)
+            raise
+        reply = await future
+        if reply['status'] == 'error':
+            raise RuntimeError(f"Autolab server {self.address}:{self.port}: {reply['error']}")
+        return reply['value']
+
+    async def get_devices_status(self) -> dict:
+        return await self.request({'command': 'get_devices_status'})
+
+    async def get_device_model(self, device_name: str) -> dict:
+        ''' Returns the description of a remote device, see describe_module '''
+        return await self.request({'command': 'get_device_model',
+                                   'device_name': device_name})
+
+    async def execute(self, address: str, operation: str, value: Any = None) -> Any:
+        ''' Reads ('read'), writes ('write') or does ('do') the remote element at
+        address, and returns the value read (None otherwise) '''
+        return await self.request({'command': 'request', 'element_address': address,
+                                   'operation': operation, 'value': value})
+
+    async def batch(self, operations: List[tuple]) -> List[Any]:
+        ''' Executes several operations (address, operation[, value]) in one
+        round trip, in order. Returns the list of their results '''
+        operations = [{'element_address': operation[0],
+                       'operation': operation[1],
+                       'value': operation[2] if len(operation) > 2 else None}
+                      for operation in operations]
+        return await self.request({'command': 'batch', 'operations': operations})
+
+    async def subscribe(self, address: str, rate: float, mode: str = None,
+                        decimation: int = 1, interval: float = 0.1,
+                        maxsize: int = 1000):
+        ''' Subscribes to the remote variable at address, read rate times per
+        second by the server. Returns a RemoteSubscription receiving the
+        samples by blocks every interval seconds. mode reduces the samples,
+        see SUBSCRIPTION_MODES '''
+        assert mode in SUBSCRIPTION_MODES, f"Unknown subscription mode '{mode}', must be one of {SUBSCRIPTION_MODES}"
+        subscription = RemoteSubscription(self, next(self._ids), maxsize)
+        self._subscriptions[subscription.id] = subscription
+        try:
+            await self.request({'command': 'subscribe', 'id': subscription.id,
+                                'element_address': address, 'rate': rate,
+                                'mode': mode, 'decimation': decimation,
+                                'interval': interval})
+        except BaseException:
+            self._subscriptions.pop(subscription.id, None)
+            raise
+        return subscription
+
+    async def unsubscribe(self, subscription):
+        ''' Stops a subscription '''
+        if self._subscriptions.pop(subscription.id, None) is not None:
+            await self.request({'command': 'unsubscribe',
+                                'subscription': subscription.id})
+
+
+class RemoteSubscription():
+    ''' Blocks of samples pushed by the server for a subscription, as dict
+    with the times 'x' and the values 'y' (or 'min' and 'max' in minmax mode,
+    or 'values' for arrays and dataframes). Use get, or async for, to receive
+    them. If the client doesn't read them fast enough, oldest blocks are
+    dropped after maxsize blocks '''
+
+    def __init__(self, client: AsyncClient, subscription_id: int, maxsize: int = 1000):
+        self.client = client
+        self.id = subscription_id
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0  # blocks dropped by the client
+
+    def _put(self, block: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(block)
+
+    async def get(self) -> dict:
+        ''' Returns the next block, raises the read errors of the server '''
+        block = await self.queue.get()
+        if 'error' in block:
+            raise RuntimeError(f"Subscription {self.id}: {block['error']}")
+        return block
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        return await self.get()
+
+    async def close(self):
+        ''' Stops the subscription '''
+        await self.client.unsubscribe(self)
@@ -4,15 +4,19 @@ Created on Fri Oct 18 23:09:51 2019
 
 @author: qchat
 """
-from typing import Any, List, Tuple
+from typing import Any, List, Tuple, TYPE_CHECKING
 import re
 import ast
 from io import StringIO
 import platform
 import os
+from itertools import product
+from collections.abc import Sequence
 
 import numpy as np
-import pandas as pd
+
+if TYPE_CHECKING:  # pandas is imported on first use, it is slow to import
+    import pandas as pd
 
 
 SUPPORTED_EXTENSION = "Text Files (*.txt);; Supported text Files (*.txt;*.csv;*.dat);; Any Files (*)"
@@ -110,6 +114,53 @@ def create_array(value: Any) -> np.ndarray:
     return value
 
 
+class ParameterSpace:
+    """ Lazy cartesian product of the values of several parameters.
+    Points are never stored: the point at a flat index is found with index
+    arithmetic (np.unravel_index) on the per-parameter value arrays, the
+    last parameter varying the fastest like itertools.product.
+    The values are indexed as given (arrays, lists, tuples...), other
+    iterables are converted to lists, so values of mixed types keep their type """
+
+    def __init__(self, values_list: List[Any], names: List[str] = None):
+        self.values_list = [values if isinstance(values, (np.ndarray, Sequence))
+                            else list(values)
+                            for values in values_list]
+        self.shape = tuple(len(values) for values in self.values_list)
+        self.names = list(names) if names is not None else None
+        if self.names is not None:
+            assert len(self.names) == len(self.values_list), \
+                "Must provide one name per parameter"
+
+    def __len__(self) -> int:
+        """ Returns the number of points """
+        size = 1
+        for length in self.shape: size *= length
+        return size
+
+    def unravel(self, index: int) -> Tuple[int, ...]:
+        """ Returns the index of each parameter for the point at flat index """
+        size = len(self)
+        if index < 0: index += size
+        if not 0 <= index < size:
+            raise IndexError(f"Index {index} out of range for {size} points")
+        return tuple(int(i) for i in np.unravel_index(index, self.shape))
+
+    def __getitem__(self, index: int) -> Tuple[Any, ...]:
+        """ Returns the parameters values of the point at flat index """
+        return tuple(values[i] for values, i in zip(
+            self.values_list, self.unravel(index)))
+
+    def as_dict(self, index: int) -> dict:
+        """ Returns the point at flat index as {name: value} """
+        assert self.names is not None, "No names given to this parameter space"
+        return dict(zip(self.names, self[index]))
+
+    def __iter__(self):
+        """ Iterates over the points in flat index order, without storing them """
+        return product(*self.values_list)
+
+
 def str_to_array(s: str) -> np.ndarray:
     ''' Convert string to a numpy array '''
     if "," in s: ls = re.sub(r'\s,+', ',', s)
@@ -125,8 +176,9 @@ def array_to_str(value: Any, threshold: int = None, max_line_width: int = None)
                            threshold=threshold, max_line_width=max_line_width)
 
 
-def str_to_dataframe(s: str) -> pd.DataFrame:
+def str_to_dataframe(s: str) -> 'pd.DataFrame':
     ''' Convert a string to a pandas DataFrame '''
+    import pandas as pd
     if s == '\r\n':  # empty
         df = pd.DataFrame()
     else:
@@ -135,8 +187,9 @@ def str_to_dataframe(s: str) -> pd.DataFrame:
     return df
 
 
-def dataframe_to_str(value: pd.DataFrame, threshold=1000) -> str:
+def dataframe_to_str(value: 'pd.DataFrame', threshold=1000) -> str:
     ''' Convert a pandas DataFrame to a string '''
+    import pandas as pd
     if isinstance(value, str) and value == '': value = None
     return pd.DataFrame(value).head(threshold).to_csv(index=False, sep="\t")  # can't display full data to QLineEdit, need to truncate (numpy does the same)
 
@@ -157,6 +210,7 @@ def str_to_data(s: str) -> Any:
 
 def data_to_str(value: Any) -> str:
     """ Convert data to str with special format for ndarray and dataframe """
+    import pandas as pd
     if isinstance(value, np.ndarray):
         raw_value_str = array_to_str(value, threshold=1000000, max_line_width=9000000)
     elif isinstance(value, pd.DataFrame):
@@ -174,8 +228,9 @@ def open_file(filename: str):
     elif system == 'Darwin': os.system(f'open "{filename}"')
 
 
-def data_to_dataframe(data: Any) -> pd.DataFrame:
+def data_to_dataframe(data: Any) -> 'pd.DataFrame':
     """ Format data to DataFrame """
+    import pandas as pd
     try: data = pd.DataFrame(data)
     except ValueError: data = pd.DataFrame([data])
 
@@ -6,7 +6,11 @@ Created on Mon Mar  4 14:54:41 2024
 """
 
 import re
-from typing import Any, List, Tuple
+import ast
+import threading
+from collections import OrderedDict, ChainMap
+from typing import Any, List, Tuple, FrozenSet
+from types import CodeType
 
 import numpy as np
 import pandas as pd
@@ -47,16 +51,29 @@ VARIABLES = {}
 
 EVAL = "$eval:"
 
+# Compiled expressions: {expression: (code object or None, referenced names,
+# True if the expression only reads names and calls variables)}. Code objects don't depend on the namespace, so entries are only evicted
+# when the cache is full (least recently used first)
+EXPRESSIONS_CACHE_SIZE = 512
+_EXPRESSIONS = OrderedDict()
+_EXPRESSIONS_LOCK = threading.Lock()
+
+# Dependency graph of the variables: {name: names of the variables whose
+# expression references name}. Used to invalidate the cached values of the
+# dependents of a variable when it is written
+_DEPENDENTS = {}
 
-def update_allowed_dict() -> dict:
-    global allowed_dict  # needed to remove variables instead of just adding new one
-    allowed_dict = {"np": np, "pd": pd}
-    allowed_dict.update(DEVICES)
-    allowed_dict.update(VARIABLES)
-    return allowed_dict
 
+# Namespace of the $eval: expressions. Live view of the registries: variables
+# hide devices which hide np and pd. Adding, modifying or removing a device or
+# a variable doesn't need any update of the namespace
+allowed_dict = ChainMap(VARIABLES, DEVICES, {"np": np, "pd": pd})
 
-allowed_dict = update_allowed_dict()
+
+def update_allowed_dict() -> ChainMap:
+    """ Returns the namespace of the $eval: expressions. Kept for
+    compatibility, the namespace is always up to date """
+    return allowed_dict
 
 # OPTIMIZE: Variable becomes closer and closer to core.elements.Variable, could envision a merge
 # TODO: refresh menu display by looking if has eval (no -> can refresh)
@@ -72,6 +89,9 @@ class Variable():
         self.unit = None
         self.writable = True
         self.readable = True
+        self._depends = frozenset()  # names referenced by raw
+        self._valid = False  # True if value is up to date with its inputs
+        self._generation = 0  # changed when value becomes outdated
         self._rename(name)
         self.write_function(var)
 
@@ -79,7 +99,15 @@ class Variable():
             self.name = new_name
             self.address = lambda: new_name
 
+    def _is_registered(self) -> bool:
+        """ Returns True if this variable is the one stored in VARIABLES """
+        return VARIABLES.get(self.name) is self
+
     def write_function(self, var: Any):
+        raw = var.raw if isinstance(var, Variable) else var
+        if self._is_registered():
+            check_circular_definition(self.name, raw)
+
         if isinstance(var, Variable):
             self.raw = var.raw
             self.value = var.value
@@ -87,6 +115,15 @@ class Variable():
             self.raw = var
             self.value = 'Need update' if has_eval(self.raw) else self.raw
 
+        old_depends = self._depends
+        self._depends = get_referenced_names(self.raw) if has_eval(
+            self.raw) else frozenset()
+        self._invalidate()
+        if self._is_registered():
+            if self._depends != old_depends:
+                _update_dependencies(self, old_depends)
+            invalidate_dependents(self.name)
+
         # If no devices or variables with char '(' found in raw, can evaluate value safely
         if not has_variable(self.raw) or '(' not in self.raw:
             try: self.value = self.read_function()
@@ -94,11 +131,28 @@ class Variable():
 
         self.type = type(self.raw)  # For slider
 
+    def _invalidate(self):
+        """ Marks value as outdated, including a value being evaluated """
+        self._generation += 1  # before _valid, see read_function
+        self._valid = False
+
     def read_function(self):
         if has_eval(self.raw):
-            value = str(self.raw)[len(EVAL): ]
-            call = eval(str(value), {}, allowed_dict)
+            if self._valid: return self.value
+
+            generation = self._generation
+            code, _, pure = compile_expression(str(self.raw)[len(EVAL): ])
+            call = eval(code, {}, allowed_dict)
             self.value = call
+            # Only a value computed from variables is kept: devices are read
+            # live, and other calls or attributes (np.random.rand(),
+            # time.time(), ...) can return a new value each time. A value is
+            # not kept either if an input was written during the evaluation
+            self._valid = self._is_registered() and pure and all(
+                name in VARIABLES and (
+                    VARIABLES[name]._valid or not has_eval(VARIABLES[name].raw))
+                for name in self._depends)
+            if generation != self._generation: self._valid = False
         else:
             call = self.value
 
@@ -123,7 +177,7 @@ def rename_variable(name: str, new_name: str):
     var = VARIABLES.pop(name)
     VARIABLES[new_name] = var
     var._rename(new_name)
-    update_allowed_dict()
+    _rebuild_dependencies()
 
 
 def set_variable(name: str, value: Any) -> Variable:
@@ -131,6 +185,7 @@ def set_variable(name: str, value: Any) -> Variable:
     name = clean_string(name)
 
     if is_Variable(value):
+        check_circular_definition(name, value.raw)
         var = value
         var(value)
     else:
@@ -138,10 +193,17 @@ def set_variable(name: str, value: Any) -> Variable:
             var = get_variable(name)
             var(value)
         else:
+            check_circular_definition(name, value)
             var = Variable(name, value)
 
-    VARIABLES[name] = var
-    update_allowed_dict()
+    if VARIABLES.get(name) is not var:
+        replaced = name in VARIABLES
+        VARIABLES[name] = var
+        if replaced or var.name != name:
+            _rebuild_dependencies()
+        else:
+            _update_dependencies(var)
+            invalidate_dependents(name)
     return var
 
 
@@ -153,10 +215,70 @@ def get_variable(name: str) -> Variable:
 
 def remove_variable(name: str) -> Variable:
     var = VARIABLES.pop(name)
-    update_allowed_dict()
+    _rebuild_dependencies()
     return var
 
 
+def _update_dependencies(var: Variable, old_depends: FrozenSet[str] = frozenset()):
+    """ Updates the dependency graph with the names referenced by var """
+    for name in old_depends:
+        if name in _DEPENDENTS: _DEPENDENTS[name].discard(var.name)
+    for name in var._depends:
+        _DEPENDENTS.setdefault(name, set()).add(var.name)
+
+
+def _rebuild_dependencies():
+    """ Rebuilds the dependency graph from VARIABLES and invalidates every
+    cached value (used when a name disappears) """
+    _DEPENDENTS.clear()
+    for var in VARIABLES.values():
+        var._invalidate()
+        for name in var._depends:
+            _DEPENDENTS.setdefault(name, set()).add(var.name)
+
+
+def get_dependents(name: str) -> List[str]:
+    ''' Returns the names of the variables depending on name, directly or
+    through other variables '''
+    dependents = []
+    to_visit = list(_DEPENDENTS.get(name, ()))
+    while to_visit:
+        dependent = to_visit.pop()
+        if dependent in dependents or dependent == name: continue
+        dependents.append(dependent)
+        to_visit.extend(_DEPENDENTS.get(dependent, ()))
+    return dependents
+
+
+def invalidate_dependents(name: str):
+    ''' Marks the values of the variables depending on name as outdated,
+    they are evaluated again on their next read '''
+    for dependent in get_dependents(name):
+        if dependent in VARIABLES:
+            VARIABLES[dependent]._invalidate()
+
+
+def check_circular_definition(name: str, raw: Any):
+    ''' Raises an AssertionError if giving raw to the variable name creates
+    a circular definition between variables '''
+    if not has_eval(raw): return None
+
+    path = {}  # {variable name: name of the variable referencing it}
+    to_visit = [(dep, name) for dep in get_referenced_names(raw)]
+    while to_visit:
+        dep, parent = to_visit.pop()
+        if dep == name:
+            chain = [parent]
+            while chain[-1] != name: chain.append(path[chain[-1]])
+            chain = [name] + chain[::-1][1:] + [name]
+            raise AssertionError(
+                f"Circular definition of variable '{name}': {' -> '.join(chain)}")
+        if dep in path or dep not in VARIABLES: continue
+        path[dep] = parent
+        to_visit.extend((sub_dep, dep) for sub_dep in VARIABLES[dep]._depends)
+    return None
+
+
 def remove_from_config(variables: List[Tuple[str, Any]]):
     for name, _ in variables:
         if name in VARIABLES:
@@ -168,15 +290,63 @@ def update_from_config(variables: List[Tuple[str, Any]]):
         set_variable(var[0], var[1])
 
 
-def has_variable(value: str) -> bool:
-    if not isinstance(value, str): return False
+def _get_expression(expression: str) -> Tuple[CodeType, FrozenSet[str], bool]:
+    """ Returns the cached (code object, referenced names, pure) of expression.
+    Code is None if expression is not valid python. pure is True if the only
+    calls are name() without arguments (reading a variable) and there is no
+    attribute access """
+    with _EXPRESSIONS_LOCK:
+        entry = _EXPRESSIONS.get(expression)
+        if entry is not None:
+            _EXPRESSIONS.move_to_end(expression)
+            return entry
+
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError:
+        # Not python: keep the names found by regex for has_variable
+        pattern = r'[a-zA-Z_][a-zA-Z0-9_]*(?:\.[a-zA-Z_][a-zA-Z0-9_]*)*'
+        entry = (None, frozenset(
+            var.split('.')[0] for var in re.findall(pattern, expression)), False)
+    else:
+        nodes = list(ast.walk(tree))
+        entry = (compile(tree, '<eval>', 'eval'), frozenset(
+            node.id for node in nodes if isinstance(node, ast.Name)), all(
+            not isinstance(node, ast.Attribute) and (
+                not isinstance(node, ast.Call) or (
+                    isinstance(node.func, ast.Name)
+                    and len(node.args) == 0 and len(node.keywords) == 0))
+            for node in nodes))
+
+    with _EXPRESSIONS_LOCK:
+        _EXPRESSIONS[expression] = entry
+        while len(_EXPRESSIONS) > EXPRESSIONS_CACHE_SIZE:
+            _EXPRESSIONS.popitem(last=False)
+    return entry
+
+
+def compile_expression(expression: str) -> Tuple[CodeType, FrozenSet[str], bool]:
+    """ Returns the compiled code of a python expression, the names it
+    references and if it is pure (see _get_expression). Results are cached
+    by expression text """
+    entry = _get_expression(expression)
+    if entry[0] is None:
+        compile(expression, '<eval>', 'eval')  # raises the SyntaxError
+    return entry
+
+
+def get_referenced_names(value: str) -> FrozenSet[str]:
+    """ Returns the names referenced by a string (with or without '$eval:') """
     if has_eval(value): value = value[len(EVAL): ]
+    return _get_expression(value)[1]
+
 
-    pattern = r'[a-zA-Z_][a-zA-Z0-9_]*(?:\.[a-zA-Z_][a-zA-Z0-9_]*)*'
-    pattern_match = [var.split('.')[0] for var in re.findall(pattern, value)]
+def has_variable(value: str) -> bool:
+    """ Checks if value references a device or a variable """
+    if not isinstance(value, str): return False
 
-    for key in (list(DEVICES) + list(VARIABLES)):
-        if key in pattern_match:
+    for name in get_referenced_names(value):
+        if name in DEVICES or name in VARIABLES:
             return True
     return False
 
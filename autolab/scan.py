@@ -6,8 +6,9 @@ Created on Fri Nov 22 21:03:46 2019
 """
 from threading import Thread, Event
 from autolab.core import elements
+from autolab.core.devices import set_io_priority, PRIORITY_SCAN
+from autolab.core.utilities import ParameterSpace
 import collections
-import itertools
 import os
 import time
 import h5py
@@ -26,6 +27,11 @@ class Scanner :
         
         self._thread = None
         self.verbose = False
+
+        # Datafile writing
+        self._flush_rows = 1000
+        self._flush_interval = 5
+        self._compression = None
         
         
     # Utilities
@@ -71,6 +77,35 @@ class Scanner :
         
     def get_datapath(self):
         return self._datapath
+
+    def set_flush_policy(self,rows=None,interval=None):
+
+        ''' Set after how many rows and/or how many seconds the buffered data
+        are written in the datafile. Data are also written on pause, stop
+        and error. '''
+
+        self._check_modif_allowed()
+        if rows is not None :
+            assert int(rows) > 0, "The number of rows must be positive"
+            self._flush_rows = int(rows)
+        if interval is not None :
+            assert float(interval) >= 0, "The interval must be positive"
+            self._flush_interval = float(interval)
+
+    def get_flush_policy(self):
+        return {'rows':self._flush_rows,'interval':self._flush_interval}
+
+    def set_compression(self,compression=None):
+
+        ''' Set the compression of the datasets of the datafile ('gzip',
+        'lzf' or None) '''
+
+        self._check_modif_allowed()
+        assert compression in (None,'gzip','lzf'), f"Compression '{compression}' not supported"
+        self._compression = compression
+
+    def get_compression(self):
+        return self._compression
     
     
     
@@ -233,8 +268,9 @@ class ScanThread(Thread):
         self.scanner = scanner
         Thread.__init__(self)
         
-        # Itertools product on parameters
-        self.param_sets = list(dict(zip(self.scanner._parameters.keys(),x)) for x in itertools.product(*[a.values for a in self.scanner._parameters.values()]) )
+        # Lazy: the i-th set of parameters is computed on demand
+        self.param_sets = ParameterSpace([a.values for a in self.scanner._parameters.values()],
+                                         names=self.scanner._parameters.keys())
             
         # Pause and stop events
         self.stop_event = Event()
@@ -262,15 +298,18 @@ class ScanThread(Thread):
         self.datapath = os.path.join(self.scanner._datapath,self.scanner._name+suffix+'.hdf5')
 
         # Prepare structure
-        def configure(file,obj,data_length):
-            for key in obj.keys(): 
+        self.writer = HDF5Writer(self.datapath,
+                                 rows=self.scanner._flush_rows,
+                                 interval=self.scanner._flush_interval,
+                                 compression=self.scanner._compression)
+        def configure(obj,data_length):
+            for key in obj.keys():
                 if isinstance(obj[key],(Parameter,Measure)) :
-                    file.create_dataset(key, (data_length,))     
-        with h5py.File(self.datapath, "a") as file :
-            configure(file,self.scanner._initrecipe,1)
-            configure(file,self.scanner._parameters,len(self.param_sets))
-            configure(file,self.scanner._recipe,len(self.param_sets))
-            configure(file,self.scanner._endrecipe,1)
+                    self.writer.create_dataset(key,data_length)
+        configure(self.scanner._initrecipe,1)
+        configure(self.scanner._parameters,len(self.param_sets))
+        configure(self.scanner._recipe,len(self.param_sets))
+        configure(self.scanner._endrecipe,1)
 
 
 
@@ -278,20 +317,39 @@ class ScanThread(Thread):
         
         ''' Start the execution of the scan '''
         
-        # Init recipe
-        self.reset_data()
-        self.execute_recipe(self.scanner._initrecipe)
-        
-        # Main recipe of each set of parameter
-        self.reset_data()
-        for i in range(len(self.param_sets)) :
-            self.set_parameters(i)
-            self.execute_recipe(self.scanner._recipe,i)
-            
-        # End recipe
-        self.reset_data()
-        self.execute_recipe(self.scanner._endrecipe)
-        
+        set_io_priority(PRIORITY_SCAN)
+
+        try :
+            # Init recipe
+            self.reset_data()
+            self.execute_recipe(self.scanner._initrecipe)
+
+            # Main recipe of each set of parameter
+            self.reset_data()
+            for i in range(len(self.param_sets)) :
+                self.set_parameters(i)
+                self.execute_recipe(self.scanner._recipe,i)
+
+            # End recipe
+            self.reset_data()
+            self.execute_recipe(self.scanner._endrecipe)
+
+        # Whatever happens (end, stop or error), write the buffered data
+        finally :
+            self.writer.close()
+
+
+
+    def wait_if_paused(self):
+
+        """ Block while the scan is paused. The buffered data are written
+        first so that the datafile is up to date during the pause """
+
+        if self.pause_event.is_set() :
+            self.writer.flush()
+            while self.pause_event.is_set() :
+                time.sleep(0.1)
+
         
         
     def reset_data(self):
@@ -319,8 +377,7 @@ class ScanThread(Thread):
                 if self.scanner.verbose : print(key, step.info(), ans)
                 
                 # If scan is paused, wait for resume
-                while self.pause_event.is_set() :
-                    time.sleep(0.1)
+                self.wait_if_paused()
               
             # If the scan has been stopped
             else :
@@ -336,7 +393,7 @@ class ScanThread(Thread):
         
         """ Apply the i-th set of parameters """
         
-        param_set = self.param_sets[i]
+        param_set = self.param_sets.as_dict(i)
         
         for key in param_set.keys() :
             
@@ -351,8 +408,7 @@ class ScanThread(Thread):
                     if self.scanner.verbose : print(key, parameter.info(), value)
                     
                 # If scan is paused, wait for resume
-                while self.pause_event.is_set() :
-                    time.sleep(0.1)
+                self.wait_if_paused()
         
             # If the scan has been stopped
             else :
@@ -367,12 +423,92 @@ class ScanThread(Thread):
     def save_data(self,i=0):
         
         """ Save in the whole content of the current self.data dictionnary 
-        in the hdf5 datafile """
-        
-        with h5py.File(self.datapath, "a") as file :
-            for key in self.data.keys():
-                file[key][i] = self.data[key]
+        in the hdf5 datafile (through the writer buffer) """
+
+        self.writer.write(i,self.data)
         if self.scanner.verbose : print('Saving data')
+
+
+
+
+class HDF5Writer:
+
+    ''' Keeps the hdf5 datafile open for the whole scan and writes the rows
+    by blocks in chunked and resizable datasets. Rows are buffered in memory
+    and written every <rows> rows or every <interval> seconds, whichever
+    comes first. '''
+
+    def __init__(self,path,rows=1000,interval=5,compression=None):
+
+        self.path = path
+        self.rows = rows
+        self.interval = interval
+        self.compression = compression
+
+        self.file = h5py.File(self.path, "a")
+        self._buffer = collections.OrderedDict()  # {row index: {key: value}}
+        self._last_flush = time.monotonic()
+
+
+
+    def create_dataset(self,key,length,dtype='f8'):
+
+        ''' Create a chunked and resizable dataset of the given length.
+        Values are stored in double precision by default (h5py default is float32) '''
+
+        chunk = max(1,min(length,self.rows))
+        self.file.create_dataset(key, (length,), dtype=dtype, maxshape=(None,),
+                                 chunks=(chunk,), compression=self.compression)
+
+
+
+    def write(self,i,data):
+
+        ''' Buffer the values of the dictionnary data at row i '''
+
+        self._buffer.setdefault(i,{}).update(data)
+
+        if (len(self._buffer) >= self.rows
+                or time.monotonic()-self._last_flush >= self.interval) :
+            self.flush()
+
+
+
+    def flush(self):
+
+        ''' Write the buffered rows in the datafile, by blocks of contiguous
+        rows for each dataset '''
+
+        columns = collections.OrderedDict()  # {key: ([rows], [values])}
+        for i in sorted(self._buffer.keys()) :
+            for key, value in self._buffer[i].items() :
+                rows, values = columns.setdefault(key,([],[]))
+                rows.append(i)
+                values.append(value)
+
+        for key, (rows, values) in columns.items() :
+            dataset = self.file[key]
+            if rows[-1] >= len(dataset) :
+                dataset.resize((rows[-1]+1,))
+            start = 0
+            for j in range(1,len(rows)+1) :
+                if j == len(rows) or rows[j] != rows[j-1]+1 :
+                    dataset[rows[start]:rows[j-1]+1] = values[start:j]
+                    start = j
+
+        self._buffer.clear()
+        self.file.flush()
+        self._last_flush = time.monotonic()
+
+
+
+    def close(self):
+
+        ''' Write the remaining rows and close the datafile '''
+
+        if self.file.id.valid :
+            try : self.flush()
+            finally : self.file.close()
             
         
         
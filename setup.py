@@ -30,8 +30,6 @@ setup(
     packages=find_packages(),
     classifiers=["Programming Language :: Python :: 3",
                  "Programming Language :: Python :: 3 :: Only",
-				"Programming Language :: Python :: 3.6",
-				"Programming Language :: Python :: 3.7",
 				"Programming Language :: Python :: 3.8",
 				"Programming Language :: Python :: 3.9",
 				"Programming Language :: Python :: 3.10",
@@ -50,7 +48,7 @@ setup(
             'comtypes',
             ],
     entry_points={'console_scripts': ['autolab = autolab:_main']},
-	python_requires='>=3.6',
+	python_requires='>=3.8',
     include_package_data=True,
     package_data={'': ['*.ini','*.txt','*.ui']},# If any package contains *.ini files, include them:
     keywords = ['scanning','interface','automation','scientific','laboratory','devices','experiments','measures','interface','gui','scan']
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Tests configuration: autolab uses a temporary user folder, and the tests can
+add local drivers and devices to it.
+
+@author: autolab
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import textwrap
+
+import pytest
+
+# Must be done before importing autolab (user folder, Qt without display)
+_HOME = tempfile.mkdtemp(prefix='autolab_tests_')
+os.environ['HOME'] = os.environ['USERPROFILE'] = _HOME
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+# The tests don't download the official drivers (done if none are installed)
+_OFFICIAL = os.path.join(_HOME, 'autolab', 'drivers', 'official')
+os.makedirs(_OFFICIAL)
+open(os.path.join(_OFFICIAL, 'README'), 'w').close()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_HOME, ignore_errors=True)
+
+
+@pytest.fixture
+def add_driver():
+    """ Returns a function writing a local driver from its source code """
+    from autolab.core.paths import DRIVER_SOURCES
+    from autolab.core.drivers import update_drivers_paths
+    folders = []
+
+    def add_driver(driver_name: str, source: str) -> str:
+        folder = os.path.join(DRIVER_SOURCES['local'], driver_name)
+        os.makedirs(folder, exist_ok=True)
+        folders.append(folder)
+        path = os.path.join(folder, f'{driver_name}.py')
+        with open(path, 'w') as file:
+            file.write(textwrap.dedent(source))
+        update_drivers_paths()
+        return path
+
+    yield add_driver
+
+    for folder in folders:
+        shutil.rmtree(folder, ignore_errors=True)
+    update_drivers_paths()
+
+
+@pytest.fixture
+def add_device():
+    """ Returns a function adding a device to devices_config.ini.
+    The devices opened during the test are closed at the end """
+    from autolab.core.config import (load_config, modify_config, save_config,
+                                     invalidate_config_cache)
+    from autolab.core.devices import DEVICES
+    names = []
+
+    def add_device(device_name: str, **config):
+        names.append(device_name)
+        save_config('devices_config', modify_config(
+            'devices_config', {device_name: config}))
+        invalidate_config_cache('devices_config')
+
+    yield add_device
+
+    for device_name in list(DEVICES):
+        DEVICES[device_name].close()
+    config = load_config('devices_config')
+    for device_name in names:
+        config.remove_section(device_name)
+    save_config('devices_config', config)
+    invalidate_config_cache('devices_config')
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    """ Returns the QApplication needed by the GUI modules (offscreen) """
+    from qtpy import QtWidgets
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
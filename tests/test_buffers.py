@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Column and ring buffers
+
+@author: autolab
+"""
+
+import numpy as np
+import pytest
+
+from autolab.core.buffers import ColumnBuffer
+
+
+def test_keep_last_keeps_previous_views():
+    buffer = ColumnBuffer(['x', 'y'], capacity=4)
+    for i in range(4):
+        buffer.append_values([i, 10*i])
+    dataframe = buffer.to_dataframe().iloc[-2:]
+    column = buffer.column('x')
+
+    buffer.keep_last(2)
+    buffer.append_values([4, 40])
+
+    assert list(dataframe['x']) == [2, 3]
+    assert list(column) == [0, 1, 2, 3]
+    assert list(buffer.column('y')) == [20, 30, 40]
+
+
+def test_clear_keeps_previous_views():
+    buffer = ColumnBuffer(['x'], capacity=4)
+    for i in range(3): buffer.append_values([i])
+    column = buffer.column('x')
+
+    buffer.clear()
+    buffer.append_values(['a'])
+
+    assert len(buffer) == 1 and buffer.capacity == 4
+    assert list(column) == [0, 1, 2]
+    assert list(buffer.column('x')) == ['a']
+
+
+def test_append_values_checks_length():
+    buffer = ColumnBuffer(['x', 'y'])
+    with pytest.raises(ValueError):
+        buffer.append_values([1])
+    assert len(buffer) == 0
+
+
+def test_ring_buffer_mean_ignores_nan():
+    from autolab.core.buffers import RingBuffer
+
+    buffer = RingBuffer(window=10, capacity=4)
+    buffer.append(0, 1.)
+    buffer.append(1, np.nan)
+    buffer.extend([2, 3, 4, 5], [3., np.nan, np.nan, 5.])
+    assert buffer.mean == 3.
+
+    buffer.extend([11, 12], [np.nan, 7.])  # evicts x < 2
+    assert buffer.mean == 5.
+    assert buffer.mean == np.nanmean(buffer.y)
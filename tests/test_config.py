@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration files cache
+
+@author: autolab
+"""
+
+import pytest
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    """ Returns the list of the configuration files parsed during the test """
+    from autolab.core import config
+    parsed = []
+    parse_config = config._parse_config
+
+    def counting_parse_config(config_name):
+        parsed.append(config_name)
+        return parse_config(config_name)
+
+    config.invalidate_config_cache()
+    monkeypatch.setattr(config, '_parse_config', counting_parse_config)
+    yield parsed
+    config.invalidate_config_cache()
+
+
+def test_config_cache_reused_until_file_changes(parses):
+    from autolab.core.config import get_config, PATHS
+
+    for _ in range(10): get_config('scanner')
+    assert parses == ['autolab_config']
+
+    # Modified outside of autolab: the size changes
+    with open(PATHS['autolab_config']) as file:
+        text = file.read()
+    try:
+        with open(PATHS['autolab_config'], 'w') as file:
+            file.write(text + '\n')
+        get_config('scanner')
+        assert parses == ['autolab_config'] * 2
+    finally:
+        with open(PATHS['autolab_config'], 'w') as file:
+            file.write(text)
+
+
+def test_config_cache_invalidated_by_save(parses):
+    from autolab.core.config import get_config, save_config, modify_config
+
+    precision = get_config('scanner')['precision']
+    assert parses == ['autolab_config']
+
+    try:
+        save_config('autolab_config', modify_config(
+            'autolab_config', {'scanner': {'precision': 7}}))
+        assert get_config('scanner')['precision'] == '7'
+        assert parses == ['autolab_config'] * 2
+    finally:
+        save_config('autolab_config', modify_config(
+            'autolab_config', {'scanner': {'precision': precision}}))
+
+
+def test_config_sections_are_read_only(add_device):
+    from autolab.core.config import get_config, get_device_config
+
+    add_device('test_config', driver='test', connection='DEFAULT')
+    scanner = get_config('scanner')
+    device = get_device_config('test_config')
+
+    with pytest.raises(TypeError): scanner['precision'] = '7'
+    with pytest.raises(TypeError): device['driver'] = 'other'
+    assert get_config('scanner')['precision'] == scanner['precision']
+    assert device['driver'] == 'test'
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Opening of the devices
+
+@author: autolab
+"""
+
+import os
+import sys
+import time
+import threading
+
+DRIVER = '''
+import time
+import threading
+
+class Driver():
+
+    def get_value(self) -> float:
+        return self.value
+
+    def get_driver_model(self):
+        return [{'element': 'variable', 'name': 'value', 'type': float,
+                 'read': self.get_value}]
+
+class Driver_DEFAULT(Driver):
+
+    def __init__(self, value=0, delay=0):
+        import slow_helper  # from the driver folder, needs sys.path
+        time.sleep(float(delay))  # connection
+        self.value = slow_helper.scale * float(value)
+'''
+
+
+def test_get_devices_same_driver_concurrently(add_driver, add_device):
+    from autolab.core.devices import get_devices
+
+    driver_path = add_driver('test_slow', DRIVER)
+    with open(os.path.join(os.path.dirname(driver_path), 'slow_helper.py'), 'w') as file:
+        file.write('scale = 2\n')
+    names = [f'test_slow_{i}' for i in range(4)]
+    for i, name in enumerate(names):
+        add_device(name, driver='test_slow', connection='DEFAULT',
+                   value=i, delay=0.3)
+    sys_path = list(sys.path)
+    cwd = os.getcwd()
+
+    t = time.perf_counter()
+    devices = get_devices(names)
+    duration = time.perf_counter() - t
+
+    assert [devices[name].value() for name in names] == [0., 2., 4., 6.]
+    assert duration < 4*0.3  # the drivers connect in parallel
+    assert sys.path == sys_path
+    assert os.getcwd() == cwd
+
+
+HELPER_DRIVER = '''
+import helper  # a different helper.py in each driver folder
+
+class Driver():
+
+    def get_value(self) -> str:
+        return helper.name
+
+    def get_driver_model(self):
+        return [{'element': 'variable', 'name': 'value', 'type': str,
+                 'read': self.get_value}]
+
+class Driver_DEFAULT(Driver):
+    pass
+'''
+
+
+def test_drivers_with_same_named_helpers(add_driver, add_device):
+    from autolab.core.devices import get_devices
+
+    names = [f'test_helper_{i}' for i in range(4)]
+    for name in names:
+        driver_path = add_driver(name, HELPER_DRIVER)
+        with open(os.path.join(os.path.dirname(driver_path), 'helper.py'), 'w') as file:
+            file.write(f'name = {name!r}\n')
+        add_device(name, driver=name, connection='DEFAULT')
+
+    devices = get_devices(names)
+
+    assert [devices[name].value() for name in names] == names
+    assert 'helper' not in sys.modules
+
+
+def _wait_queue(lane, depth):
+    """ Waits until depth calls are waiting for the lane """
+    while lane.queue_depth() != depth: time.sleep(0.001)
+
+
+def _start_thread(function, priority=None):
+    from autolab.core.devices import set_io_priority
+
+    def run():
+        if priority is not None: set_io_priority(priority)
+        function()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_lane_serializes_calls():
+    from autolab.core.devices import DeviceLane
+
+    lane = DeviceLane('test')
+    running = []
+    overlaps = []
+
+    def call():
+        running.append(1)
+        overlaps.append(len(running))
+        time.sleep(0.01)
+        running.pop()
+
+    threads = [_start_thread(lambda: lane.execute(call)) for _ in range(8)]
+    for thread in threads: thread.join()
+
+    assert overlaps == [1] * 8
+    assert lane.stats()['calls'] == 8
+
+
+def test_lane_priority_order():
+    from autolab.core.devices import (DeviceLane, PRIORITY_SCAN,
+                                      PRIORITY_DEFAULT, PRIORITY_MONITOR)
+
+    lane = DeviceLane('test')
+    release = threading.Event()
+    order = []
+
+    holder = _start_thread(lambda: lane.execute(release.wait))
+    while lane._owner is None: time.sleep(0.001)
+
+    threads = []
+    for depth, priority in enumerate([PRIORITY_MONITOR, PRIORITY_DEFAULT,
+                                      PRIORITY_SCAN, PRIORITY_DEFAULT]):
+        threads.append(_start_thread(
+            lambda priority=priority: lane.execute(order.append, priority),
+            priority))
+        _wait_queue(lane, depth + 1)
+    release.set()
+    for thread in [holder] + threads: thread.join()
+
+    assert order == [PRIORITY_SCAN, PRIORITY_DEFAULT, PRIORITY_DEFAULT,
+                     PRIORITY_MONITOR]
+
+
+def test_lane_monitor_not_starved():
+    from autolab.core.devices import (DeviceLane, PRIORITY_SCAN,
+                                      PRIORITY_MONITOR)
+
+    lane = DeviceLane('test', max_bypass=3)
+    release = threading.Event()
+    order = []
+
+    holder = _start_thread(lambda: lane.execute(release.wait))
+    while lane._owner is None: time.sleep(0.001)
+
+    # One monitor call, then a steady stream of scan calls
+    threads = [_start_thread(lambda: lane.execute(order.append, 'monitor'),
+                             PRIORITY_MONITOR)]
+    _wait_queue(lane, 1)
+    for i in range(10):
+        threads.append(_start_thread(
+            lambda i=i: lane.execute(order.append, i), PRIORITY_SCAN))
+        _wait_queue(lane, i + 2)
+    release.set()
+    for thread in [holder] + threads: thread.join()
+
+    assert order == [0, 1, 2, 'monitor', 3, 4, 5, 6, 7, 8, 9]
+
+
+def test_lane_is_reentrant():
+    from autolab.core.devices import DeviceLane
+
+    lane = DeviceLane('test')
+    depths = []
+
+    def inner():
+        depths.append(lane._depth)
+        return 'done'
+
+    def outer():  # driver function using another element of the device
+        depths.append(lane._depth)
+        return lane.execute(inner)
+
+    thread = _start_thread(lambda: depths.append(lane.execute(outer)))
+    thread.join(1)
+
+    assert not thread.is_alive()
+    assert depths == [1, 2, 'done']
+    assert lane._owner is None and lane._depth == 0
+
+
+MODULE_DRIVER = '''
+class Channel():
+
+    def __init__(self):
+        self.value = 1.
+
+    def get_value(self) -> float:
+        return self.value
+
+    def reset(self):
+        self.value = 0.
+
+    def get_driver_model(self):
+        return [{'element': 'variable', 'name': 'value', 'type': float,
+                 'read': self.get_value},
+                {'element': 'action', 'name': 'reset', 'do': self.reset}]
+
+class Driver():
+
+    def __init__(self):
+        self.channel = Channel()
+
+    def get_driver_model(self):
+        return [{'element': 'module', 'name': 'channel', 'object': self.channel},
+                {'element': 'variable', 'name': 'value', 'type': float,
+                 'read': self.channel.get_value}]
+
+class Driver_DEFAULT(Driver):
+    pass
+'''
+
+
+def _walk(device, address):
+    element = device
+    for name in address.split('.')[1:]:
+        element = getattr(element, name)
+    return element
+
+
+def test_element_index_matches_tree(add_driver, add_device):
+    from autolab.core.devices import (get_device, get_element_by_address,
+                                      ELEMENTS)
+
+    add_driver('test_module', MODULE_DRIVER)
+    add_device('test_module', driver='test_module', connection='DEFAULT')
+    device = get_device('test_module')
+
+    addresses = [address for address in ELEMENTS
+                 if address.split('.')[0] == 'test_module']
+    assert sorted(addresses) == ['test_module', 'test_module.channel',
+                                 'test_module.channel.reset',
+                                 'test_module.channel.value',
+                                 'test_module.value']
+    for address in addresses:
+        assert get_element_by_address(address) is _walk(device, address)
+        assert get_element_by_address(address).address() == address
+    assert (get_element_by_address('test_module. channel.value')
+            is device.channel.value)
+
+    device.close()
+
+    assert not [address for address in ELEMENTS
+                if address.split('.')[0] == 'test_module']
+    reopened = get_element_by_address('test_module.channel.value')
+    assert reopened is not _walk(device, 'test_module.channel.value')
+    assert reopened is get_device('test_module').channel.value
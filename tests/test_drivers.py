@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Drivers index
+
+@author: autolab
+"""
+
+import ast
+
+DRIVER = '''
+import os
+
+category = 'Test'
+
+class Driver():
+
+    def __init__(self, nb_channels=2, path=os.getcwd()):
+        pass
+
+class Driver_DEFAULT(Driver):
+
+    def __init__(self, address: str = 'COM1', *, timeout=[1, 2]):
+        Driver.__init__(self)
+'''
+
+
+def test_parse_driver_file(add_driver, monkeypatch):
+    from autolab.core.drivers import parse_driver_file
+
+    path = add_driver('test_parsed', DRIVER)
+    expected = {'name': 'test_parsed', 'path': path, 'category': 'Test',
+                'connections': {'DEFAULT': {'address': 'COM1',
+                                            'timeout': '[1, 2]'}},
+                'modules': [],
+                'driver_args': {'nb_channels': 2, 'path': 'os.getcwd()'}}
+    assert parse_driver_file(path) == expected
+
+    # Without ast.unparse (python < 3.9), the source code is used
+    monkeypatch.delattr(ast, 'unparse')
+    assert parse_driver_file(path) == expected
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Elements of the devices
+
+@author: autolab
+"""
+
+import time
+import threading
+
+from autolab.core.elements import Variable
+
+
+class FakeInstrument():
+
+    def __init__(self, read_delay=0, write_delay=0):
+        self.value = 0.
+        self.reads = 0
+        self.read_delay = read_delay
+        self.write_delay = write_delay
+
+    def get_value(self) -> float:
+        self.reads += 1
+        value = self.value
+        time.sleep(self.read_delay)
+        return value
+
+    def set_value(self, value: float):
+        time.sleep(self.write_delay)
+        self.value = value
+
+
+def _variable(instrument, ttl):
+    return Variable(None, {'name': 'value', 'type': float, 'cache_ttl': ttl,
+                           'read': instrument.get_value,
+                           'write': instrument.set_value})
+
+
+def test_cache_ttl_expiry():
+    instrument = FakeInstrument()
+    variable = _variable(instrument, 0.05)
+
+    assert variable() == 0.
+    instrument.value = 1.
+    assert variable() == 0.  # cached
+    time.sleep(0.06)
+    assert variable() == 1.
+    assert instrument.reads == 2
+    assert variable.cache_info()['hits'] == 1
+
+
+def test_concurrent_reads_are_coalesced():
+    instrument = FakeInstrument(read_delay=0.1)
+    variable = _variable(instrument, 10)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(variable()))
+               for _ in range(5)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    assert results == [0.] * 5
+    assert instrument.reads == 1
+
+
+def test_read_during_write_is_not_cached():
+    instrument = FakeInstrument(write_delay=0.1)
+    variable = _variable(instrument, 10)
+
+    writer = threading.Thread(target=variable, args=(5.,))
+    writer.start()
+    time.sleep(0.03)
+    assert variable() == 0.  # the write is not finished
+    writer.join()
+
+    assert variable() == 5.
+
+
+def test_failed_write_clears_cache():
+    instrument = FakeInstrument()
+    variable = _variable(instrument, 10)
+    assert variable() == 0.
+
+    def failing_write(value):
+        instrument.value = value
+        raise OSError('timeout')
+    variable.write_function = failing_write
+    try: variable(3.)
+    except OSError: pass
+
+    assert variable() == 3.
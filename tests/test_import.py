@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Import time of autolab
+
+@author: autolab
+"""
+
+import os
+import sys
+import subprocess
+
+
+def test_import_doesnt_load_pandas():
+    # In a new interpreter: pandas is already imported by the other tests
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, '-c',
+         'import sys, autolab; print(sorted(name for name in ('
+         '"pandas", "autolab.core.devices", "autolab.core.gui") '
+         'if name in sys.modules))'],
+        cwd=root, env=os.environ, capture_output=True, text=True, check=True)
+
+    assert output.stdout.strip().splitlines()[-1] == '[]'
+
+
+def test_import_time():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import autolab'],
+        cwd=root, env=os.environ, capture_output=True, text=True, check=True)
+
+    # Lines are 'import time: self [us] | cumulative | imported package'
+    cumulative = {line.split('|')[2].strip(): int(line.split('|')[1])
+                  for line in output.stderr.splitlines()
+                  if line.startswith('import time:') and line.count('|') == 2
+                  and line.split('|')[1].strip().isdigit()}
+
+    assert cumulative['autolab'] < 1e6  # us, numpy included
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Monitor acquisition thread, without the GUI
+
+@author: autolab
+"""
+
+import time
+from queue import Queue
+
+
+def test_last_block_published_on_stop():
+    from autolab.core.variables import Variable
+    from autolab.core.gui.monitoring.monitor import MonitorThread, SampleBlock
+
+    queue = Queue(maxsize=100)
+    thread = MonitorThread(Variable('monitored', 1.5), queue)
+    thread.block_interval = 60  # blocks are only published when full or on stop
+    thread.delay = 0.001
+    thread.start()
+    time.sleep(0.1)
+    thread.stopFlag.set()
+    thread.wait()
+
+    blocks = []
+    while not queue.empty(): blocks.append(queue.get_nowait())
+    assert len(blocks) == 1 and isinstance(blocks[0], SampleBlock)
+    assert len(blocks[0]) > 10
+    assert set(blocks[0].y) == {1.5}
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Recorder_V2: data.csv and the rows kept in memory
+
+@author: autolab
+"""
+
+import os
+import csv
+import time
+
+
+def _rows(recorder):
+    with open(os.path.join(recorder.getPath(), 'data.csv'), newline='') as file:
+        return list(csv.reader(file, delimiter=';'))
+
+
+def test_recorder_tail_matches_file(tmp_path):
+    from autolab.core.recorder import Recorder_V2
+
+    with Recorder_V2('test', str(tmp_path), verbose=False, tail=10) as recorder:
+        for i in range(35):
+            recorder.setValue('x', i)
+            recorder.setValue('y', i / 2)
+            recorder.save()
+        df = recorder.dataframe
+
+    assert recorder.dataFile is None  # closed by the context manager
+    assert list(df.index) == list(range(25, 35))
+    rows = _rows(recorder)
+    assert len(rows) == 36
+    for index, row in df.iterrows():  # the index is the row number in the file
+        assert rows[index + 1] == [str(index), str(int(row['x'])), str(row['y'])]
+
+
+def test_recorder_flushes_without_save(tmp_path):
+    from autolab.core.recorder import Recorder_V2
+
+    recorder = Recorder_V2('test', str(tmp_path), verbose=False,
+                           flush_interval=0.05)
+    recorder.setValue('x', 1)
+    recorder.save()
+    time.sleep(0.3)  # no other save: flushed by the flusher thread
+
+    assert _rows(recorder) == [['', 'x'], ['0', '1']]
+    flusher = recorder._flusher
+    del recorder  # closed when garbage collected
+    flusher.join(1)
+    assert not flusher.is_alive()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Scanner datafile
+
+@author: autolab
+"""
+
+import os
+
+import h5py
+
+
+def test_hdf5_writer_double_precision(tmp_path):
+    from autolab.scan import HDF5Writer
+
+    path = os.path.join(str(tmp_path), 'scan.hdf5')
+    writer = HDF5Writer(path, rows=2)
+    writer.create_dataset('time', 3)
+    values = [1.7e9 + 0.123456, 1.7e9 + 0.5, 1 + 1e-12]
+    for i, value in enumerate(values):
+        writer.write(i, {'time': value})
+    writer.close()
+
+    with h5py.File(path, 'r') as file:
+        assert file['time'].dtype == 'f8'
+        assert list(file['time'][:]) == values
+
+
+DRIVER = '''
+class Driver():
+
+    def __init__(self):
+        self.value = 0.
+
+    def get_value(self) -> float:
+        return self.value
+
+    def get_double(self) -> float:
+        return 2 * self.value
+
+    def get_driver_model(self):
+        return [{'element': 'variable', 'name': 'value', 'type': float,
+                 'read': self.get_value},
+                {'element': 'variable', 'name': 'double', 'type': float,
+                 'read': self.get_double}]
+
+class Driver_DEFAULT(Driver):
+    pass
+'''
+
+
+def test_scan_reads_remote_measures_in_one_request(qapp, add_driver, add_device,
+                                                   monkeypatch):
+    from queue import Queue
+    import autolab
+    from autolab.core.server import Server, Driver_REMOTE
+    from autolab.core.gui.scanning.scan import ScanThread
+
+    server = Server(port=0, background=True)
+    try:
+        add_driver('test_local', DRIVER)
+        add_device('test_local', driver='test_local', connection='DEFAULT')
+        add_device('test_remote', driver='autolab_server', address='127.0.0.1',
+                   port=server.port, devices='test_local')
+        remote = autolab.get_device('test_remote').test_local
+        autolab.get_device('test_local').instance.value = 1.5
+
+        recipe = {'active': True, 'parameter': [],
+                  'recipe': [{'name': name, 'stepType': 'measure',
+                              'element': remote.get_variable(name)}
+                             for name in ['value', 'double', 'value']]}
+        recipe['recipe'][2]['name'] = 'value_2'
+        queue = Queue()
+        thread = ScanThread(queue, {'recipe': recipe})
+
+        requests = []
+        request = Driver_REMOTE.request
+        def counting_request(self, command):
+            requests.append(command['command'])
+            return request(self, command)
+        monkeypatch.setattr(Driver_REMOTE, 'request', counting_request)
+        thread.execRecipe('recipe')
+        monkeypatch.undo()
+    finally:
+        server.close()
+
+    assert thread.remote_batches == {'recipe': {0: 3}}
+    assert requests == ['batch']
+    assert queue.get_nowait().values == [1.5, 3., 1.5]
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Scan results storage, without the GUI
+
+@author: autolab
+"""
+
+import os
+import csv
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('steps', [1, 10, 100])
+def test_dataset_add_points(tmp_path, steps):
+    """ Throughput of a scan of N points, each one measuring 'steps' results:
+    one array, the others floats """
+    from autolab.core.gui.scanning.data import Dataset, ScanPoint, TempWriter
+
+    float_element = SimpleNamespace(type=float)
+    array_element = SimpleNamespace(type=np.ndarray)
+    floats = [f'y{k}' for k in range(steps - 1)]
+    recipe = {'active': True,
+              'parameter': [{'name': 'x', 'element': float_element}],
+              'recipe': [{'name': name, 'stepType': 'measure',
+                          'element': float_element} for name in floats] + [
+                         {'name': 'spectrum', 'stepType': 'measure',
+                          'element': array_element}]}
+    names = ScanPoint.schema(recipe)
+    writer = TempWriter()
+    writer.start()
+    dataset = Dataset(str(tmp_path), 'recipe', {'recipe': recipe},
+                      writer=writer)
+
+    N = 20000 // steps
+    t = time.perf_counter()
+    for i in range(N):
+        point = ScanPoint('recipe', names)
+        point.values[:] = [float(i)] + [i**2 / 2] * len(floats) + [np.arange(3.) + i]
+        dataset.addPoint(point)
+        if i % 50 == 0: dataset.pushJobs()  # like DataManager.sync
+    dataset.close()
+    duration = time.perf_counter() - t
+    writer.wait()
+    writer.stop()
+
+    assert writer.error is None
+    assert N * steps / duration > 20000  # results per second, GUI thread only
+    assert len(dataset) == N
+    for name in floats:
+        assert np.array_equal(dataset.getColumn(name), np.arange(N)**2 / 2)
+
+    with open(os.path.join(str(tmp_path), 'data.txt'), newline='') as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == ['id', 'x'] + floats
+    assert len(rows) == N + 1
+    assert [float(value) for value in rows[-1]] == [N, N - 1] + [(N - 1)**2 / 2] * len(floats)
+
+    spectrums = dataset.array_stores['spectrum']
+    assert spectrums.ids() == list(range(1, N + 1))
+    assert np.array_equal(spectrums.read(N), np.arange(3.) + N - 1)
+
+    # The arrays are read back from the store once written, not kept in memory
+    arrays = dataset.data_arrays['spectrum']
+    assert len(arrays) == N and not arrays._pending
+    assert isinstance(arrays[N - 1], np.memmap)
+    assert np.array_equal(arrays[N - 1], np.arange(3.) + N - 1)
+
+
+def _array_dataset(folder, writer=None, export_arrays_txt=False):
+    from autolab.core.gui.scanning.data import Dataset, ScanPoint
+
+    def save(path, value):
+        np.savetxt(path, value)
+
+    array_element = SimpleNamespace(type=np.ndarray, save=save)
+    recipe = {'active': True,
+              'parameter': [{'name': 'x', 'element': SimpleNamespace(type=float)}],
+              'recipe': [{'name': 'spectrum', 'stepType': 'measure',
+                          'element': array_element}]}
+    names = ScanPoint.schema(recipe)
+    dataset = Dataset(folder, 'recipe', {'recipe': recipe}, writer=writer,
+                      export_arrays_txt=export_arrays_txt)
+    for i in range(3):
+        point = ScanPoint('recipe', names)
+        point.values[:] = [float(i), np.arange(3.) + i]
+        dataset.addPoint(point)
+    return dataset
+
+
+def test_dataset_save_copies_array_store(tmp_path):
+    from autolab.core.buffers import ArrayStore
+    from autolab.core.gui.scanning.data import TempWriter
+
+    writer = TempWriter()
+    writer.start()
+    temp_folder = tmp_path / 'temp'
+    temp_folder.mkdir()
+    dataset = _array_dataset(str(temp_folder), writer)
+
+    dataset.save(str(tmp_path / 'scan.txt'))
+    writer.wait()
+    writer.stop()
+
+    assert writer.error is None
+    saved = tmp_path / 'scan' / 'spectrum'
+    assert sorted(os.listdir(saved)) == ['spectrum.index', 'spectrum.npys']
+    assert np.array_equal(ArrayStore(str(saved), 'spectrum').read(3),
+                          np.arange(3.) + 2)
+
+
+def test_dataset_save_exports_text(tmp_path):
+    temp_folder = tmp_path / 'temp'
+    temp_folder.mkdir()
+    dataset = _array_dataset(str(temp_folder), export_arrays_txt=True)
+
+    dataset.save(str(tmp_path / 'scan.txt'))
+
+    saved = tmp_path / 'scan' / 'spectrum'
+    assert {'1.txt', '2.txt', '3.txt', 'spectrum.npys'} <= set(os.listdir(saved))
+    assert np.array_equal(np.loadtxt(saved / '3.txt'), np.arange(3.) + 2)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Scanner figure: live curve of the scan in progress
+
+@author: autolab
+"""
+
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+
+class FakeDataset:
+
+    def __init__(self):
+        self.x = []
+
+    def __len__(self):
+        return len(self.x)
+
+    def getColumn(self, name):
+        return np.array(self.x) * (2 if name == 'y' else 1)
+
+
+def test_live_curve_redraw_is_throttled(qapp):
+    import pyqtgraph as pg
+    from qtpy import QtCore
+    from autolab.core.gui.scanning import figure
+    from autolab.core.gui.scanning.figure import FigureManager
+
+    dataset = FakeDataset()
+    curve = pg.PlotDataItem()
+    redraws = []
+    set_data = curve.setData
+    curve.setData = lambda x, y: (redraws.append(len(x)), set_data(x, y))
+
+    combo = lambda text: SimpleNamespace(currentText=lambda: text)
+    manager = SimpleNamespace(
+        _live_curve=(curve, dataset, 0), _plot_key='key', _plotKey=lambda: 'key',
+        _live_update=0., _live_cost=0., _live_timer=QtCore.QTimer(singleShot=True),
+        gui=SimpleNamespace(variable_x_comboBox=combo('x'),
+                            variable_y_comboBox=combo('y')),
+        displayScan=SimpleNamespace(isVisible=lambda: False))
+    manager.updateLiveCurve = lambda: FigureManager.updateLiveCurve(manager)
+    manager._live_timer.timeout.connect(manager.updateLiveCurve)
+
+    for i in range(200):  # one point per tick of the scan
+        dataset.x.append(i)
+        assert manager.updateLiveCurve()
+        time.sleep(0.001)
+
+    assert 1 <= len(redraws) <= 200 * 0.001 / figure.LIVE_CURVE_INTERVAL + 2
+
+    # The last points are drawn by the postponed redraw
+    end = time.perf_counter() + 1
+    while redraws[-1] != 200 and time.perf_counter() < end:
+        qapp.processEvents()
+        time.sleep(0.01)
+    assert redraws[-1] == 200
+    assert list(curve.yData) == [2 * i for i in range(200)]
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Autolab server and its clients, on the local host
+
+@author: autolab
+"""
+
+import time
+import socket
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def server():
+    from autolab.core.server import Server
+    server = Server(port=0, background=True)
+    yield server
+    server.close()
+
+
+def test_server_free_port(server):
+    from autolab.core.server import AsyncClient
+
+    async def main():
+        async with AsyncClient('127.0.0.1', server.port) as client:
+            return await client.get_devices_status()
+
+    assert server.port != 0
+    assert isinstance(asyncio.run(main()), dict)
+
+
+DRIVER = '''
+class Driver():
+
+    def __init__(self):
+        self.value = 0.
+
+    def get_value(self) -> float:
+        return self.value
+
+    def set_value(self, value: float):
+        self.value = value
+
+    def get_driver_model(self):
+        return [{'element': 'variable', 'name': 'value', 'type': float,
+                 'read': self.get_value, 'write': self.set_value}]
+
+class Driver_DEFAULT(Driver):
+    pass
+'''
+
+
+def test_get_remote_device(server, add_driver, add_device):
+    import autolab
+
+    add_driver('test_local', DRIVER)
+    add_device('test_local', driver='test_local', connection='DEFAULT')
+    add_device('test_remote', driver='autolab_server', address='127.0.0.1',
+               port=server.port, devices='test_local')
+
+    remote = autolab.get_device('test_remote')
+    remote.test_local.value(2.5)
+
+    assert remote.test_local.value() == 2.5
+    assert autolab.get_device('test_local').value() == 2.5
+
+
+def test_subscription_rate(server, add_driver, add_device):
+    from autolab.core.server import AsyncClient
+
+    add_driver('test_local', DRIVER)
+    add_device('test_local', driver='test_local', connection='DEFAULT')
+
+    async def receive(subscription, duration):
+        x = []
+        loop = asyncio.get_running_loop()
+        end = loop.time() + duration
+        while loop.time() < end:
+            try:
+                block = await asyncio.wait_for(subscription.get(), end - loop.time())
+            except asyncio.TimeoutError:
+                break
+            x.extend(block['x'])
+        return x
+
+    async def main():
+        async with AsyncClient('127.0.0.1', server.port) as client:
+            slow = await client.subscribe('test_local.value', rate=1)
+            fast = await client.subscribe('test_local.value', rate=20)
+            return await asyncio.gather(receive(slow, 1.2), receive(fast, 1.2))
+
+    slow, fast = asyncio.run(main())
+
+    assert 1 <= len(slow) <= 2  # sampler reads at 20 Hz for fast
+    assert len(fast) >= 15
+
+
+SLOW_DRIVER = '''
+import time
+
+class Driver():
+
+    def get_value(self) -> float:
+        time.sleep(0.05)
+        return 1.
+
+    def get_driver_model(self):
+        return [{'element': 'variable', 'name': 'value', 'type': float,
+                 'read': self.get_value}]
+
+class Driver_DEFAULT(Driver):
+    pass
+'''
+
+
+def test_pipelined_requests_overlap(server, add_driver, add_device):
+    from autolab.core.server import AsyncClient
+
+    add_driver('test_slow_read', SLOW_DRIVER)
+    names = [f'test_slow_read_{i}' for i in range(3)]
+    for name in names:
+        add_device(name, driver='test_slow_read', connection='DEFAULT')
+
+    async def main():
+        async with AsyncClient('127.0.0.1', server.port) as client:
+            # devices are opened by the server on first use
+            await asyncio.gather(*[client.get_device_model(name) for name in names])
+            t = time.perf_counter()
+            values = await asyncio.gather(*[
+                client.execute(f'{name}.value', 'read') for name in names])
+            return values, time.perf_counter() - t
+
+    values, duration = asyncio.run(main())
+
+    assert values == [1., 1., 1.]
+    assert duration < 2*0.05  # 3 reads of 50 ms
+
+
+def test_invalid_message_closes_client(server, add_driver, add_device):
+    from autolab.core.server import (COUNT, LENGTH, send_message,
+                                     recv_message)
+
+    add_driver('test_local', DRIVER)
+    add_device('test_local', driver='test_local', connection='DEFAULT')
+
+    with socket.create_connection(('127.0.0.1', server.port)) as client_socket:
+        client_socket.settimeout(2)
+        send_message(client_socket, 'AUTOLAB?HOSTNAME=test')
+        assert recv_message(client_socket) == 'YES'
+        send_message(client_socket, {'command': 'subscribe', 'id': 1, 'rate': 10,
+                                     'element_address': 'test_local.value'})
+        assert recv_message(client_socket)['status'] == 'ok'
+        assert len(server._subscriptions) == 1
+
+        client_socket.sendall(COUNT.pack(1) + LENGTH.pack(5) + b'12345')
+        while True:  # until closed by the server
+            try: recv_message(client_socket)
+            except ConnectionError: break
+
+    # The client is closed properly: its subscriptions are removed
+    assert len(server._subscriptions) == 0
+    assert len(server.clients) == 0
+
+
+ARRAY_DRIVER = '''
+import numpy as np
+
+class Driver():
+
+    def __init__(self):
+        self.array = np.random.rand(1_000_000)  # 8 MB
+
+    def get_value(self) -> float:
+        return 1.
+
+    def get_array(self) -> np.ndarray:
+        return self.array
+
+    def get_driver_model(self):
+        return [{'element': 'variable', 'name': 'value', 'type': float,
+                 'read': self.get_value},
+                {'element': 'variable', 'name': 'array', 'type': np.ndarray,
+                 'read': self.get_array}]
+
+class Driver_DEFAULT(Driver):
+    pass
+'''
+
+
+def test_loopback_throughput(server, add_driver, add_device):
+    """ Requests per second for small values, MB/s for large arrays """
+    from autolab.core.server import AsyncClient
+
+    add_driver('test_array', ARRAY_DRIVER)
+    add_device('test_array', driver='test_array', connection='DEFAULT')
+
+    async def main():
+        async with AsyncClient('127.0.0.1', server.port) as client:
+            array = await client.execute('test_array.array', 'read')
+
+            N = 500
+            t = time.perf_counter()
+            for _ in range(N): await client.execute('test_array.value', 'read')
+            requests_rate = N / (time.perf_counter() - t)
+
+            M = 20
+            t = time.perf_counter()
+            for _ in range(M): received = await client.execute('test_array.array', 'read')
+            array_rate = M * array.nbytes / 1e6 / (time.perf_counter() - t)
+            return array, received, requests_rate, array_rate
+
+    array, received, requests_rate, array_rate = asyncio.run(main())
+
+    assert received.nbytes == 8_000_000
+    assert (received == array).all()
+    assert requests_rate > 500  # requests/s, one at a time
+    assert array_rate > 100  # MB/s
+
+
+def test_server_close_closes_clients_once(capsys):
+    from autolab.core.server import Server, send_message, recv_message
+
+    server = Server(port=0, background=True)
+    assert server.host == '127.0.0.1'  # not exposed unless requested
+
+    with socket.create_connection(('127.0.0.1', server.port)) as client_socket:
+        client_socket.settimeout(2)
+        send_message(client_socket, 'AUTOLAB?HOSTNAME=test')
+        assert recv_message(client_socket) == 'YES'
+        client, = server.clients
+        server.close()
+
+    assert client.closed
+    assert capsys.readouterr().out.count('Host "test" disconnected') == 1
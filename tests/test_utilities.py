@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities: parameter space of a scan
+
+@author: autolab
+"""
+
+from itertools import product
+
+import numpy as np
+import pytest
+
+from autolab.core.utilities import ParameterSpace
+
+
+def test_parameter_space_matches_iteration():
+    values_list = [np.linspace(0, 1, 3), [10, 20], range(4)]
+    space = ParameterSpace(values_list)
+    points = list(space)
+
+    assert len(space) == len(points) == 3 * 2 * 4
+    assert points == list(product(*values_list))
+    for index, point in enumerate(points):
+        assert space[index] == point
+        assert space.unravel(index) == tuple(
+            int(i) for i in np.unravel_index(index, space.shape))
+    assert space[-1] == points[-1]
+    with pytest.raises(IndexError): space[len(space)]
+
+
+def test_parameter_space_keeps_value_types():
+    space = ParameterSpace([[1, 'a', 2.5], (x for x in [True, None])],
+                           names=['x', 'y'])
+
+    assert space[2] == ('a', True)
+    assert type(space[0][0]) is int and space[5] == (2.5, None)
+    assert space.as_dict(1) == {'x': 1, 'y': None}
+    assert list(space) == list(product([1, 'a', 2.5], [True, None]))
+
+
+def test_parameter_space_without_parameter():
+    space = ParameterSpace([])
+    assert len(space) == 1
+    assert list(space) == [()] and space[0] == ()
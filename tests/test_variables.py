@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Variables and $eval: expressions
+
+@author: autolab
+"""
+
+import time
+
+import pytest
+
+
+@pytest.fixture
+def variables():
+    from autolab.core import variables
+    yield variables
+    for name in list(variables.VARIABLES):
+        variables.remove_variable(name)
+
+
+def test_derived_value_is_cached(variables):
+    a = variables.set_variable('a', 2)
+    b = variables.set_variable('b', '$eval:a() * 3')
+    assert b() == 6
+    assert b._valid
+
+    a(5)
+    assert not b._valid
+    assert b() == 15
+
+
+def test_impure_expressions_are_not_cached(variables):
+    random = variables.set_variable('random', '$eval:np.random.rand()')
+    values = {random() for _ in range(5)}
+    assert len(values) == 5
+    assert not random._valid
+
+    a = variables.set_variable('a', 1)
+    noisy = variables.set_variable('noisy', '$eval:a() + np.random.rand()')
+    assert noisy() != noisy()
+    assert not noisy._valid
+
+    derived = variables.set_variable('derived', '$eval:random() + 1')
+    assert derived() != derived()
+
+
+def test_compiled_expressions_are_reused(variables, monkeypatch):
+    compiled = []
+
+    def counting_compile(*args, **kwargs):
+        compiled.append(args[0])
+        return compile(*args, **kwargs)
+
+    monkeypatch.setattr(variables, 'compile', counting_compile, raising=False)
+    namespace = variables.allowed_dict
+
+    a = variables.set_variable('a', 1)
+    noisy = variables.set_variable('noisy', '$eval:a() + np.random.rand() + 17')
+    for _ in range(100): noisy()
+    assert len(compiled) == 1
+
+    # Modifying an existing variable doesn't compile or rebuild anything
+    for i in range(100):
+        variables.set_variable('a', i)
+        variables.set_variable('noisy', '$eval:a() + np.random.rand() + 17')
+    assert len(compiled) == 1
+    assert variables.allowed_dict is namespace
+    assert 99 + 17 <= noisy() < 100 + 17
+
+
+def test_input_written_during_evaluation(variables, monkeypatch):
+    a = variables.set_variable('a', 1)
+    b = variables.set_variable('b', '$eval:a() + 1')
+    assert b() == 2
+    a(1)  # b is outdated
+
+    # a is written (by another thread) while b is evaluated
+    original = variables.Variable.__call__
+    def write_during_read(self, value=None):
+        result = original(self, value)
+        if self is a and value is None and a.raw == 1:
+            variables.set_variable('a', 10)
+        return result
+    monkeypatch.setattr(variables.Variable, '__call__', write_during_read)
+    assert b() == 2  # evaluated before the write
+    monkeypatch.undo()
+
+    assert not b._valid
+    assert b() == 11
+
+
+def test_derived_variable_read_time(variables):
+    """ Reading an up to date derived variable doesn't evaluate it again """
+    variables.set_variable('a', 2)
+    variables.set_variable('b', '$eval:a() * 3')
+    c = variables.set_variable('c', '$eval:b() + a() ** 2 - b() / a()')
+    expected = c()
+
+    N = 10000
+    t = time.perf_counter()
+    for _ in range(N): c()
+    cached = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for _ in range(N):
+        c._invalidate()  # as done when an input is written
+        c()
+    evaluated = time.perf_counter() - t
+
+    assert c() == expected
+    assert N / cached > 200000  # reads per second
+    assert cached < evaluated / 5